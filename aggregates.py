@@ -0,0 +1,203 @@
+"""Инкрементальные агрегаты по записям пользователя.
+
+Суммы хранятся в копейках (целые числа), поэтому добавление и откат
+записи взаимно обратны без накопления ошибки float.
+"""
+import math
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ledger import FLAG_INCOME, Record
+
+# Постоянная времени темпа накоплений: вклад записи убывает в e раз за 30 дней
+SAVINGS_TAU_DAYS = 30
+DAY = 86400
+
+
+def to_kopecks(amount: float) -> int:
+    """Переводит сумму в рублях в целое число копеек"""
+    return int(round(amount * 100))
+
+
+def _record_keys(record: Record) -> Tuple[str, str, int, date, Tuple[int, int]]:
+    moment = record.moment
+    return (
+        record.type,
+        record.category,
+        record.amount_kop,
+        moment.date(),
+        (moment.year, moment.month),
+    )
+
+
+def _bump(table: Dict, key, kop: int, sign: int):
+    # Значение - [сумма в копейках, количество записей]
+    entry = table.get(key)
+    if entry is None:
+        entry = table[key] = [0, 0]
+    entry[0] += sign * kop
+    entry[1] += sign
+    if entry[1] == 0:
+        del table[key]
+
+
+class SavingsRate:
+    """Экспоненциально взвешенные суммы доходов и расходов.
+
+    Вклад записи - сумма * exp(-(ref_ts - ts) / tau), где ref_ts - время
+    самой поздней записи. Суммы линейны по записям, поэтому удаление
+    записи вычитает ровно ее вклад, а темп в день получается делением
+    на вес наблюдаемого периода за O(1), без прохода по истории.
+    """
+
+    __slots__ = ("income", "expense", "ref_ts", "first_ts")
+
+    def __init__(self):
+        # Взвешенные суммы в копейках на момент ref_ts
+        self.income = 0.0
+        self.expense = 0.0
+        self.ref_ts: Optional[int] = None
+        self.first_ts: Optional[int] = None
+
+    def apply(self, ts: int, flags: int, kop: int, sign: int):
+        tau = SAVINGS_TAU_DAYS * DAY
+        if self.ref_ts is None:
+            self.ref_ts = self.first_ts = ts
+        elif ts > self.ref_ts:
+            decay = math.exp(-(ts - self.ref_ts) / tau)
+            self.income *= decay
+            self.expense *= decay
+            self.ref_ts = ts
+        if sign > 0 and ts < self.first_ts:
+            self.first_ts = ts
+        weighted = sign * kop * math.exp(-(self.ref_ts - ts) / tau)
+        if flags & FLAG_INCOME:
+            self.income += weighted
+        else:
+            self.expense += weighted
+
+    def at(self, now: float) -> Tuple[float, float]:
+        """Взвешенные суммы доходов и расходов, приведенные к моменту now"""
+        if self.ref_ts is None:
+            return 0.0, 0.0
+        decay = math.exp(-(now - self.ref_ts) / (SAVINGS_TAU_DAYS * DAY))
+        return self.income * decay, self.expense * decay
+
+    def _per_day(self, kop: float, now: float) -> float:
+        if self.ref_ts is None:
+            return 0.0
+        tau = SAVINGS_TAU_DAYS * DAY
+        decay = math.exp(-max(now - self.ref_ts, 0) / tau)
+        # Ровный поток r в день за период span дает сумму r * tau * (1 - exp(-span / tau)).
+        # Короткую историю считаем окном не меньше tau: зарплата, записанная
+        # сегодня, - доход за месяц, а не за один день
+        span = max(now - self.first_ts, tau)
+        weight_days = SAVINGS_TAU_DAYS * (1 - math.exp(-span / tau))
+        return kop * decay / weight_days / 100
+
+    def income_per_day(self, now: float) -> float:
+        """Средний доход в день в рублях, недавние дни весят больше"""
+        return self._per_day(self.income, now)
+
+    def net_per_day(self, now: float) -> float:
+        """Средние накопления (доход минус расход) в день в рублях"""
+        return self._per_day(self.income - self.expense, now)
+
+
+class UserAggregates:
+    """Итоги пользователя по типу, категории, дню и месяцу"""
+
+    __slots__ = ("count", "totals", "by_category", "by_day", "by_month", "by_month_category",
+                 "savings")
+
+    def __init__(self):
+        self.count = 0
+        self.totals: Dict[str, List[int]] = {}
+        self.by_category: Dict[Tuple[str, str], List[int]] = {}
+        self.by_day: Dict[Tuple[str, date], List[int]] = {}
+        self.by_month: Dict[Tuple[str, Tuple[int, int]], List[int]] = {}
+        # (тип, месяц) -> категория -> [сумма, количество]: разбивка месяца без прохода по записям
+        self.by_month_category: Dict[Tuple[str, Tuple[int, int]], Dict[str, List[int]]] = {}
+        self.savings = SavingsRate()
+
+    @classmethod
+    def from_records(cls, records: Iterable[Record]) -> "UserAggregates":
+        aggregates = cls()
+        for record in records:
+            aggregates.add(record)
+        return aggregates
+
+    def add(self, record: Record):
+        self._apply(record, 1)
+
+    def remove(self, record: Record):
+        self._apply(record, -1)
+
+    def _apply(self, record: Record, sign: int):
+        record_type, category, kop, day, month = _record_keys(record)
+        self.count += sign
+        _bump(self.totals, record_type, kop, sign)
+        _bump(self.by_category, (record_type, category), kop, sign)
+        _bump(self.by_day, (record_type, day), kop, sign)
+        _bump(self.by_month, (record_type, month), kop, sign)
+        month_categories = self.by_month_category.get((record_type, month))
+        if month_categories is None:
+            month_categories = self.by_month_category[(record_type, month)] = {}
+        _bump(month_categories, category, kop, sign)
+        if not month_categories:
+            del self.by_month_category[(record_type, month)]
+        if self.count:
+            self.savings.apply(record.ts, record.flags, kop, sign)
+        else:
+            # Записей не осталось - сбрасываем и накопленную погрешность float
+            self.savings = SavingsRate()
+
+    # --- Чтение (суммы возвращаются в рублях) ---
+
+    def total(self, record_type: str) -> float:
+        return self.totals.get(record_type, (0, 0))[0] / 100
+
+    def day_total(self, record_type: str, day: date) -> float:
+        return self.by_day.get((record_type, day), (0, 0))[0] / 100
+
+    def month_total(self, record_type: str, month: Tuple[int, int]) -> float:
+        return self.by_month.get((record_type, month), (0, 0))[0] / 100
+
+    def categories(self, record_type: str) -> Dict[str, float]:
+        return {
+            category: kop / 100
+            for (kind, category), (kop, _) in self.by_category.items()
+            if kind == record_type
+        }
+
+    def month_categories(self, record_type: str, month: Tuple[int, int]) -> Dict[str, float]:
+        return {
+            category: kop / 100
+            for category, (kop, _) in self.by_month_category.get((record_type, month), {}).items()
+        }
+
+    def months(self) -> List[Tuple[int, int]]:
+        """Месяцы с записями, от новых к старым"""
+        return sorted({month for _, month in self.by_month}, reverse=True)
+
+
+def check_consistency(records: Iterable[Record], aggregates: UserAggregates) -> List[str]:
+    """Пересчитывает агрегаты с нуля и возвращает список расхождений"""
+    expected = UserAggregates.from_records(records)
+    problems = []
+    if expected.count != aggregates.count:
+        problems.append(f"count: {aggregates.count} != {expected.count}")
+    for name in ("totals", "by_category", "by_day", "by_month", "by_month_category"):
+        actual_table = getattr(aggregates, name)
+        expected_table = getattr(expected, name)
+        for key in expected_table.keys() | actual_table.keys():
+            actual = actual_table.get(key)
+            wanted = expected_table.get(key)
+            if actual != wanted:
+                problems.append(f"{name}[{key}]: {actual} != {wanted}")
+    moment = max(aggregates.savings.ref_ts or 0, expected.savings.ref_ts or 0)
+    for name, actual, wanted in zip(("income", "expense"), aggregates.savings.at(moment),
+                                    expected.savings.at(moment)):
+        if not math.isclose(actual, wanted, rel_tol=1e-6, abs_tol=1e-3):
+            problems.append(f"savings.{name}: {actual} != {wanted}")
+    return problems
@@ -0,0 +1,192 @@
+"""Аналитика по истории пользователя: тренды, месяцы, категории, дни недели.
+
+Колонки Ledger превращаются в массивы NumPy, и все группировки
+делаются без цикла по записям: номер локального дня - searchsorted по
+границам суток, суммы по дням, категориям и дням недели - bincount,
+по месяцам - add.reduceat по непрерывным отрезкам дней, скользящие
+средние - разности накопленных сумм. Без NumPy те же отчеты считаются
+обычным циклом, только медленнее.
+
+Колонки копируются в потоке event loop (compute_* можно вызывать в
+рабочем потоке: копии уже никто не меняет).
+"""
+from array import array
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ledger import FLAG_INCOME, Ledger, categories, day_start
+
+try:
+    import numpy as np
+except ImportError:  # аналитика работает и без NumPy, но медленнее
+    np = None
+
+# Сколько дней скользящей средней за 7 дней показывать в отчете
+ROLLING_DAYS = 60
+# Окно сравнения категорий и средних
+WINDOW = 30
+
+
+class Columns(NamedTuple):
+    ts: array
+    amounts: array
+    flags: array
+    category_ids: array
+
+
+class Trend(NamedTuple):
+    today: date
+    months: List[Tuple[int, int]]  # от старых к новым
+    month_income: List[float]
+    month_expense: List[float]
+    weekday_avg: List[float]  # средний расход по дням недели, пн..вс
+    avg7: float  # средний расход в день за последние 7 дней
+    avg30: float
+    prev_avg30: float  # то же за 30 дней перед этим
+    categories_30: Dict[str, float]
+    categories_prev30: Dict[str, float]
+    rolling7: List[float]  # скользящее среднее за 7 дней, последние ROLLING_DAYS дней
+
+
+def copy_columns(ledger: Ledger) -> Columns:
+    """Копии колонок; вызывать в потоке event loop"""
+    return Columns(ledger.ts[:], ledger.amounts[:], ledger.flags[:], ledger.category_ids[:])
+
+
+def _day_bounds(first: date, days: int) -> List[int]:
+    """Начала days + 1 локальных суток подряд (с учетом перевода часов)"""
+    return [day_start(first + timedelta(days=offset)) for offset in range(days + 1)]
+
+
+def _calendar(first: date, days: int):
+    """Для каждого дня: индекс месяца, список месяцев и день недели"""
+    month_of_day, months, weekday_of_day = [], [], []
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        key = (day.year, day.month)
+        if not months or months[-1] != key:
+            months.append(key)
+        month_of_day.append(len(months) - 1)
+        weekday_of_day.append(day.weekday())
+    return month_of_day, months, weekday_of_day
+
+
+def _window_avg(cumulative, end: int, length: int) -> float:
+    """Средний расход в день за length дней, заканчивающихся днем end - 1"""
+    start = max(end - length, 0)
+    return (cumulative[end] - cumulative[start]) / length / 100
+
+
+def compute_trend(columns: Columns, today: date) -> Optional[Trend]:
+    if not len(columns.ts):
+        return None
+    first = min(date.fromtimestamp(min(columns.ts)), today - timedelta(days=2 * WINDOW))
+    last = max(date.fromtimestamp(max(columns.ts)), today)
+    days = (last - first).days + 1
+    bounds = _day_bounds(first, days)
+    month_of_day, months, weekday_of_day = _calendar(first, days)
+    if np is not None:
+        return _trend_numpy(columns, today, first, days, bounds, month_of_day, months, weekday_of_day)
+    return _trend_python(columns, today, first, days, bounds, month_of_day, months, weekday_of_day)
+
+
+def _trend_numpy(columns, today, first, days, bounds, month_of_day, months, weekday_of_day):
+    ts = np.frombuffer(columns.ts, dtype=np.int64)
+    amounts = np.frombuffer(columns.amounts, dtype=np.int64).astype(np.float64)
+    is_income = (np.frombuffer(columns.flags, dtype=np.uint8) & FLAG_INCOME).astype(bool)
+    category_ids = np.frombuffer(columns.category_ids, dtype=np.uint32)
+    expense = np.where(is_income, 0.0, amounts)
+    income = amounts - expense
+
+    day = np.searchsorted(np.asarray(bounds, dtype=np.int64), ts, side="right") - 1
+    daily_expense = np.bincount(day, weights=expense, minlength=days)
+    daily_income = np.bincount(day, weights=income, minlength=days)
+
+    # Дни идут подряд, поэтому месяц - непрерывный отрезок: reduceat по его началам
+    month_of_day = np.asarray(month_of_day)
+    month_starts = np.flatnonzero(np.r_[True, month_of_day[1:] != month_of_day[:-1]])
+    month_expense = np.add.reduceat(daily_expense, month_starts) / 100
+    month_income = np.add.reduceat(daily_income, month_starts) / 100
+
+    weekday_of_day = np.asarray(weekday_of_day)
+    weekday_sum = np.bincount(weekday_of_day, weights=daily_expense, minlength=7)
+    weekday_days = np.bincount(weekday_of_day, minlength=7)
+    weekday_avg = weekday_sum / np.maximum(weekday_days, 1) / 100
+
+    end = (today - first).days + 1
+    cumulative = np.concatenate(([0.0], np.cumsum(daily_expense)))
+    rolling7 = (cumulative[7:] - cumulative[:-7]) / 7 / 100
+    rolling_end = end - 7 + 1
+
+    def window_categories(start_day: int, stop_day: int) -> Dict[str, float]:
+        mask = (day >= start_day) & (day < stop_day) & ~is_income
+        sums = np.bincount(category_ids[mask], weights=amounts[mask])
+        return {categories.name(int(i)): float(sums[i]) / 100 for i in np.flatnonzero(sums)}
+
+    return Trend(
+        today=today,
+        months=months,
+        month_income=month_income.tolist(),
+        month_expense=month_expense.tolist(),
+        weekday_avg=weekday_avg.tolist(),
+        avg7=float(_window_avg(cumulative, end, 7)),
+        avg30=float(_window_avg(cumulative, end, WINDOW)),
+        prev_avg30=float(_window_avg(cumulative, end - WINDOW, WINDOW)),
+        categories_30=window_categories(end - WINDOW, end),
+        categories_prev30=window_categories(end - 2 * WINDOW, end - WINDOW),
+        rolling7=rolling7[max(rolling_end - ROLLING_DAYS, 0):rolling_end].tolist(),
+    )
+
+
+def _trend_python(columns, today, first, days, bounds, month_of_day, months, weekday_of_day):
+    from bisect import bisect_right
+
+    end = (today - first).days + 1
+    daily_expense = [0] * days
+    daily_income = [0] * days
+    categories_30: Dict[str, float] = {}
+    categories_prev30: Dict[str, float] = {}
+    for ts, amount, flags, category_id in zip(columns.ts, columns.amounts, columns.flags,
+                                              columns.category_ids):
+        day = bisect_right(bounds, ts) - 1
+        if flags & FLAG_INCOME:
+            daily_income[day] += amount
+            continue
+        daily_expense[day] += amount
+        if end - WINDOW <= day < end:
+            name = categories.name(category_id)
+            categories_30[name] = categories_30.get(name, 0) + amount
+        elif end - 2 * WINDOW <= day < end - WINDOW:
+            name = categories.name(category_id)
+            categories_prev30[name] = categories_prev30.get(name, 0) + amount
+
+    month_expense = [0.0] * len(months)
+    month_income = [0.0] * len(months)
+    weekday_sum = [0] * 7
+    weekday_days = [0] * 7
+    for day in range(days):
+        month_expense[month_of_day[day]] += daily_expense[day] / 100
+        month_income[month_of_day[day]] += daily_income[day] / 100
+        weekday_sum[weekday_of_day[day]] += daily_expense[day]
+        weekday_days[weekday_of_day[day]] += 1
+
+    cumulative = [0]
+    for value in daily_expense:
+        cumulative.append(cumulative[-1] + value)
+    rolling_end = end - 7 + 1
+    rolling7 = [(cumulative[i + 7] - cumulative[i]) / 7 / 100
+                for i in range(max(rolling_end - ROLLING_DAYS, 0), rolling_end)]
+
+    return Trend(
+        today=today,
+        months=months,
+        month_income=month_income,
+        month_expense=month_expense,
+        weekday_avg=[weekday_sum[i] / max(weekday_days[i], 1) / 100 for i in range(7)],
+        avg7=_window_avg(cumulative, end, 7),
+        avg30=_window_avg(cumulative, end, WINDOW),
+        prev_avg30=_window_avg(cumulative, end - WINDOW, WINDOW),
+        categories_30={name: kop / 100 for name, kop in categories_30.items()},
+        categories_prev30={name: kop / 100 for name, kop in categories_prev30.items()},
+        rolling7=rolling7,
+    )
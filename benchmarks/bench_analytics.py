@@ -0,0 +1,109 @@
+"""Отчеты по истории: прежний цикл со strptime против analytics.
+
+Прежняя месячная статистика разбирала дату каждой записи strptime и
+складывала суммы в словарь по строковому ключу месяца. analytics
+считает весь отчет /trend (месяцы, категории, дни недели, скользящие
+средние) по колонкам Ledger: с NumPy - без цикла по записям, без
+NumPy - одним циклом. Суммы по месяцам сверяются между вариантами.
+
+Запуск: python benchmarks/bench_analytics.py [--sizes 100000 1000000 --years 3]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+from ledger import Ledger, type_flags  # noqa: E402
+
+CATEGORIES = ["Еда", "Транспорт", "Развлечения", "Покупки", "Здоровье", "Другое",
+              "Зарплата", "Подарок", "Инвестиции"]
+
+
+def synthetic_rows(count: int, years: int):
+    rnd = random.Random(42)
+    end = int(time.time())
+    start = end - years * 365 * 86400
+    for ts in sorted(rnd.randrange(start, end) for _ in range(count)):
+        record_type = "доход" if rnd.random() < 0.1 else "расход"
+        yield ts, record_type, rnd.choice(CATEGORIES), rnd.randint(100, 10_000_000)
+
+
+def build(count: int, years: int):
+    records, ledger = [], Ledger()
+    for ts, record_type, category, amount_kop in synthetic_rows(count, years):
+        # Прежний формат записей в user_data_store
+        records.append({
+            "type": record_type,
+            "category": category,
+            "amount": amount_kop / 100,
+            "date": datetime.fromtimestamp(ts).strftime("%d.%m.%Y %H:%M"),
+        })
+        ledger.append(ts, type_flags(record_type), category, amount_kop)
+    return records, ledger
+
+
+def old_monthly(records):
+    # Цикл из прежней monthly_statistics
+    monthly_data = {}
+    for record in records:
+        record_date = datetime.strptime(record['date'], "%d.%m.%Y %H:%M")
+        month_key = f"{record_date.year}-{record_date.month}"
+        if month_key not in monthly_data:
+            monthly_data[month_key] = {'доход': 0, 'расход': 0}
+        monthly_data[month_key][record['type']] += record['amount']
+    return monthly_data
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def trend(ledger: Ledger, today: date, use_numpy: bool):
+    saved = analytics.np
+    if not use_numpy:
+        analytics.np = None
+    try:
+        return analytics.compute_trend(analytics.copy_columns(ledger), today)
+    finally:
+        analytics.np = saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--years", type=int, default=3)
+    args = parser.parse_args()
+
+    today = date.today()
+    print(f"NumPy: {analytics.np.__version__ if analytics.np is not None else 'нет'}")
+    print(f"{'записей':>9} {'strptime (месяцы)':>18} {'python (/trend)':>16} {'numpy (/trend)':>15}")
+    for size in args.sizes:
+        records, ledger = build(size, args.years)
+        old_seconds, monthly = timed(old_monthly, records)
+        python_seconds, python_trend = timed(trend, ledger, today, False)
+        numpy_seconds, numpy_trend = (timed(trend, ledger, today, True)
+                                      if analytics.np is not None else (None, None))
+
+        for result in (python_trend, numpy_trend):
+            if result is None:
+                continue
+            for (year, month), expense in zip(result.months, result.month_expense):
+                expected = monthly.get(f"{year}-{month}", {}).get("расход", 0)
+                assert math.isclose(expected, expense, rel_tol=1e-9, abs_tol=0.01), (year, month)
+
+        numpy_column = f"{numpy_seconds * 1000:12.0f} мс" if numpy_seconds is not None else f"{'-':>15}"
+        print(f"{size:>9} {old_seconds * 1000:15.0f} мс {python_seconds * 1000:13.0f} мс {numpy_column}",
+              flush=True)
+        del records, ledger
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Графики в секунду при одновременных запросах.
+
+Каждый запрос - столбцы по месяцам для своего пользователя (разные
+данные, кэш не помогает). Сравниваются рисование прямо в event loop и
+ChartRenderer с пулом процессов разного размера. Кроме пропускной
+способности замеряется задержка event loop: фоновая задача каждые
+10 мс проверяет, насколько позже срока она проснулась. Последняя
+строка - повторные запросы тех же графиков из кэша.
+
+Запуск: python benchmarks/bench_charts.py [--charts 200 --concurrency 20 --workers 1 2 4]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import charts  # noqa: E402
+from render_cache import RenderCache  # noqa: E402
+
+TICK = 0.01
+LABELS = [f"{month:02d}.26" for month in range(1, 13)]
+
+
+def chart_args(number: int):
+    rnd = random.Random(number)
+    income = [rnd.uniform(50_000, 150_000) for _ in LABELS]
+    expense = [rnd.uniform(30_000, 120_000) for _ in LABELS]
+    return "Доходы и расходы по месяцам", LABELS, income, expense
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def run(count: int, concurrency: int, render) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+
+    async def one(number: int):
+        async with semaphore:
+            png = await render(number)
+            assert png.startswith(b"\x89PNG")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(number) for number in range(count)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return count / elapsed, max(lags, default=0) * 1000
+
+
+async def inline(number: int) -> bytes:
+    return charts.render_bars(*chart_args(number))
+
+
+async def main_async(args):
+    charts._warm_up()
+    await inline(0)
+    rate, lag = await run(args.charts, args.concurrency, inline)
+    print(f"{'в event loop':>16}: {rate:7.1f} графиков/с, макс. задержка loop {lag:7.1f} мс", flush=True)
+
+    for workers in args.workers:
+        renderer = charts.ChartRenderer(workers, RenderCache(max_bytes=0))
+
+        async def pooled(number: int, renderer=renderer) -> bytes:
+            return await renderer.render(("bench", number), 0, charts.render_bars,
+                                         lambda: chart_args(number))
+
+        # Прогрев: процессы пула запущены и импортировали matplotlib
+        await asyncio.gather(*(pooled(-1 - number) for number in range(workers)))
+        rate, lag = await run(args.charts, args.concurrency, pooled)
+        print(f"{f'пул {workers} проц.':>16}: {rate:7.1f} графиков/с, макс. задержка loop {lag:7.1f} мс",
+              flush=True)
+        renderer.shutdown()
+
+    renderer = charts.ChartRenderer(args.workers[0], RenderCache())
+
+    async def cached(number: int) -> bytes:
+        return await renderer.render(("bench", number % 10), 0, charts.render_bars,
+                                     lambda: chart_args(number % 10))
+
+    await asyncio.gather(*(cached(number) for number in range(10)))
+    rate, lag = await run(args.charts, args.concurrency, cached)
+    print(f"{'из кэша':>16}: {rate:7.0f} графиков/с, макс. задержка loop {lag:7.1f} мс")
+    renderer.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--charts", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    if not charts.available():
+        sys.exit("matplotlib не установлен")
+    print(f"ядер: {os.cpu_count()}")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Время до первого обновления после перезапуска.
+
+Готовит каталог бэкенда snapshot: снимок на --records записей и хвост
+журнала из --tail изменений. Затем в отдельном процессе замеряет
+загрузку хранилища и первую запись с отчетом для крупного
+пользователя (агрегаты строятся лениво, при первом обращении). Для
+сравнения так же замеряется SQLiteStorage на --sqlite-records записях.
+
+Запуск: python benchmarks/bench_cold_start.py [--records 10000000 --users 10000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTED = time.perf_counter()
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CATEGORIES = ["Еда", "Транспорт", "Развлечения", "Покупки", "Здоровье", "Другое", "Зарплата"]
+START_TS = 1_600_000_000
+
+
+def user_columns(user_id: int, count: int):
+    """Колонки синтетической истории пользователя без цикла по записям в Python-объектах"""
+    from array import array
+    ts = array("q", range(START_TS + user_id, START_TS + user_id + count * 3600, 3600))
+    amounts = array("q", ((i * 7919 + user_id) % 500_000 + 100 for i in range(count)))
+    flags = array("B", bytes((i % 10 == 0) for i in range(count)))
+    category_ids = array("I", (i % len(CATEGORIES) for i in range(count)))
+    return ts, amounts, flags, category_ids
+
+
+def prepare_snapshot(directory: str, records: int, users: int, tail: int):
+    from snapshot import encode_add, write_snapshot
+
+    per_user = records // users
+    columns = {user_id: user_columns(user_id, per_user) for user_id in range(users)}
+    meta = {"categories": CATEGORIES, "goals": {}, "subscriptions": {}, "digest": {}}
+    write_snapshot(os.path.join(directory, "snapshot.bin"), 1, columns, meta)
+    with open(os.path.join(directory, "log.1"), "wb") as f:
+        for number in range(tail):
+            f.write(encode_add(number % users, START_TS + 10**8 + number, 0, "Еда", 15000))
+
+
+def prepare_sqlite(path: str, records: int, users: int):
+    conn = sqlite3.connect(path)
+    from storage import SQLiteStorage
+    conn.executescript(SQLiteStorage.SCHEMA)
+    per_user = records // users
+    with conn:
+        for user_id in range(users):
+            ts, amounts, flags, category_ids = user_columns(user_id, per_user)
+            conn.executemany(
+                "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                ((user_id, seq, ts[seq], "доход" if flags[seq] else "расход",
+                  CATEGORIES[category_ids[seq]], amounts[seq]) for seq in range(per_user))
+            )
+    conn.close()
+
+
+def child(backend: str, path: str):
+    """Замер в чистом процессе: загрузка и первое обновление"""
+    import logging
+    logging.disable(logging.INFO)
+    from storage import create_storage
+
+    async def first_update():
+        started = time.perf_counter()
+        storage = create_storage(backend, path, snapshot_interval=0)
+        await storage.start()
+        loaded = time.perf_counter()
+        storage.add_record(0, "расход", "Еда", 150)
+        total = storage.get_aggregates(0).total("расход")
+        done = time.perf_counter()
+        result = {
+            "backend": backend,
+            "records": sum(len(records) for records in storage.records.values()),
+            "load_s": round(loaded - started, 3),
+            "first_update_s": round(done - loaded, 3),
+            "time_to_first_update_s": round(done - STARTED, 3),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "check": total > 0,
+        }
+        # Хранилище не закрываем: снимок при остановке к замеру не относится
+        return result
+
+    print(json.dumps(asyncio.run(first_update())))
+
+
+def measure(backend: str, path: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", backend, path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--tail", type=int, default=100_000, help="изменений в журнале после снимка")
+    parser.add_argument("--sqlite-records", type=int, default=1_000_000, help="0 - не сравнивать")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="cold_start_")
+    try:
+        snapshot_dir = os.path.join(workdir, "snapshot")
+        os.makedirs(snapshot_dir)
+        started = time.perf_counter()
+        prepare_snapshot(snapshot_dir, args.records, args.users, args.tail)
+        size = os.path.getsize(os.path.join(snapshot_dir, "snapshot.bin"))
+        print(f"снимок: {args.records} записей, {size / 2**20:.0f} МБ, "
+              f"подготовка {time.perf_counter() - started:.1f} с", flush=True)
+        results = [measure("snapshot", snapshot_dir)]
+
+        if args.sqlite_records:
+            db_path = os.path.join(workdir, "bench.db")
+            prepare_sqlite(db_path, args.sqlite_records, args.users)
+            results.append(measure("sqlite", db_path))
+
+        for result in results:
+            print(f"{result['backend']:>9}: {result['records']:>10} записей, загрузка {result['load_s']} с, "
+                  f"первое обновление {result['first_update_s']} с, "
+                  f"до первого обновления {result['time_to_first_update_s']} с, "
+                  f"пик RSS {result['max_rss_mb']} МБ")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
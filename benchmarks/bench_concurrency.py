@@ -0,0 +1,83 @@
+"""Задержка обработки при смешанной нагрузке: последовательно против
+UserOrderedUpdateProcessor.
+
+Обработчики моделируются ожиданием: быстрые - как один запрос к Bot
+API, медленные - как экспорт или тяжелая статистика. Заодно
+проверяется, что порядок обновлений каждого пользователя сохранен.
+
+Запуск: python benchmarks/bench_concurrency.py [--users 200 --updates 5000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from concurrency import UserOrderedUpdateProcessor  # noqa: E402
+
+
+def make_load(users: int, updates: int, slow_share: float, seed: int = 1):
+    rnd = random.Random(seed)
+    load = []
+    for number in range(updates):
+        user_id = rnd.randrange(users)
+        duration = 0.3 if rnd.random() < slow_share else 0.005
+        load.append((number, user_id, duration))
+    return load
+
+
+async def run(load, max_concurrent: int, rate: float):
+    processor = UserOrderedUpdateProcessor(max_concurrent)
+    latencies = []
+    seen = {}
+    ordered = True
+
+    async def handler(number, user_id, duration, arrived):
+        nonlocal ordered
+        if seen.get(user_id, -1) > number:
+            ordered = False
+        seen[user_id] = number
+        await asyncio.sleep(duration)
+        latencies.append(time.perf_counter() - arrived)
+
+    # Как Application: задача на каждое обновление в порядке поступления
+    tasks = []
+    for number, user_id, duration in load:
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+        coroutine = handler(number, user_id, duration, time.perf_counter())
+        tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "ordered": ordered,
+        "locks_left": len(processor.user_locks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=300, help="обновлений в секунду")
+    parser.add_argument("--slow-share", type=float, default=0.02)
+    args = parser.parse_args()
+
+    load = make_load(args.users, args.updates, args.slow_share)
+    for label, concurrent in (("последовательно", 1), ("по пользователям", 64)):
+        result = asyncio.run(run(load, concurrent, args.rate))
+        print(f"{label:>17}: p50 {result['p50'] * 1000:8.1f} мс, p99 {result['p99'] * 1000:8.1f} мс, "
+              f"порядок {'сохранен' if result['ordered'] else 'НАРУШЕН'}, "
+              f"замков осталось {result['locks_left']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Пиковая память и время экспорта: прежний StringIO/BytesIO против потокового.
+
+Каждый замер идет в отдельном процессе, чтобы ru_maxrss не смешивался.
+Запуск: python benchmarks/bench_export.py [--sizes 100000 1000000]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_ledger_memory import build_ledger  # noqa: E402
+from export import take_snapshot, write_export  # noqa: E402
+
+
+def export_old(ledger):
+    # Копия прежней реализации export_data
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Дата', 'Тип', 'Категория', 'Сумма'])
+    for record in ledger.iter_records():
+        writer.writerow([record.date, record.type, record.category, f"{record.amount:.2f}"])
+    output.seek(0)
+    csv_file = io.BytesIO(output.getvalue().encode('utf-8'))
+    return len(csv_file.getvalue())
+
+
+def export_new(ledger, compression):
+    spool = write_export(take_snapshot(ledger), "bench.csv", compression)
+    spool.seek(0, os.SEEK_END)
+    size = spool.tell()
+    spool.close()
+    return size
+
+
+def run_case(mode: str, count: int):
+    ledger = build_ledger(count)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if mode == "old":
+        size = export_old(ledger)
+    else:
+        size = export_new(ledger, None if mode == "stream" else mode.split("-")[1])
+    elapsed = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "mode": mode, "rows": count, "seconds": round(elapsed, 3),
+        "peak_rss_delta_mb": round((peak_rss - base_rss) / 1024, 1),
+        "file_mb": round(size / 2**20, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--case", nargs=2, metavar=("MODE", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case[0], int(args.case[1]))
+        return
+
+    print(f"{'режим':>10} {'строк':>9} {'сек':>7} {'+RSS, МБ':>9} {'файл, МБ':>9}")
+    for count in args.sizes:
+        for mode in ("old", "stream", "stream-gz", "stream-zip"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--case", mode, str(count)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            print(f"{mode:>10} {count:>9} {result['seconds']:>7.2f} "
+                  f"{result['peak_rss_delta_mb']:>9.1f} {result['file_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
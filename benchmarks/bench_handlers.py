@@ -0,0 +1,169 @@
+"""Время обработчиков отчетов на синтетических историях разного размера.
+
+Замеряются show_statistics, monthly_statistics, show_quick_stats,
+show_history, trend_command и export_data с поддельным Update: ответы не уходят в
+Telegram, а только запоминаются. Кэш отчетов по умолчанию выключен,
+чтобы мерить сам рендер; --warm оставляет его включенным.
+
+Результат - медиана по повторам в миллисекундах, пишется в JSON
+(--out). С --compare старый JSON сравнивается с текущим прогоном, и
+при замедлении больше --threshold скрипт завершается с кодом 1.
+
+Запуск: python benchmarks/bench_handlers.py [--sizes 1000 10000 100000 1000000]
+            [--out bench.json] [--compare baseline.json --threshold 0.2]
+            [--warm] [--min-delta 0.05]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import main as bot  # noqa: E402
+from bench_ledger_memory import build_ledger  # noqa: E402
+from render_cache import RenderCache  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+USER_ID = 1
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+class FakeMessage:
+    """Сообщение, которое только запоминает ответы"""
+
+    def __init__(self):
+        self.replies = 0
+
+    async def reply_text(self, text, **kwargs):
+        self.replies += 1
+
+    async def reply_document(self, document, **kwargs):
+        self.replies += 1
+
+
+def fake_update():
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=USER_ID),
+        effective_chat=SimpleNamespace(id=USER_ID),
+        message=FakeMessage(),
+    )
+
+
+def fake_context(args=None):
+    return SimpleNamespace(args=args or [], user_data={})
+
+
+HANDLERS = {
+    "show_statistics": lambda update: bot.show_statistics(update, fake_context()),
+    "monthly_statistics": lambda update: bot.monthly_statistics(update, fake_context()),
+    "show_quick_stats": lambda update: bot.show_quick_stats(update, USER_ID),
+    "show_history": lambda update: bot.show_history(update, fake_context()),
+    "trend_command": lambda update: bot.trend_command(update, fake_context()),
+    "export_data": lambda update: bot.export_data(update, fake_context()),
+}
+
+
+def prepare(size: int, warm: bool):
+    """Подменяет хранилище бота историей из size записей"""
+    bot.storage = MemoryStorage()
+    bot.storage.records[USER_ID] = build_ledger(size)
+    bot.storage.rebuild_aggregates()
+    # Нулевой объем - каждая запись сразу вытесняется, рендер идет всегда
+    bot.render_cache = RenderCache() if warm else RenderCache(max_bytes=0)
+
+
+async def time_handler(name: str, repeat: int) -> float:
+    handler = HANDLERS[name]
+    # Первый вызов - прогрев (ленивый индекс, импорты)
+    await handler(fake_update())
+    timings = []
+    for _ in range(repeat):
+        update = fake_update()
+        started = time.perf_counter()
+        await handler(update)
+        timings.append(time.perf_counter() - started)
+        assert update.message.replies, f"{name} ничего не ответил"
+    return statistics.median(timings) * 1000
+
+
+def run(sizes, handlers, repeat: int, warm: bool) -> Dict:
+    results: Dict[str, Dict[str, float]] = {name: {} for name in handlers}
+    for size in sizes:
+        prepare(size, warm)
+        for name in handlers:
+            # На больших историях медленные обработчики повторяем реже
+            runs = max(1, repeat // max(1, size // 100_000))
+            results[name][str(size)] = round(asyncio.run(time_handler(name, runs)), 3)
+            print(f"{name:>20} {size:>9}: {results[name][str(size)]:10.3f} мс", flush=True)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "warm": warm,
+        "results": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float, min_delta: float) -> bool:
+    """Печатает сравнение; True, если есть замедление больше порога.
+
+    Разница меньше min_delta мс не считается: на микросекундных
+    замерах относительный шум велик.
+    """
+    regressed = False
+    print(f"\n{'обработчик':>20} {'размер':>9} {'было, мс':>10} {'стало, мс':>10} {'изм.':>8}")
+    for name, by_size in current["results"].items():
+        for size, value in by_size.items():
+            old = baseline.get("results", {}).get(name, {}).get(size)
+            if old is None:
+                continue
+            change = (value - old) / old if old else 0.0
+            mark = ""
+            if change > threshold and value - old > min_delta:
+                mark = "  РЕГРЕССИЯ"
+                regressed = True
+            print(f"{name:>20} {size:>9} {old:10.3f} {value:10.3f} {change:+8.1%}{mark}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--handlers", nargs="+", choices=list(HANDLERS), default=list(HANDLERS))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warm", action="store_true", help="не выключать кэш отчетов")
+    parser.add_argument("--out", help="записать результат в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="допустимое замедление, доля (0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="минимальная значимая разница, мс")
+    args = parser.parse_args()
+
+    # Логи обработчиков в замере не нужны
+    logging.disable(logging.INFO)
+
+    current = run(args.sizes, args.handlers, args.repeat, args.warm)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, current, args.threshold, args.min_delta):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Сравнение памяти: список словарей против колоночного Ledger.
+
+Запуск: python benchmarks/bench_ledger_memory.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import Ledger, type_flags  # noqa: E402
+
+CATEGORIES = ["Еда", "Транспорт", "Развлечения", "Покупки", "Здоровье", "Другое",
+              "Зарплата", "Подарок", "Инвестиции"]
+START_TS = int(datetime(2020, 1, 1).timestamp())
+
+
+def synthetic_rows(count: int):
+    rnd = random.Random(42)
+    ts = START_TS
+    for _ in range(count):
+        ts += rnd.randint(60, 6 * 3600)
+        record_type = "доход" if rnd.random() < 0.1 else "расход"
+        yield ts, record_type, rnd.choice(CATEGORIES), rnd.randint(100, 10_000_000)
+
+
+def build_dicts(count: int):
+    # Прежний формат записей в user_data_store
+    records = []
+    for ts, record_type, category, amount_kop in synthetic_rows(count):
+        moment = datetime.fromtimestamp(ts)
+        records.append({
+            "type": record_type,
+            "category": category,
+            "amount": amount_kop / 100,
+            "date": moment.strftime("%d.%m.%Y %H:%M"),
+            "timestamp": moment.isoformat()
+        })
+    return records
+
+
+def build_ledger(count: int):
+    ledger = Ledger()
+    for ts, record_type, category, amount_kop in synthetic_rows(count):
+        ledger.append(ts, type_flags(record_type), category, amount_kop)
+    return ledger
+
+
+def measure(builder, count: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    data = builder(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'записей':>10} {'dict, МБ':>10} {'ledger, МБ':>11} {'байт/запись':>18} {'выигрыш':>8}")
+    for count in args.sizes:
+        dict_bytes = measure(build_dicts, count)
+        ledger_bytes = measure(build_ledger, count)
+        print(
+            f"{count:>10} {dict_bytes / 2**20:>10.1f} {ledger_bytes / 2**20:>11.2f} "
+            f"{dict_bytes / count:>8.0f} -> {ledger_bytes / count:>5.1f} "
+            f"{dict_bytes / ledger_bytes:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Пропускная способность при разном числе процессов-шардов.
+
+Поднимает заглушку Bot API, запускает ShardPool с main.run_shard и
+раздает через него синтетические обновления (запись расхода и
+статистика вперемешку). Обновление считается обработанным, когда
+шард отправил ответ в заглушку. Прирост с числом шардов ограничен
+числом ядер машины.
+
+Запуск: python benchmarks/bench_sharding.py [--shards 1 2 4 --updates 20000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_bot_api import FakeBotAPI, text_update  # noqa: E402
+
+TEXTS = ["/ex 250 кофе", "📊 Статистика"]
+
+
+async def wait_replies(fake: FakeBotAPI, expected: int, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while fake.counts.get("sendMessage", 0) < expected:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"получено {fake.counts.get('sendMessage', 0)} ответов из {expected}")
+        await asyncio.sleep(0.01)
+
+
+async def run(shards: int, updates: int, users: int) -> float:
+    fake = FakeBotAPI(keep_calls=False)
+    base_url = await fake.start()
+    # Шарды читают настройки из окружения при импорте main
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:SHARD",
+        "BOT_API_URL": base_url,
+        "STORAGE_BACKEND": "memory",
+        "METRICS_PORT": "0",
+    })
+    import main as bot
+    pool = bot.ShardPool(shards, bot.run_shard)
+    pool.start()
+    try:
+        # Прогрев: по обновлению на шард, ждем готовности всех процессов
+        for number in range(shards):
+            pool.dispatch(text_update(number + 1, number, "/start"))
+        await wait_replies(fake, shards, 120)
+
+        base = fake.counts["sendMessage"]
+        started = time.perf_counter()
+        for number in range(updates):
+            user_id = 1000 + number % users
+            pool.dispatch(text_update(shards + number + 1, user_id, TEXTS[number // users % len(TEXTS)]))
+            if number % 1000 == 999:
+                # Не даем фронту уйти далеко вперед очередей
+                await asyncio.sleep(0)
+        await wait_replies(fake, base + updates, 600)
+        elapsed = time.perf_counter() - started
+    finally:
+        await asyncio.to_thread(pool.stop)
+        await fake.stop()
+    return updates / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    print(f"ядер: {os.cpu_count()}")
+    baseline = None
+    for shards in args.shards:
+        rate = asyncio.run(run(shards, args.updates, args.users))
+        baseline = baseline or rate
+        print(f"шардов {shards}: {rate:8.0f} обн/с, x{rate / baseline:.2f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
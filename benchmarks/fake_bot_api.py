@@ -0,0 +1,157 @@
+"""Локальная заглушка Bot API для тестов без обращения к Telegram.
+
+Отвечает на любой метод правдоподобным результатом и записывает
+вызовы. Приложение направляется сюда через BOT_API_URL или
+build_application(base_url=...).
+
+Отдельный запуск: python benchmarks/fake_bot_api.py --port 8081
+и затем BOT_API_URL=http://127.0.0.1:8081/bot python main.py
+"""
+import argparse
+import asyncio
+import email
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from httpserver import Request, Response, json_response, serve  # noqa: E402
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Finance", "username": "finance_test_bot"}
+
+
+def _decode_value(value: str):
+    # PTB кодирует каждый параметр как JSON-строку
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def parse_params(request: Request) -> Dict:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        return json.loads(request.body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = email.message_from_bytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + request.body
+        )
+        params = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"filename": part.get_filename(),
+                                "size": len(part.get_payload(decode=True) or b"")}
+            else:
+                params[name] = _decode_value(part.get_payload(decode=True).decode("utf-8"))
+        return params
+    return {key: _decode_value(value)
+            for key, value in parse_qsl(request.body.decode("utf-8"), keep_blank_values=True)}
+
+
+def text_update(update_id: int, user_id: int, text: str) -> Dict:
+    """JSON обновления с текстовым сообщением пользователя"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+class FakeBotAPI:
+    """Заглушка Bot API, записывающая вызовы методов.
+
+    delay имитирует сетевую задержку ответа; при keep_calls=False
+    считаются только количества, без сохранения параметров.
+    """
+
+    def __init__(self, delay: float = 0.0, keep_calls: bool = True):
+        self.delay = delay
+        self.keep_calls = keep_calls
+        self.calls: List[Tuple[str, Dict]] = []
+        self.counts: Counter = Counter()
+        self._message_id = 0
+        self._server = None
+
+    def _message(self, params: Dict) -> Dict:
+        self._message_id += 1
+        chat_id = params.get("chat_id", 0)
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def _result(self, method: str, params: Dict):
+        if method == "getMe":
+            return BOT_USER
+        if method.startswith("send"):
+            return self._message(params)
+        if method == "editMessageText":
+            return self._message(params)
+        if method == "getFile":
+            return {"file_id": params.get("file_id"), "file_unique_id": "u", "file_size": 0}
+        if method == "getUpdates":
+            return []
+        return True
+
+    async def handle(self, request: Request) -> Response:
+        # Путь вида /bot<token>/<method>
+        method = request.path.rsplit("/", 1)[-1]
+        params = parse_params(request)
+        if self.keep_calls:
+            self.calls.append((method, params))
+        self.counts[method] += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return json_response({"ok": True, "result": self._result(method, params)})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запускает сервер и возвращает base_url для Application"""
+        self._server = await serve(self.handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/bot"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа, с")
+    args = parser.parse_args()
+
+    async def run():
+        fake = FakeBotAPI(delay=args.delay, keep_calls=False)
+        print("BOT_API_URL=" + await fake.start(args.host, args.port))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            print(dict(fake.counts))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
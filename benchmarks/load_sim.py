@@ -0,0 +1,155 @@
+"""Синтетическая нагрузка на бота через настоящие обработчики.
+
+Поднимает заглушку Bot API и прогоняет тысячи виртуальных
+пользователей по сценариям ConversationHandler: ввод расхода и
+дохода, быстрые расходы, /ex, статистика, история, экспорт. Обновления
+идут тем же путем, что и из polling/webhook - через update_processor.
+
+Отчет: обновлений в секунду, p50/p95/p99 задержки по шагам, прирост
+памяти и число вызовов Bot API. С --json результат пишется в файл,
+чтобы сравнивать сборки.
+
+Запуск: python benchmarks/load_sim.py [--users 2000 --steps 20]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main as bot  # noqa: E402
+from fake_bot_api import FakeBotAPI, text_update  # noqa: E402
+from telegram import Update  # noqa: E402
+
+TOKEN = "123456:LOAD"
+
+# Сценарии: (название шага, текст сообщения)
+SCENARIOS = {
+    "expense": [("expense:type", "💰 Расход"), ("expense:category", "🍔 Еда"),
+                ("expense:amount", "350"), ("expense:confirm", "✅ Да")],
+    "income": [("income:type", "💵 Доход"), ("income:category", "💼 Зарплата"),
+               ("income:amount", "50000"), ("income:confirm", "✅ Да")],
+    "quick": [("quick:menu", "/quick"), ("quick:button", "☕ Кофе 250")],
+    "ex": [("ex", "/ex 420 такси")],
+    "stats": [("stats", "📊 Статистика")],
+    "history": [("history", "📜 История")],
+    "export": [("export", "/export")],
+}
+# Вес сценария в смеси нагрузки
+WEIGHTS = {"expense": 30, "income": 5, "quick": 15, "ex": 20, "stats": 15, "history": 10, "export": 5}
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values: List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def simulate(users: int, steps: int, think: float, api_delay: float, seed: int) -> Dict:
+    rnd = random.Random(seed)
+    fake = FakeBotAPI(delay=api_delay, keep_calls=False)
+    base_url = await fake.start()
+    application = bot.build_application(TOKEN, base_url=base_url)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    update_ids = iter(range(1, 10**9))
+    names = list(WEIGHTS)
+    weights = [WEIGHTS[name] for name in names]
+
+    async def send(user_id: int, step: str, text: str):
+        update = Update.de_json(text_update(next(update_ids), user_id, text), application.bot)
+        started = time.perf_counter()
+        # Тот же путь, что и у обновлений из polling/webhook
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[step].append(time.perf_counter() - started)
+
+    async def virtual_user(user_id: int):
+        await send(user_id, "start", "/start")
+        for _ in range(steps):
+            scenario = rnd.choices(names, weights)[0]
+            for step, text in SCENARIOS[scenario]:
+                await send(user_id, step, text)
+                if think:
+                    await asyncio.sleep(rnd.expovariate(1 / think))
+
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(100000 + number) for number in range(users)))
+    elapsed = time.perf_counter() - started
+    rss_after = current_rss_mb()
+
+    await application.stop()
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    await fake.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "users": users,
+        "updates": len(all_latencies),
+        "seconds": round(elapsed, 2),
+        "updates_per_second": round(len(all_latencies) / elapsed, 1),
+        "latency_ms": {
+            step: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.50) * 1000, 2),
+                "p95": round(percentile(values, 0.95) * 1000, 2),
+                "p99": round(percentile(values, 0.99) * 1000, 2),
+            }
+            for step, values in sorted(latencies.items()) + [("all", all_latencies)]
+        },
+        "rss_growth_mb": round(rss_after - rss_before, 1),
+        "api_calls": dict(fake.counts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=20, help="сценариев на пользователя")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза между сообщениями, с")
+    parser.add_argument("--api-delay", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="записать результат в файл")
+    args = parser.parse_args()
+
+    # Лог каждого запроса к заглушке только мешает
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    result = asyncio.run(simulate(args.users, args.steps, args.think, args.api_delay, args.seed))
+
+    print(f"пользователей: {result['users']}, обновлений: {result['updates']}, "
+          f"{result['updates_per_second']} обн/с, прирост RSS {result['rss_growth_mb']} МБ")
+    print(f"{'шаг':>18} {'кол-во':>7} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8}")
+    for step, stats in result["latency_ms"].items():
+        print(f"{step:>18} {stats['count']:>7} {stats['p50']:>8} {stats['p95']:>8} {stats['p99']:>8}")
+    print("вызовы Bot API:", result["api_calls"])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Сквозная проверка webhook-режима без Telegram.
+
+Поднимает заглушку Bot API, запускает бота в режиме webhook и
+отправляет POST-ом записанные обновления (JSON по одному на строку).
+Без файла отправляет несколько встроенных примеров.
+
+Запуск: python benchmarks/replay_updates.py [--updates updates.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main as bot  # noqa: E402
+from fake_bot_api import FakeBotAPI, text_update  # noqa: E402
+from webhook import HEALTH_PATH, SECRET_HEADER, run_webhook  # noqa: E402
+
+TOKEN = "123456:TEST"
+SECRET = "replay-secret"
+
+
+def sample_updates(user_id: int = 1001):
+    texts = ["/start", "/ex 350 еда", "/ex 1500 транспорт", "📊 Статистика", "/history", "/undo"]
+    for number, text in enumerate(texts, 1):
+        yield text_update(number, user_id, text)
+
+
+async def replay(updates, port: int):
+    fake = FakeBotAPI()
+    base_url = await fake.start()
+    application = bot.build_application(TOKEN, base_url=base_url)
+    stop = asyncio.Event()
+    server = asyncio.create_task(run_webhook(
+        application, "127.0.0.1", port, "/telegram", secret_token=SECRET, stop=stop
+    ))
+
+    url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient() as client:
+        # Ждем, пока сервер поднимется
+        for _ in range(100):
+            try:
+                if (await client.get(url + HEALTH_PATH)).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+
+        forbidden = await client.post(url + "/telegram", json={"update_id": 0})
+        print(f"без секрета: HTTP {forbidden.status_code}")
+
+        statuses = []
+        for update in updates:
+            response = await client.post(url + "/telegram", json=update,
+                                         headers={SECRET_HEADER: SECRET})
+            statuses.append(response.status_code)
+        print(f"отправлено обновлений: {len(statuses)}, ответы: {sorted(set(statuses))}")
+
+        while application.update_queue.qsize():
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)
+        print("health:", (await client.get(url + HEALTH_PATH)).json())
+
+    stop.set()
+    await server
+    await fake.stop()
+
+    print("вызовы Bot API:", dict(fake.counts))
+    for method, params in fake.calls:
+        if method == "sendMessage":
+            print("  ->", params.get("chat_id"), params.get("text", "").splitlines()[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", help="файл с обновлениями, JSON по одному на строку")
+    parser.add_argument("--port", type=int, default=8787)
+    args = parser.parse_args()
+
+    if args.updates:
+        with open(args.updates, encoding="utf-8") as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = list(sample_updates())
+    asyncio.run(replay(updates, args.port))
+
+
+if __name__ == "__main__":
+    main()
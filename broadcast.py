@@ -0,0 +1,165 @@
+"""Массовая рассылка сообщений с учетом лимитов Bot API.
+
+Сообщения отправляет пул воркеров ограниченного размера. Общий
+token bucket держит глобальный лимит, отдельные bucket-ы - лимит на
+один чат. Временные ошибки повторяются с экспоненциальной задержкой,
+окончательные попадают в список dead letters, а рассылка продолжается.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: около 30 сообщений в секунду всего и 1 в секунду на чат
+GLOBAL_RATE = 25
+PER_CHAT_RATE = 1
+# Сколько последних недоставленных сообщений хранить
+DEAD_LETTER_LIMIT = 1000
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class OutgoingMessage(NamedTuple):
+    chat_id: int
+    text: str
+    parse_mode: Optional[str] = None
+
+
+class BroadcastReport(NamedTuple):
+    total: int
+    sent: int
+    failed: List[Tuple[int, str]]  # (chat_id, причина)
+    seconds: float
+
+
+class Broadcaster:
+    """Рассылка через пул воркеров с глобальным и початовым лимитом"""
+
+    def __init__(self, workers: int = 16, global_rate: float = GLOBAL_RATE,
+                 per_chat_rate: float = PER_CHAT_RATE, max_retries: int = 3,
+                 base_delay: float = 1.0):
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        # Сообщения, которые не удалось доставить: (сообщение, причина)
+        self.dead_letters: Deque[Tuple[OutgoingMessage, str]] = deque(maxlen=DEAD_LETTER_LIMIT)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    async def _send(self, bot, message: OutgoingMessage) -> Optional[str]:
+        """Отправляет одно сообщение; возвращает причину отказа или None"""
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(message.chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await bot.send_message(
+                    chat_id=message.chat_id,
+                    text=message.text,
+                    parse_mode=message.parse_mode
+                )
+                return None
+            except RetryAfter as e:
+                # Telegram сам говорит, сколько ждать
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                error = f"RetryAfter {delay}"
+                await asyncio.sleep(delay)
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован или чат не существует - повтор не поможет
+                return f"{type(e).__name__}: {e}"
+            except NetworkError as e:
+                error = f"{type(e).__name__}: {e}"
+                await asyncio.sleep(self.base_delay * 2 ** attempt * (1 + random.random()))
+        return error
+
+    async def broadcast(self, bot, messages: Iterable[OutgoingMessage],
+                        progress: Optional[Callable[[int, int], None]] = None,
+                        progress_every: int = 100) -> BroadcastReport:
+        """Рассылает сообщения и возвращает отчет; исключений не бросает"""
+        messages = list(messages)
+        started = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+
+        sent = 0
+        done = 0
+        failed: List[Tuple[int, str]] = []
+
+        async def worker():
+            nonlocal sent, done
+            while True:
+                try:
+                    message = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    error = await self._send(bot, message)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    logger.exception("Ошибка рассылки в чат %s", message.chat_id)
+                if error is None:
+                    sent += 1
+                else:
+                    failed.append((message.chat_id, error))
+                    self.dead_letters.append((message, error))
+                done += 1
+                if progress is not None and (done % progress_every == 0 or done == len(messages)):
+                    progress(done, len(messages))
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(messages)))))
+
+        # Забываем чаты, чьи bucket-ы уже полностью восстановились
+        for chat_id in [c for c, bucket in self.chat_buckets.items() if bucket.idle()]:
+            del self.chat_buckets[chat_id]
+
+        report = BroadcastReport(len(messages), sent, failed, time.monotonic() - started)
+        logger.info(
+            "Рассылка: отправлено %d из %d за %.1f с, ошибок %d",
+            report.sent, report.total, report.seconds, len(report.failed)
+        )
+        return report
+
+
+def log_progress(done: int, total: int):
+    logger.info("Рассылка: %d/%d", done, total)
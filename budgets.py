@@ -0,0 +1,147 @@
+"""Бюджеты по категориям расходов.
+
+Бюджет - лимит расходов категории за день, неделю или месяц. Для
+каждого бюджета держится счетчик потраченного в текущем окне периода:
+новая запись или ее отмена меняет его за O(1), а при переходе через
+границу периода счетчик просто начинается с нуля, без прохода по
+записям. Записи читаются только при первом обращении к бюджету
+(после /budget или перезапуска) - один проход по позициям категории.
+
+Категории сравниваются без эмодзи и регистра: "🍔 Еда" из меню и
+"Еда" из быстрой записи попадают в один бюджет.
+"""
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ledger import FLAG_INCOME, Ledger, Record, categories, day_start
+
+# Пороги уведомлений по умолчанию, проценты лимита
+DEFAULT_THRESHOLDS = (80, 100)
+
+PERIODS = {"day": "в день", "week": "в неделю", "month": "в месяц"}
+PERIOD_ALIASES = {
+    "day": "day", "d": "day", "день": "day", "д": "day",
+    "week": "week", "w": "week", "неделя": "week", "нед": "week",
+    "month": "month", "m": "month", "месяц": "month", "мес": "month",
+}
+
+
+@lru_cache(maxsize=1024)
+def category_key(category: str) -> str:
+    """Название категории без эмодзи и регистра"""
+    return " ".join("".join(ch for ch in category if ch.isalnum() or ch.isspace()).split()).lower()
+
+
+def period_window(period: str, ts: int) -> Tuple[int, int]:
+    """Полуинтервал [начало, конец) периода, содержащего момент ts"""
+    day = datetime.fromtimestamp(ts).date()
+    if period == "day":
+        first, following = day, day + timedelta(days=1)
+    elif period == "week":
+        first = day - timedelta(days=day.weekday())
+        following = first + timedelta(days=7)
+    elif period == "month":
+        first = day.replace(day=1)
+        following = date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+    else:
+        raise ValueError(f"неизвестный период {period!r}")
+    return day_start(first), day_start(following)
+
+
+def crossed(limit_kop: int, before: int, after: int, thresholds: Iterable[int]) -> List[int]:
+    """Пороги (в процентах лимита), пройденные при росте траты с before до after"""
+    return [
+        percent for percent in thresholds
+        if before * 100 < percent * limit_kop <= after * 100
+    ]
+
+
+class Counter:
+    """Потрачено по бюджету в окне [start, end)"""
+
+    __slots__ = ("start", "end", "spent")
+
+    def __init__(self, start: int, end: int, spent: int = 0):
+        self.start = start
+        self.end = end
+        self.spent = spent
+
+
+class Status(NamedTuple):
+    category: str
+    period: str
+    limit_kop: int
+    spent_kop: int
+
+    @property
+    def percent(self) -> float:
+        return self.spent_kop * 100 / self.limit_kop if self.limit_kop else 0.0
+
+
+class BudgetTracker:
+    """Счетчики бюджетов одного пользователя.
+
+    budgets - сохраняемые настройки: ключ категории -> {"category",
+    "limit" (копейки), "period"}. Счетчики живут только в памяти.
+    """
+
+    def __init__(self, budgets: Dict[str, Dict]):
+        self.budgets = budgets
+        self.counters: Dict[str, Counter] = {}
+
+    def apply(self, record: Record, sign: int):
+        """Учитывает добавление (sign=1) или отмену (sign=-1) записи"""
+        if record.flags & FLAG_INCOME:
+            return
+        key = category_key(record.category)
+        counter = self.counters.get(key)
+        # Нет счетчика - запись учтет проход при первом обращении
+        if counter is None:
+            return
+        if record.ts >= counter.end and sign > 0:
+            # Новый период: старые траты в нем не считаются
+            budget = self.budgets[key]
+            counter.start, counter.end = period_window(budget["period"], record.ts)
+            counter.spent = 0
+        if counter.start <= record.ts < counter.end:
+            counter.spent += sign * record.amount_kop
+
+    def reset(self, key: Optional[str] = None):
+        """Забывает счетчики (все или одной категории); они пересчитаются по записям"""
+        if key is None:
+            self.counters.clear()
+        else:
+            self.counters.pop(key, None)
+
+    def spent(self, key: str, records: Ledger, now: int) -> int:
+        """Потрачено по бюджету key в периоде, содержащем now"""
+        budget = self.budgets[key]
+        counter = self.counters.get(key)
+        if counter is None or not counter.start <= now < counter.end:
+            start, end = period_window(budget["period"], now)
+            if counter is not None and now >= counter.end:
+                # Период сменился, а записей в новом еще не было
+                counter.start, counter.end, counter.spent = start, end, 0
+            else:
+                counter = self.counters[key] = Counter(start, end, _scan(records, key, start, end))
+        return counter.spent
+
+    def status(self, key: str, records: Ledger, now: int) -> Status:
+        budget = self.budgets[key]
+        return Status(budget["category"], budget["period"], budget["limit"],
+                      self.spent(key, records, now))
+
+
+def _scan(records: Ledger, key: str, start: int, end: int) -> int:
+    """Расходы категорий с ключом key за [start, end): только их позиции"""
+    total = 0
+    ts, amounts, flags = records.ts, records.amounts, records.flags
+    # Только категории этого пользователя, а не весь реестр бота
+    for category_id, positions in records.postings.items():
+        if category_key(categories.name(category_id)) != key:
+            continue
+        for position in positions:
+            if start <= ts[position] < end and not flags[position] & FLAG_INCOME:
+                total += amounts[position]
+    return total
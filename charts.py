@@ -0,0 +1,141 @@
+"""Графики в PNG: круговая диаграмма категорий и столбцы по месяцам.
+
+matplotlib работает медленно и держит GIL, поэтому картинки рисуются в
+пуле процессов, а event loop только готовит данные (из агрегатов,
+десятки чисел) и ждет результат. Готовые PNG лежат в RenderCache, а
+версия картинки - сами ее данные (разбивка месяца по категориям, суммы
+по месяцам), так что записи, которые картинку не меняют, кэш не
+сбрасывают. Одинаковые запросы, пришедшие во время рисования,
+ждут одну и ту же задачу пула.
+
+matplotlib - необязательная зависимость: без него /chart отвечает, что
+графики недоступны.
+"""
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from render_cache import RenderCache
+
+# Категории сверх этого числа на круговой диаграмме сливаются в "Прочее"
+PIE_SLICES = 7
+DPI = 100
+FIGSIZE = (8, 5)
+
+
+def available() -> bool:
+    return importlib.util.find_spec("matplotlib") is not None
+
+
+def _warm_up():
+    """Инициализатор процесса пула: импорт matplotlib - до первого запроса"""
+    import matplotlib.figure
+    matplotlib.use("Agg")
+
+
+def _to_png(figure) -> bytes:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    FigureCanvasAgg(figure)
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=DPI)
+    return buffer.getvalue()
+
+
+def render_pie(title: str, labels: List[str], values: List[float]) -> bytes:
+    """Круговая диаграмма; выполняется в процессе пула"""
+    from matplotlib.figure import Figure
+
+    if len(labels) > PIE_SLICES:
+        pairs = sorted(zip(values, labels), reverse=True)
+        rest = sum(value for value, _ in pairs[PIE_SLICES - 1:])
+        pairs = pairs[:PIE_SLICES - 1] + [(rest, "Прочее")]
+        values, labels = [value for value, _ in pairs], [label for _, label in pairs]
+    figure = Figure(figsize=FIGSIZE)
+    axes = figure.add_subplot()
+    axes.pie(values, labels=labels, autopct="%1.0f%%", startangle=90, counterclock=False)
+    axes.set_title(title)
+    axes.axis("equal")
+    return _to_png(figure)
+
+
+def render_bars(title: str, labels: List[str], income: List[float], expense: List[float]) -> bytes:
+    """Доходы и расходы по месяцам; выполняется в процессе пула"""
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=FIGSIZE)
+    axes = figure.add_subplot()
+    positions = range(len(labels))
+    width = 0.4
+    axes.bar([p - width / 2 for p in positions], income, width, label="Доходы", color="#4caf50")
+    axes.bar([p + width / 2 for p in positions], expense, width, label="Расходы", color="#f44336")
+    axes.set_xticks(list(positions))
+    axes.set_xticklabels(labels, rotation=45 if len(labels) > 6 else 0)
+    axes.set_title(title)
+    axes.legend()
+    axes.grid(axis="y", alpha=0.3)
+    figure.tight_layout()
+    return _to_png(figure)
+
+
+class ChartRenderer:
+    """Пул процессов для графиков, кэш PNG и объединение одинаковых запросов"""
+
+    def __init__(self, workers: int, cache: RenderCache):
+        self.workers = workers
+        self.cache = cache
+        self.rendered = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[Tuple[Hashable, Hashable], asyncio.Future] = {}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Пул создается при первом графике: шарды и боты без /chart его не держат
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                # spawn: дочерние процессы не наследуют потоки и сокеты бота
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+            )
+        return self._executor
+
+    async def render(self, key: Hashable, version: Hashable, function: Callable[..., bytes],
+                     prepare: Callable[[], tuple]) -> bytes:
+        """PNG из кэша или из пула; prepare() собирает аргументы function
+        и вызывается только при промахе кэша."""
+        png = self.cache.get(key, version)
+        if png is not None:
+            return png
+
+        pending = self._pending.get((key, version))
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = self._pending[(key, version)] = asyncio.ensure_future(
+                loop.run_in_executor(self._pool(), function, *prepare())
+            )
+            pending.add_done_callback(lambda _: self._pending.pop((key, version), None))
+            pending.add_done_callback(lambda done: self._store(key, version, done))
+        # shield: отмена одного ожидающего не отменяет рисование для остальных
+        return await asyncio.shield(pending)
+
+    def _store(self, key: Hashable, version: Hashable, done: asyncio.Future):
+        if done.cancelled():
+            return
+        if done.exception() is not None:
+            if isinstance(done.exception(), BrokenProcessPool):
+                # Процесс пула упал - следующий график поднимет новый пул
+                self.shutdown()
+            return
+        self.rendered += 1
+        self.cache.put(key, version, done.result())
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
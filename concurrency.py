@@ -0,0 +1,84 @@
+"""Параллельная обработка обновлений с сохранением порядка для пользователя.
+
+Обновления разных пользователей обрабатываются одновременно, а
+обновления одного пользователя - строго по очереди, в порядке
+поступления. Для этого у каждого пользователя свой asyncio.Lock
+(очередь ожидающих у него FIFO), и замок удаляется, как только
+становится никому не нужен.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Dict, Hashable, List, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+import outbound
+
+
+class KeyedLock:
+    """Замки по ключу, которые удаляются, когда их никто не ждет"""
+
+    def __init__(self):
+        # Ключ -> [замок, сколько задач держат или ждут его]
+        self._locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+def update_key(update: object) -> Optional[int]:
+    """Ключ сериализации: пользователь, иначе чат"""
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, "effective_chat", None)
+    return chat.id if chat is not None else None
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает до max_concurrent_updates обновлений одновременно,
+    но не больше одного на пользователя.
+
+    Замок пользователя берется раньше общего семафора базового класса,
+    поэтому обновления, ждущие своей очереди, не занимают слоты
+    других пользователей.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.user_locks = KeyedLock()
+
+    async def process_update(self, update: object, coroutine: Awaitable):
+        key = update_key(update)
+        if key is None:
+            async with outbound.collect():
+                await super().process_update(update, coroutine)
+            return
+        # Отложенные ответы уходят до освобождения замка: следующее
+        # обновление пользователя не обгонит их
+        async with self.user_locks.hold(key):
+            async with outbound.collect():
+                await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,60 @@
+"""Расписание ежедневного дайджеста.
+
+Вместо задачи JobQueue на каждого пользователя одна периодическая
+задача раз в минуту берет корзину пользователей с этой минутой
+доставки. Число задач не зависит от числа пользователей.
+"""
+from typing import Dict, List, Optional, Set
+
+MINUTES_PER_DAY = 24 * 60
+# Время доставки по умолчанию - 09:00
+DEFAULT_MINUTE = 9 * 60
+# Сколько пропущенных минут догонять, если задача запустилась с опозданием
+MAX_CATCH_UP = 15
+
+
+def parse_minute(text: str) -> int:
+    """Переводит "чч:мм" в минуту суток"""
+    hours, minutes = text.split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"неверное время {text!r}")
+    return hours * 60 + minutes
+
+
+def format_minute(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+class DigestSchedule:
+    """Пользователи, сгруппированные по минуте доставки"""
+
+    def __init__(self, user_minutes: Optional[Dict[int, int]] = None):
+        self.user_minutes: Dict[int, int] = {}
+        self.buckets: Dict[int, Set[int]] = {}
+        for user_id, minute in (user_minutes or {}).items():
+            self.set(user_id, minute)
+
+    def set(self, user_id: int, minute: Optional[int]):
+        """Назначает минуту доставки; None - отписка"""
+        old = self.user_minutes.pop(user_id, None)
+        if old is not None:
+            bucket = self.buckets[old]
+            bucket.discard(user_id)
+            if not bucket:
+                del self.buckets[old]
+        if minute is not None:
+            self.user_minutes[user_id] = minute
+            self.buckets.setdefault(minute, set()).add(user_id)
+
+    def get(self, user_id: int) -> Optional[int]:
+        return self.user_minutes.get(user_id)
+
+    def due(self, after: int, until: int) -> List[int]:
+        """Пользователи с минутой в полуинтервале (after, until] с переходом через полночь"""
+        users: List[int] = []
+        minute = after
+        while minute != until:
+            minute = (minute + 1) % MINUTES_PER_DAY
+            users.extend(self.buckets.get(minute, ()))
+        return users
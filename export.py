@@ -0,0 +1,108 @@
+"""Потоковый экспорт записей в CSV.
+
+CSV формируется порциями в рабочем потоке и пишется в
+SpooledTemporaryFile, который уходит на диск после SPOOL_MAX_SIZE байт.
+Полная строка CSV в памяти не собирается.
+"""
+import csv
+import gzip
+import io
+import zipfile
+from array import array
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import Iterator, NamedTuple, Optional
+
+from ledger import FLAG_INCOME, TYPE_EXPENSE, TYPE_INCOME, Ledger, categories
+
+EXPORT_HEADER = ['Дата', 'Тип', 'Категория', 'Сумма']
+COMPRESSIONS = ("gz", "zip")
+
+# Порог, после которого временный файл уходит на диск
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+# Сколько строк форматируется за одну порцию
+CHUNK_ROWS = 5000
+
+
+class LedgerSnapshot(NamedTuple):
+    """Копия колонок ledger для чтения из другого потока"""
+
+    ts: array
+    amounts: array
+    flags: array
+    category_ids: array
+
+
+def take_snapshot(ledger: Ledger, t0: Optional[int] = None,
+                  t1: Optional[int] = None) -> LedgerSnapshot:
+    """Копирует колонки (вызывать в потоке event loop).
+
+    Без интервала копируются массивы целиком, с интервалом - только
+    попавшие в него записи в порядке времени.
+    """
+    if t0 is None and t1 is None:
+        return LedgerSnapshot(ledger.ts[:], ledger.amounts[:],
+                              ledger.flags[:], ledger.category_ids[:])
+
+    index = ledger.index
+    lo, hi = index.bounds(t0 if t0 is not None else -2**63,
+                          t1 if t1 is not None else 2**63 - 1)
+    positions = index.positions[lo:hi]
+    return LedgerSnapshot(
+        array("q", (ledger.ts[p] for p in positions)),
+        array("q", (ledger.amounts[p] for p in positions)),
+        array("B", (ledger.flags[p] for p in positions)),
+        array("I", (ledger.category_ids[p] for p in positions)),
+    )
+
+
+def iter_csv_chunks(snapshot: LedgerSnapshot, chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """Отдает CSV порциями по chunk_rows строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+
+    # Реестр категорий только растет, читать его из потока безопасно
+    names = categories.name
+    for start in range(0, len(snapshot.ts), chunk_rows):
+        stop = min(start + chunk_rows, len(snapshot.ts))
+        writer.writerows(
+            (
+                datetime.fromtimestamp(snapshot.ts[i]).strftime("%d.%m.%Y %H:%M"),
+                TYPE_INCOME if snapshot.flags[i] & FLAG_INCOME else TYPE_EXPENSE,
+                names(snapshot.category_ids[i]),
+                f"{snapshot.amounts[i] / 100:.2f}",
+            )
+            for i in range(start, stop)
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail
+
+
+def write_export(snapshot: LedgerSnapshot, filename: str,
+                 compression: Optional[str] = None) -> SpooledTemporaryFile:
+    """Пишет CSV во временный файл (вызывать в рабочем потоке).
+
+    filename - имя CSV внутри zip-архива. Файл возвращается
+    перемотанным на начало.
+    """
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    if compression == "gz":
+        with gzip.GzipFile(filename=filename, mode="wb", fileobj=spool) as stream:
+            for chunk in iter_csv_chunks(snapshot):
+                stream.write(chunk.encode('utf-8'))
+    elif compression == "zip":
+        with zipfile.ZipFile(spool, "w", zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(filename, "w", force_zip64=True) as stream:
+                for chunk in iter_csv_chunks(snapshot):
+                    stream.write(chunk.encode('utf-8'))
+    else:
+        for chunk in iter_csv_chunks(snapshot):
+            spool.write(chunk.encode('utf-8'))
+    spool.seek(0)
+    return spool
@@ -0,0 +1,117 @@
+"""Минимальный HTTP/1.1 сервер на asyncio.
+
+Нужен для webhook, эндпоинта метрик и тестового Bot API, чтобы не
+тянуть отдельный веб-фреймворк. Поддерживает Content-Length и
+keep-alive; chunked-тела запросов не поддерживаются.
+"""
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Telegram присылает обновления заметно меньше этого размера
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    headers: Dict[str, str]  # имена в нижнем регистре
+    body: bytes
+
+
+class Response(NamedTuple):
+    status: int
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+def json_response(data, status: int = 200) -> Response:
+    return Response(status, json.dumps(data, ensure_ascii=False).encode("utf-8"),
+                    "application/json")
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[Request, bool]:
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise _BadRequest(413)
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise _BadRequest(400)
+    if length < 0:
+        raise _BadRequest(400)
+    if length > MAX_BODY_SIZE:
+        raise _BadRequest(413)
+    body = await reader.readexactly(length) if length else b""
+
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return Request(method.upper(), target.split("?", 1)[0], headers, body), keep_alive
+
+
+def _encode_response(response: Response, keep_alive: bool) -> bytes:
+    head = (
+        f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+        f"Content-Type: {response.content_type}\r\n"
+        f"Content-Length: {len(response.body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + response.body
+
+
+async def serve(handler: Handler, host: str, port: int) -> asyncio.AbstractServer:
+    """Запускает сервер; остановка - server.close() и await server.wait_closed()"""
+
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request, keep_alive = await _read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except _BadRequest as e:
+                    writer.write(_encode_response(Response(e.status), False))
+                    await writer.drain()
+                    return
+
+                try:
+                    response = await handler(request)
+                except Exception:
+                    logger.exception("Ошибка обработки HTTP-запроса %s %s", request.method, request.path)
+                    response = Response(500)
+
+                writer.write(_encode_response(response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port, limit=MAX_HEADER_SIZE)
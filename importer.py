@@ -0,0 +1,108 @@
+"""Массовый импорт записей из CSV в формате export_data.
+
+Файл читается потоково (в том числе .gz и .zip), строки проверяются в
+рабочем потоке и складываются в колонки. Категории интернируются уже в
+потоке event loop, потому что общий реестр не потокобезопасен.
+"""
+import csv
+import gzip
+import io
+import zipfile
+from array import array
+from datetime import datetime
+from typing import BinaryIO, Dict, List, NamedTuple
+
+from aggregates import to_kopecks
+from export import EXPORT_HEADER
+from ledger import TYPE_EXPENSE, TYPE_INCOME, categories, type_flags
+
+# Ограничения как при ручном вводе суммы
+MAX_AMOUNT = 1000000000
+MAX_CATEGORY_LENGTH = 64
+# Сколько ошибок показывать пользователю
+MAX_REPORTED_ERRORS = 5
+
+
+class ParsedImport(NamedTuple):
+    """Принятые строки по колонкам и статистика отказов"""
+
+    ts: array
+    flags: array
+    amounts: array
+    category_refs: array  # индексы в category_names
+    category_names: List[str]
+    rejected: int
+    errors: List[str]
+
+
+def _open_text(raw: BinaryIO, filename: str) -> io.TextIOWrapper:
+    name = filename.lower()
+    if name.endswith(".gz"):
+        raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif name.endswith(".zip"):
+        archive = zipfile.ZipFile(raw)
+        members = [item for item in archive.namelist() if item.lower().endswith(".csv")]
+        if not members:
+            raise ValueError("в архиве нет CSV-файла")
+        raw = archive.open(members[0])
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+def _parse_date(text: str) -> int:
+    # Быстрый разбор "дд.мм.гггг чч:мм" без strptime
+    if len(text) != 16 or text[2] != "." or text[5] != "." or text[10] != " " or text[13] != ":":
+        raise ValueError(f"неверная дата {text!r}")
+    moment = datetime(int(text[6:10]), int(text[3:5]), int(text[0:2]),
+                      int(text[11:13]), int(text[14:16]))
+    return int(moment.timestamp())
+
+
+def parse_import(raw: BinaryIO, filename: str) -> ParsedImport:
+    """Разбирает и проверяет файл (вызывать в рабочем потоке)"""
+    ts, flags, amounts, refs = array("q"), array("B"), array("q"), array("I")
+    name_refs: Dict[str, int] = {}
+    names: List[str] = []
+    rejected = 0
+    errors: List[str] = []
+
+    reader = csv.reader(_open_text(raw, filename))
+    for line_number, row in enumerate(reader, 1):
+        if line_number == 1 and row == EXPORT_HEADER:
+            continue
+        if not row:
+            continue
+        try:
+            if len(row) != 4:
+                raise ValueError(f"ожидалось 4 колонки, получено {len(row)}")
+            date_text, record_type, category, amount_text = row
+            if record_type not in (TYPE_INCOME, TYPE_EXPENSE):
+                raise ValueError(f"неизвестный тип {record_type!r}")
+            category = category.strip()
+            if not category or len(category) > MAX_CATEGORY_LENGTH:
+                raise ValueError("пустая или слишком длинная категория")
+            amount = float(amount_text.replace(",", "."))
+            if not 0 < amount <= MAX_AMOUNT:
+                raise ValueError(f"недопустимая сумма {amount_text!r}")
+            record_ts = _parse_date(date_text)
+        except ValueError as e:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"строка {line_number}: {e}")
+            continue
+
+        ref = name_refs.get(category)
+        if ref is None:
+            ref = name_refs[category] = len(names)
+            names.append(category)
+        ts.append(record_ts)
+        flags.append(type_flags(record_type))
+        amounts.append(to_kopecks(amount))
+        refs.append(ref)
+
+    return ParsedImport(ts, flags, amounts, refs, names, rejected, errors)
+
+
+def resolve_categories(parsed: ParsedImport) -> array:
+    """Переводит ссылки на категории в id общего реестра (в потоке event loop)"""
+    ids = [categories.intern(name) for name in parsed.category_names]
+    return array("I", (ids[ref] for ref in parsed.category_refs))
@@ -0,0 +1,314 @@
+"""Компактное колоночное хранение записей пользователя.
+
+Вместо списка словарей каждая запись раскладывается по массивам:
+время (секунды epoch), сумма в копейках, битовые флаги типа и
+id категории. Названия категорий интернируются один раз на весь бот.
+"""
+import heapq
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# Биты поля flags
+FLAG_INCOME = 1 << 0  # доход; если бит не установлен - расход
+
+TYPE_INCOME = "доход"
+TYPE_EXPENSE = "расход"
+
+
+def type_flags(record_type: str) -> int:
+    return FLAG_INCOME if record_type == TYPE_INCOME else 0
+
+
+def day_start(day: date) -> int:
+    """Начало суток day (локальное время) в секундах epoch"""
+    return int(datetime.combine(day, time.min).timestamp())
+
+
+def day_range(first: date, last: date) -> Tuple[int, int]:
+    """Полуинтервал [t0, t1) от начала first до конца last включительно"""
+    return day_start(first), day_start(last + timedelta(days=1))
+
+
+class CategoryRegistry:
+    """Интернирование названий категорий в целые id"""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+
+    def intern(self, name: str) -> int:
+        category_id = self._ids.get(name)
+        if category_id is None:
+            category_id = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return category_id
+
+    def name(self, category_id: int) -> str:
+        return self._names[category_id]
+
+    def names(self) -> List[str]:
+        """Копия списка названий; индекс - id категории"""
+        return list(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+# Общий реестр категорий для всех пользователей
+categories = CategoryRegistry()
+
+
+class Record(NamedTuple):
+    """Запись для чтения; в памяти ledger хранит ее по колонкам"""
+
+    ts: int
+    flags: int
+    category: str
+    amount_kop: int
+
+    @property
+    def type(self) -> str:
+        return TYPE_INCOME if self.flags & FLAG_INCOME else TYPE_EXPENSE
+
+    @property
+    def amount(self) -> float:
+        return self.amount_kop / 100
+
+    @property
+    def moment(self) -> datetime:
+        return datetime.fromtimestamp(self.ts)
+
+    @property
+    def date(self) -> str:
+        return self.moment.strftime("%d.%m.%Y %H:%M")
+
+
+class TimeIndex:
+    """Индекс записей, отсортированный по времени.
+
+    Хранит отсортированные метки времени, позиции записей в ledger и
+    префиксные суммы по типу, поэтому сумма и количество за любой
+    интервал считаются двумя бинарными поисками.
+    """
+
+    __slots__ = ("ts", "positions", "income_kop", "income_count",
+                 "expense_kop", "expense_count")
+
+    def __init__(self):
+        self.ts = array("q")
+        self.positions = array("I")
+        # Префиксные суммы: элемент i - итог по первым i записям индекса
+        self.income_kop = array("q", [0])
+        self.income_count = array("I", [0])
+        self.expense_kop = array("q", [0])
+        self.expense_count = array("I", [0])
+
+    @classmethod
+    def build(cls, ledger: "Ledger") -> "TimeIndex":
+        index = cls()
+        order = sorted(range(len(ledger)), key=ledger.ts.__getitem__)
+        for position in order:
+            index.push(position, ledger.ts[position], ledger.flags[position],
+                       ledger.amounts[position])
+        return index
+
+    def push(self, position: int, ts: int, flags: int, amount_kop: int):
+        """Добавляет запись, которая не раньше всех уже проиндексированных"""
+        income = flags & FLAG_INCOME
+        self.ts.append(ts)
+        self.positions.append(position)
+        self.income_kop.append(self.income_kop[-1] + (amount_kop if income else 0))
+        self.income_count.append(self.income_count[-1] + (1 if income else 0))
+        self.expense_kop.append(self.expense_kop[-1] + (0 if income else amount_kop))
+        self.expense_count.append(self.expense_count[-1] + (0 if income else 1))
+
+    def drop_last(self):
+        for column in (self.ts, self.positions, self.income_kop, self.income_count,
+                       self.expense_kop, self.expense_count):
+            column.pop()
+
+    def bounds(self, t0: int, t1: int) -> Tuple[int, int]:
+        """Диапазон индекса для записей с t0 <= ts < t1"""
+        return bisect_left(self.ts, t0), bisect_left(self.ts, t1)
+
+    def total(self, record_type: str, t0: int, t1: int) -> Tuple[int, int]:
+        """Сумма в копейках и количество записей типа за [t0, t1)"""
+        lo, hi = self.bounds(t0, t1)
+        if record_type == TYPE_INCOME:
+            kop, count = self.income_kop, self.income_count
+        else:
+            kop, count = self.expense_kop, self.expense_count
+        return kop[hi] - kop[lo], count[hi] - count[lo]
+
+
+class Ledger:
+    """Записи одного пользователя в порядке добавления"""
+
+    __slots__ = ("ts", "amounts", "flags", "category_ids", "_index", "_postings")
+
+    def __init__(self):
+        self.ts = array("q")
+        self.amounts = array("q")
+        self.flags = array("B")
+        self.category_ids = array("I")
+        # None - индекс устарел и будет перестроен при первом запросе
+        self._index: Optional[TimeIndex] = TimeIndex()
+        # Инвертированный индекс по категориям строится при первом поиске
+        self._postings: Optional[Dict[int, array]] = None
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __getitem__(self, index: int) -> Record:
+        return Record(
+            self.ts[index],
+            self.flags[index],
+            categories.name(self.category_ids[index]),
+            self.amounts[index],
+        )
+
+    def __iter__(self) -> Iterator[Record]:
+        return self.iter_records()
+
+    def append(self, ts: int, flags: int, category: str, amount_kop: int) -> Record:
+        index = self._index
+        if index is not None:
+            # Обычно записи идут по времени и индекс дописывается за O(1)
+            if not index.ts or ts >= index.ts[-1]:
+                index.push(len(self.ts), ts, flags, amount_kop)
+            else:
+                self._index = None
+        category_id = categories.intern(category)
+        if self._postings is not None:
+            self._postings.setdefault(category_id, array("I")).append(len(self.ts))
+        self.ts.append(ts)
+        self.amounts.append(amount_kop)
+        self.flags.append(flags)
+        self.category_ids.append(category_id)
+        return Record(ts, flags, category, amount_kop)
+
+    def extend(self, ts: array, flags: array, category_ids: array, amounts: array):
+        """Добавляет пачку записей; индекс перестроится один раз при запросе"""
+        self.ts.extend(ts)
+        self.amounts.extend(amounts)
+        self.flags.extend(flags)
+        self.category_ids.extend(category_ids)
+        self._index = None
+        self._postings = None
+
+    def extend_raw(self, ts, amounts, flags, category_ids):
+        """Дописывает колонки из буферов (bytes, memoryview) одним копированием.
+
+        Буферы должны быть в формате массивов этой машины; id категорий -
+        уже в нумерации общего реестра.
+        """
+        self.ts.frombytes(ts)
+        self.amounts.frombytes(amounts)
+        self.flags.frombytes(flags)
+        self.category_ids.frombytes(category_ids)
+        self._index = None
+        self._postings = None
+
+    def pop(self) -> Record:
+        index = self._index
+        if index is not None:
+            # Последняя по времени запись обычно и добавлена последней
+            if index.positions[-1] == len(self.ts) - 1:
+                index.drop_last()
+            else:
+                self._index = None
+        category_id = self.category_ids.pop()
+        if self._postings is not None:
+            # Удаляемая запись - последняя, значит и в списке категории она последняя
+            positions = self._postings[category_id]
+            positions.pop()
+            if not positions:
+                del self._postings[category_id]
+        return Record(
+            self.ts.pop(),
+            self.flags.pop(),
+            categories.name(category_id),
+            self.amounts.pop(),
+        )
+
+    # --- API чтения для обработчиков ---
+
+    def iter_records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Record]:
+        """Записи с позиции start до stop в порядке добавления"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for index in range(start, stop):
+            yield self[index]
+
+    def tail(self, count: int) -> List[Record]:
+        """Последние count записей в порядке добавления"""
+        return list(self.iter_records(max(0, len(self) - count)))
+
+    def last(self) -> Optional[Record]:
+        return self[-1] if self.ts else None
+
+    @property
+    def index(self) -> TimeIndex:
+        if self._index is None:
+            self._index = TimeIndex.build(self)
+        return self._index
+
+    def range_total(self, record_type: str, t0: int, t1: int) -> Tuple[float, int]:
+        """Сумма в рублях и количество записей типа за [t0, t1) за O(log n)"""
+        kop, count = self.index.total(record_type, t0, t1)
+        return kop / 100, count
+
+    def iter_range(self, t0: int, t1: int) -> Iterator[Record]:
+        """Записи за [t0, t1) в порядке времени"""
+        index = self.index
+        lo, hi = index.bounds(t0, t1)
+        for i in range(lo, hi):
+            yield self[index.positions[i]]
+
+    @property
+    def postings(self) -> Dict[int, array]:
+        """Инвертированный индекс: id категории -> позиции ее записей по возрастанию"""
+        if self._postings is None:
+            postings: Dict[int, array] = {}
+            for position, category_id in enumerate(self.category_ids):
+                positions = postings.get(category_id)
+                if positions is None:
+                    positions = postings[category_id] = array("I")
+                positions.append(position)
+            self._postings = postings
+        return self._postings
+
+    def search(self, category_ids: Optional[Iterable[int]], min_kop: Optional[int] = None,
+               max_kop: Optional[int] = None, limit: int = 20) -> Tuple[List[Record], int, int]:
+        """Записи указанных категорий (None - всех) с суммой в [min_kop, max_kop].
+
+        Возвращает до limit последних найденных записей (от новых к
+        старым), число всех найденных и их сумму в копейках. Проходятся
+        только позиции нужных категорий.
+        """
+        if category_ids is None:
+            candidates: Iterable[int] = range(len(self.ts) - 1, -1, -1)
+        else:
+            postings = self.postings
+            lists = [postings[i] for i in category_ids if i in postings]
+            candidates = heapq.merge(*(reversed(positions) for positions in lists), reverse=True)
+        found: List[Record] = []
+        count = total = 0
+        amounts = self.amounts
+        for position in candidates:
+            amount = amounts[position]
+            if (min_kop is not None and amount < min_kop) or (max_kop is not None and amount > max_kop):
+                continue
+            count += 1
+            total += amount
+            if len(found) < limit:
+                found.append(self[position])
+        return found, count, total
+
+    def nbytes(self) -> int:
+        """Объем памяти под данные колонок"""
+        return sum(
+            column.buffer_info()[1] * column.itemsize
+            for column in (self.ts, self.amounts, self.flags, self.category_ids)
+        )
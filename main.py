@@ -1,20 +1,60 @@
+import asyncio
 import logging
+import math
 import os
-import csv
-import io
+import time
+from tempfile import SpooledTemporaryFile
+from typing import Optional
 from telegram import InputFile
+from datetime import date
 from datetime import timedelta
 from datetime import datetime
-from typing import Dict, List
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from datetime import time as dt_time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application,
+    BasePersistence,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     filters,
     ContextTypes,
 )
+from aggregates import to_kopecks
+from budgets import PERIOD_ALIASES, PERIODS, category_key, crossed
+from broadcast import GLOBAL_RATE, Broadcaster, OutgoingMessage, log_progress
+from digest import (
+    DEFAULT_MINUTE,
+    MAX_CATCH_UP,
+    MINUTES_PER_DAY,
+    DigestSchedule,
+    format_minute,
+    parse_minute,
+)
+from export import COMPRESSIONS, SPOOL_MAX_SIZE, take_snapshot, write_export
+from importer import parse_import, resolve_categories
+import analytics
+import charts
+import metrics
+import outbound
+from ledger import categories, day_range, day_start
+from persistence import SQLitePersistence
+from profiling import Profiler, ProfilingUpdateProcessor, memory_report, stop_tracing
+from render_cache import RenderCache
+from sharding import (
+    ShardPool,
+    ignore_interrupts,
+    run_front_polling,
+    run_front_webhook,
+    serve_shard,
+    shard_path,
+)
+from storage import BaseStorage, MemoryStorage, create_storage
+from subscriptions import SubscriptionCalendar, days_to_post, last_posted, next_billing_date
+from webhook import run_webhook
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,8 +66,76 @@ logger = logging.getLogger(__name__)
 # Токен бота из переменных окружения (БЕЗОПАСНОСТЬ!)
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Хранилище: memory (по умолчанию), sqlite или snapshot (каталог со снимком и журналом)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "finance_bot.db")
+# Как часто писать снимок для бэкенда snapshot, секунды
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "600"))
+
+# Режим работы: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Адрес Bot API; можно указать локальную заглушку для тестов
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org/bot")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Публичный URL для setWebhook; если пуст, webhook в Telegram не регистрируется
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# Состояние диалогов и user_data: файл SQLite; по умолчанию хранится,
+# только если и сами записи хранятся в SQLite
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH") or (
+    "finance_bot_state.db" if STORAGE_BACKEND == "sqlite" else None
+)
+# Как часто сбрасывать изменившиеся user_data и состояния, секунды
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "10"))
+
+# Число процессов-шардов; больше 1 - фронт раздает обновления по user_id
+SHARDS = int(os.getenv("SHARDS", "1"))
+
+# Сколько обновлений обрабатывать одновременно (по одному на пользователя)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+# Администраторы (id через запятую): им доступна команда /profile
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+# Куда сохранять .prof медленных обновлений; пусто - только в памяти
+PROFILE_DIR = os.getenv("PROFILE_DIR") or None
+
+# Эндпоинт метрик Prometheus; порт 0 - метрики не отдаются
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Пул соединений с Bot API: размер, таймауты (с) и время жизни простаивающего соединения
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", "128"))
+BOT_API_CONNECT_TIMEOUT = float(os.getenv("BOT_API_CONNECT_TIMEOUT", "5"))
+BOT_API_READ_TIMEOUT = float(os.getenv("BOT_API_READ_TIMEOUT", "5"))
+BOT_API_WRITE_TIMEOUT = float(os.getenv("BOT_API_WRITE_TIMEOUT", "5"))
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", "3"))
+BOT_API_KEEPALIVE = float(os.getenv("BOT_API_KEEPALIVE", "60"))
+# "2" требует python-telegram-bot[http2]
+BOT_API_HTTP_VERSION = os.getenv("BOT_API_HTTP_VERSION", "1.1")
+
+# Процессов для рисования графиков и объем кэша картинок
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", str(min(2, os.cpu_count() or 1))))
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_MB", "32")) * 1024 * 1024
+
+# Во сколько списывать регулярные платежи (чч:мм) и в какую категорию
+SUBSCRIPTION_TIME = parse_minute(os.getenv("SUBSCRIPTION_TIME", "10:00"))
+SUBSCRIPTION_CATEGORY = "🔄 Подписки"
+
+# Пороги уведомлений о бюджете, проценты лимита через запятую
+BUDGET_ALERTS = tuple(sorted(int(x) for x in os.getenv("BUDGET_ALERTS", "80,100").replace(" ", "").split(",") if x))
+
 # Константы для ConversationHandler
 TYPE_SELECTION, CATEGORY, AMOUNT, CONFIRM = range(4)
+# Имена состояний для меток метрик
+STATE_NAMES = {
+    TYPE_SELECTION: "type_selection",
+    CATEGORY: "category",
+    AMOUNT: "amount",
+    CONFIRM: "confirm",
+}
 
 # Клавиатура для выбора типа операции
 TYPE_KEYBOARD = ReplyKeyboardMarkup(
@@ -41,15 +149,18 @@ TYPE_KEYBOARD = ReplyKeyboardMarkup(
     input_field_placeholder="Выберите действие..."
 )
 
+QUICK_CATEGORIES = [
+    ["🍔 Еда 150", "🚗 Такси 300"],
+    ["☕ Кофе 250", "🛒 Продукты 1000"],
+    ["🎬 Кино 500", "⬅️ Отмена"]
+]
 QUICK_CATEGORIES_KEYBOARD = ReplyKeyboardMarkup(
-    [
-        ["🍔 Еда 150", "🚗 Такси 300"],
-        ["☕ Кофе 250", "🛒 Продукты 1000"],
-        ["🎬 Кино 500", "⬅️ Отмена"]
-    ],
+    QUICK_CATEGORIES,
     resize_keyboard=True,
     one_time_keyboard=True
 )
+# Кнопки быстрых расходов (кроме отмены)
+QUICK_BUTTONS = {button for row in QUICK_CATEGORIES for button in row if "Отмена" not in button}
 
 # Клавиатура для выбора категорий расходов
 EXPENSE_CATEGORIES = [
@@ -75,15 +186,39 @@ CONFIRM_KEYBOARD = ReplyKeyboardMarkup(
     one_time_keyboard=True
 )
 
-# "База данных" (в памяти, для примера - в реальном проекте используйте БД)
-user_data_store: Dict[int, List[Dict]] = {}
+# Хранилище записей, целей и подписок (выбирается в main())
+storage: BaseStorage = MemoryStorage()
+
+# Все массовые рассылки идут через общий ограничитель
+broadcaster = Broadcaster()
+
+# Подписчики ежедневного дайджеста по минутам доставки
+digest_schedule = DigestSchedule()
+
+# Регулярные платежи по дням месяца
+subscription_calendar = SubscriptionCalendar()
+
+# Готовые тексты отчетов, действительные до следующего изменения данных
+render_cache = RenderCache()
+# PNG графиков - отдельно, чтобы картинки не вытесняли тексты
+chart_renderer = charts.ChartRenderer(CHART_WORKERS, RenderCache(CHART_CACHE_BYTES))
+
+# Профилирование медленных обновлений, включается командой /profile
+profiler = Profiler(dump_dir=PROFILE_DIR)
+
+# Размер хранилища и кэша считается в момент опроса метрик
+metrics.add_gauge("bot_users", "Пользователей с записями", lambda: len(storage.records))
+metrics.add_gauge("bot_records", "Записей в хранилище",
+                  lambda: sum(len(records) for records in storage.records.values()))
+metrics.add_gauge("bot_render_cache_bytes", "Объем кэша отчетов", lambda: render_cache.bytes)
+metrics.add_gauge("bot_render_cache_hits", "Попадания в кэш отчетов", lambda: render_cache.hits)
+metrics.add_gauge("bot_render_cache_misses", "Промахи кэша отчетов", lambda: render_cache.misses)
+metrics.add_gauge("bot_chart_cache_bytes", "Объем кэша графиков", lambda: chart_renderer.cache.bytes)
+metrics.add_gauge("bot_charts_rendered", "Нарисовано графиков", lambda: chart_renderer.rendered)
+metrics.add_gauge("bot_charts_pending", "Графиков в работе", lambda: chart_renderer.pending())
 
 # Команда /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if user_id not in user_data_store:
-        user_data_store[user_id] = []
-    
     await update.message.reply_text(
         "👋 *Добро пожаловать в Финансовый помощник!*\n\n"
         "Я помогу вам отслеживать доходы и расходы.\n"
@@ -122,72 +257,71 @@ async def handle_quick_expense(update: Update, context: ContextTypes.DEFAULT_TYP
         amount = float(parts[2])
         
         user_id = update.effective_user.id
-        record = {
-            "type": "расход",
-            "category": category,
-            "amount": amount,
-            "date": datetime.now().strftime("%d.%m.%Y %H:%M"),
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        if user_id not in user_data_store:
-            user_data_store[user_id] = []
-        user_data_store[user_id].append(record)
-        
-        await update.message.reply_text(
-            f"✅ *{emoji} {category} за {amount}₽ сохранен!*\n"
-            f"💳 Баланс автоматически обновлен.",
-            reply_markup=TYPE_KEYBOARD,
-            parse_mode="Markdown"
-        )
-        
-        # Показываем обновленную статистику
-        await show_quick_stats(update, user_id)
-        
+        record = storage.add_record(user_id, "расход", category, amount)
     except Exception as e:
         logger.error(f"Ошибка быстрой записи: {e}")
-        await update.message.reply_text(
+        # Через буфер, чтобы не обогнать уже отложенные ответы
+        await outbound.reply(
+            update.message,
             "❌ Ошибка записи",
             reply_markup=TYPE_KEYBOARD
         )
+        return TYPE_SELECTION
+    
+    # Подтверждение и статистика уходят одним сообщением (см. outbound)
+    await outbound.reply(
+        update.message,
+        f"✅ *{emoji} {category} за {amount}₽ сохранен!*\n"
+        f"💳 Баланс автоматически обновлен." + budget_alerts(user_id, record),
+        reply_markup=TYPE_KEYBOARD,
+        parse_mode="Markdown"
+    )
+    
+    # Показываем обновленную статистику; запись уже сохранена, так что
+    # ошибки здесь уходят в общий обработчик, а не в "Ошибка записи"
+    await show_quick_stats(update, user_id)
     
     return TYPE_SELECTION
 
 # Быстрая статистика после записи
 async def show_quick_stats(update: Update, user_id: int):
     """Показывает краткую статистику после записи"""
-    records = user_data_store.get(user_id, [])
+    records = storage.get_records(user_id)
     
     if not records:
         return
-        return
     
     # Статистика за сегодня
-    today = datetime.now().strftime("%d.%m.%Y")
-    today_expenses = sum(
-        r["amount"] for r in records 
-        if r["type"] == "расход" and r["date"].startswith(today)
-    )
+    today = datetime.now().date()
+    today_expenses, _ = records.range_total("расход", *day_range(today, today))
     
-    # Статистика за неделю
-    week_ago = (datetime.now() - timedelta(days=7)).strftime("%d.%m.%Y")
-    week_expenses = sum(
-        r["amount"] for r in records 
-        if r["type"] == "расход" and r["date"][:10] >= week_ago
+    # Статистика за неделю (последние 7 дней, включая сегодня)
+    week_expenses, _ = records.range_total(
+        "расход", *day_range(today - timedelta(days=6), today)
     )
     
-    await update.message.reply_text(
+    tracker = storage.budget_tracker(user_id)
+    if tracker is not None:
+        now = int(time.time())
+        tip = "💼 *Бюджеты:*\n" + "\n".join(
+            format_budget(tracker.status(key, records, now)) for key in tracker.budgets
+        )
+    else:
+        tip = "💡 Задайте бюджет категории: /budget Еда 5000 неделя"
+    
+    await outbound.reply(
+        update.message,
         f"📊 *Краткая статистика:*\n\n"
         f"💸 Расходы сегодня: {today_expenses:,.0f}₽\n"
         f"📅 Расходы за неделю: {week_expenses:,.0f}₽\n\n"
-        f"💡 Совет: старайтесь не превышать 1000₽ в день",
+        f"{tip}",
         parse_mode="Markdown"
     )
 
-# Команда /export - экспорт данных в CSV
+# Команда /export [gz|zip] [с] [по] - экспорт данных в CSV
 async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    records = user_data_store.get(user_id, [])
+    records = storage.get_records(user_id)
     
     if not records:
         await update.message.reply_text(
@@ -196,40 +330,106 @@ async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return TYPE_SELECTION
     
-    # Создаем CSV в памяти
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Заголовки
-    writer.writerow(['Дата', 'Тип', 'Категория', 'Сумма'])
-    
-    # Данные
-    for record in records:
-        writer.writerow([
-            record['date'],
-            record['type'],
-            record['category'],
-            f"{record['amount']:.2f}"
-        ])
-    
-    # Создаем файл
-    output.seek(0)
-    csv_file = io.BytesIO(output.getvalue().encode('utf-8'))
-    
-    # Отправляем файл
-    await update.message.reply_document(
-        document=InputFile(csv_file, filename=f'finance_{user_id}_{datetime.now().strftime("%Y%m%d")}.csv'),
-        caption=f"📊 Экспорт ваших финансовых данных\n"
-                f"Всего записей: {len(records)}",
-        reply_markup=TYPE_KEYBOARD
-    )
+    # Разбираем аргументы: формат сжатия и необязательный период
+    args = list(context.args or [])
+    compression = args.pop(0).lower() if args and args[0].lower() in COMPRESSIONS else None
+    t0 = t1 = None
+    try:
+        if args:
+            first = datetime.strptime(args[0], "%d.%m.%Y").date()
+            last = datetime.strptime(args[1], "%d.%m.%Y").date() if len(args) > 1 else datetime.now().date()
+            t0, t1 = day_range(min(first, last), max(first, last))
+    except ValueError:
+        await update.message.reply_text(
+            "📤 *Экспорт данных*\n\n"
+            "Использование: /export [gz|zip] [с] [по]\n"
+            "Пример: /export zip 01.01.2026 31.03.2026",
+            parse_mode="Markdown"
+        )
+        return TYPE_SELECTION
+    
+    # Копируем колонки здесь, а CSV форматируем в рабочем потоке
+    snapshot = take_snapshot(records, t0, t1)
+    filename = f'finance_{user_id}_{datetime.now().strftime("%Y%m%d")}.csv'
+    csv_file = await asyncio.to_thread(write_export, snapshot, filename, compression)
+    
+    try:
+        # PTB все равно читает файл целиком, а по объекту SpooledTemporaryFile
+        # не может угадать имя, поэтому передаем байты
+        await update.message.reply_document(
+            document=InputFile(csv_file.read(), filename=filename + (f".{compression}" if compression else "")),
+            caption=f"📊 Экспорт ваших финансовых данных\n"
+                    f"Всего записей: {len(snapshot.ts)}",
+            reply_markup=TYPE_KEYBOARD
+        )
+    finally:
+        csv_file.close()
     
     return TYPE_SELECTION
 
+# Команда /import - загрузка истории из CSV в формате /export
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["awaiting_import"] = True
+    await update.message.reply_text(
+        "📥 *Импорт данных*\n\n"
+        "Отправьте CSV-файл в формате /export (можно .gz или .zip).\n"
+        "Колонки: Дата, Тип, Категория, Сумма\n"
+        "Пример строки: 01.09.2026 12:30,расход,Еда,350.00",
+        parse_mode="Markdown"
+    )
+
+# Обработка присланного файла для импорта
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    caption = update.message.caption or ""
+    if not context.user_data.pop("awaiting_import", False) and not caption.startswith("/import"):
+        return await unknown_message(update, context)
+    
+    user_id = update.effective_user.id
+    document = update.message.document
+    
+    # Скачиваем во временный файл, который уходит на диск после порога
+    raw = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_memory(out=raw)
+        raw.seek(0)
+        parsed = await asyncio.to_thread(parse_import, raw, document.file_name or "import.csv")
+    except Exception as e:
+        logger.error(f"Ошибка импорта: {e}")
+        await update.message.reply_text(
+            "❌ Не удалось прочитать файл. Проверьте, что это CSV в формате /export.",
+            reply_markup=TYPE_KEYBOARD
+        )
+        return
+    finally:
+        raw.close()
+    
+    # Одна пакетная запись, индексы и агрегаты пересчитываются один раз
+    if parsed.ts:
+        storage.add_records_bulk(
+            user_id, parsed.ts, parsed.flags, resolve_categories(parsed), parsed.amounts
+        )
+    
+    report = (
+        f"📥 Импорт завершен\n\n"
+        f"✅ Принято: {len(parsed.ts)}\n"
+        f"❌ Отклонено: {parsed.rejected}"
+    )
+    if parsed.errors:
+        report += "\n\nПримеры ошибок:\n" + "\n".join(parsed.errors)
+    
+    await update.message.reply_text(report, reply_markup=TYPE_KEYBOARD)
+
 # Добавим в константы
 MONTHS_RU = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
              'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
 
+# Дальше этого срока прогноз достижения цели не показывает дату
+MAX_PROJECTION_DAYS = 50 * 365
+
+# Сколько месяцев можно запросить в /monthly
+MAX_MONTHS = 24
+
 # Клавиатура для месячной статистики
 MONTHS_KEYBOARD = ReplyKeyboardMarkup(
     [
@@ -239,77 +439,233 @@ MONTHS_KEYBOARD = ReplyKeyboardMarkup(
     resize_keyboard=True
 )
 
-# Обработка месячной статистики
+# Обработка месячной статистики: /monthly [число месяцев]
 async def monthly_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    records = user_data_store.get(user_id, [])
+    aggregates = storage.get_aggregates(user_id)
     
-    if not records:
+    if not aggregates.count:
         await update.message.reply_text(
             "📭 Нет данных для статистики.",
             reply_markup=TYPE_KEYBOARD
         )
         return TYPE_SELECTION
     
-    current_month = datetime.now().month
-    current_year = datetime.now().year
-    
-    # Собираем данные по месяцам
-    monthly_data = {}
-    for record in records:
-        record_date = datetime.strptime(record['date'], "%d.%m.%Y %H:%M")
-        month_key = f"{record_date.year}-{record_date.month}"
-        
-        if month_key not in monthly_data:
-            monthly_data[month_key] = {'доход': 0, 'расход': 0}
-        
-        monthly_data[month_key][record['type']] += record['amount']
+    months = 6
+    if context.args:
+        try:
+            months = min(max(int(context.args[0]), 1), MAX_MONTHS)
+        except ValueError:
+            await update.message.reply_text(f"Использование: /monthly [1-{MAX_MONTHS}]")
+            return TYPE_SELECTION
+    
+    stats_text = render_cache.get_or_render(
+        (user_id, "monthly", months),
+        storage.version(user_id),
+        lambda: render_monthly_statistics(aggregates, months)
+    )
     
+    await update.message.reply_text(
+        stats_text,
+        reply_markup=TYPE_KEYBOARD,
+        parse_mode="Markdown"
+    )
+    return TYPE_SELECTION
+
+def render_monthly_statistics(aggregates, months: int = 6) -> str:
+    """Текст статистики по последним месяцам"""
     # Формируем статистику
     stats_text = "📅 *Статистика по месяцам:*\n\n"
     
-    for month_key in sorted(monthly_data.keys(), reverse=True)[:6]:  # Последние 6 месяцев
-        year, month = map(int, month_key.split('-'))
-        data = monthly_data[month_key]
+    for year, month in aggregates.months()[:months]:
+        income = aggregates.month_total('доход', (year, month))
+        expense = aggregates.month_total('расход', (year, month))
         
-        balance = data['доход'] - data['расход']
+        balance = income - expense
         month_name = MONTHS_RU[month-1]
         
         stats_text += (
             f"*{month_name} {year}*\n"
-            f"📈 Доходы: {data['доход']:,.2f}\n"
-            f"📉 Расходы: {data['расход']:,.2f}\n"
+            f"📈 Доходы: {income:,.2f}\n"
+            f"📉 Расходы: {expense:,.2f}\n"
             f"💼 Баланс: {balance:,.2f}\n\n"
         ).replace(',', ' ')
     
+    return stats_text
+
+# Команда /trend - динамика расходов
+async def trend_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    records = storage.get_records(user_id)
+    
+    if not records:
+        await update.message.reply_text(
+            "📭 Нет данных для статистики.",
+            reply_markup=TYPE_KEYBOARD
+        )
+        return
+    
+    today = datetime.now().date()
+    key = (user_id, "trend", today)
+    version = storage.version(user_id)
+    trend_text = render_cache.get(key, version)
+    if trend_text is None:
+        # Колонки копируем здесь, а считаем в потоке: у крупного
+        # пользователя отчет не задерживает остальные обновления
+        columns = analytics.copy_columns(records)
+        trend = await asyncio.to_thread(analytics.compute_trend, columns, today)
+        trend_text = render_trend(trend)
+        render_cache.put(key, version, trend_text)
+    
     await update.message.reply_text(
-        stats_text,
+        trend_text,
         reply_markup=TYPE_KEYBOARD,
         parse_mode="Markdown"
     )
-    return TYPE_SELECTION
 
-# Добавим в глобальные переменные
-user_goals: Dict[int, Dict] = {}
+# Команда /chart pie [мм.гггг] | bars [N] - графики
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    args = context.args or []
+    kind = args[0].lower() if args else ""
+    
+    if kind not in ("pie", "bars"):
+        await update.message.reply_text(
+            "📊 *Графики*\n\n"
+            "/chart pie [мм.гггг] - расходы по категориям за месяц\n"
+            f"/chart bars [1-{MAX_MONTHS}] - доходы и расходы по месяцам\n"
+            "Пример: /chart pie 03.2026",
+            parse_mode="Markdown"
+        )
+        return
+    if not charts.available():
+        await update.message.reply_text("Графики недоступны: на сервере не установлен matplotlib.")
+        return
+    
+    aggregates = storage.get_aggregates(user_id)
+    if not aggregates.count:
+        await update.message.reply_text(
+            "📭 Нет данных для графика.",
+            reply_markup=TYPE_KEYBOARD
+        )
+        return
+    
+    today = datetime.now().date()
+    try:
+        if kind == "pie":
+            month = (today.year, today.month)
+            if len(args) > 1:
+                parsed = datetime.strptime(args[1], "%m.%Y")
+                month = (parsed.year, parsed.month)
+            request = pie_chart_request(user_id, aggregates, month)
+        else:
+            months = min(max(int(args[1]), 1), MAX_MONTHS) if len(args) > 1 else 6
+            request = bars_chart_request(user_id, aggregates, months)
+    except ValueError:
+        await update.message.reply_text("❌ Неверный месяц или число месяцев. Справка: /chart")
+        return
+    
+    if request is None:
+        await update.message.reply_text("📭 Нет расходов за этот месяц.")
+        return
+    key, version, function, prepare, caption = request
+    png = await chart_renderer.render(key, version, function, prepare)
+    await update.message.reply_photo(photo=png, caption=caption, reply_markup=TYPE_KEYBOARD)
+
+def pie_chart_request(user_id: int, aggregates, month):
+    """Ключ, версия и данные круговой диаграммы расходов за месяц"""
+    totals = aggregates.month_categories("расход", month)
+    if not totals:
+        return None
+    # Версия - сама разбивка месяца по категориям: записи других месяцев
+    # картинку не сбрасывают, а перенос суммы между категориями сбрасывает
+    version = tuple(sorted(totals.items()))
+    year, number = month
+    title = f"Расходы: {MONTHS_RU[number-1]} {year}"
+    
+    total = f"{aggregates.month_total('расход', month):,.2f}".replace(',', ' ')
+    caption = f"🥧 {title}, всего {total}"
+    return ((user_id, "pie", month), version, charts.render_pie,
+            lambda: (title, list(totals), list(totals.values())), caption)
+
+def bars_chart_request(user_id: int, aggregates, months: int):
+    """Ключ, версия и данные столбцов доходов и расходов по месяцам"""
+    selected = list(reversed(aggregates.months()[:months]))
+    labels = [f"{MONTHS_RU[month-1][:3]} {year % 100:02d}" for year, month in selected]
+    income = [aggregates.month_total("доход", month) for month in selected]
+    expense = [aggregates.month_total("расход", month) for month in selected]
+    # Версия - сами суммы: пока они не изменились, картинка та же
+    version = (tuple(selected), tuple(income), tuple(expense))
+    title = "Доходы и расходы по месяцам"
+    return ((user_id, "bars", months), version, charts.render_bars,
+            lambda: (title, labels, income, expense), f"📊 {title}")
+
+SPARK_BARS = "▁▂▃▄▅▆▇█"
+WEEKDAYS_RU = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+def sparkline(values) -> str:
+    top = max(values, default=0)
+    if top <= 0:
+        return SPARK_BARS[0] * len(values)
+    return "".join(SPARK_BARS[min(int(v / top * len(SPARK_BARS)), len(SPARK_BARS) - 1)] for v in values)
+
+def format_change(current: float, previous: float) -> str:
+    if previous <= 0:
+        return ""
+    change = (current - previous) / previous * 100
+    return f" ({'+' if change >= 0 else ''}{change:.0f}%)"
+
+def render_trend(trend) -> str:
+    """Текст отчета о динамике расходов"""
+    def format_amount(num):
+        return f"{num:,.2f}".replace(',', ' ').replace('.', ',')
+    
+    text = (
+        "📈 *Динамика расходов*\n\n"
+        f"В среднем за день:\n"
+        f"• 7 дней: {format_amount(trend.avg7)}{format_change(trend.avg7, trend.avg30)}\n"
+        f"• 30 дней: {format_amount(trend.avg30)}{format_change(trend.avg30, trend.prev_avg30)}\n"
+        f"• предыдущие 30 дней: {format_amount(trend.prev_avg30)}\n\n"
+        f"Среднее за 7 дней, последние {len(trend.rolling7)} дн.:\n"
+        f"`{sparkline(trend.rolling7)}`\n\n"
+    )
+    
+    if trend.categories_30:
+        text += "*Категории за 30 дней:*\n"
+        top = sorted(trend.categories_30.items(), key=lambda item: item[1], reverse=True)[:5]
+        for name, amount in top:
+            previous = trend.categories_prev30.get(name, 0)
+            text += f"• {name}: {format_amount(amount)}{format_change(amount, previous)}\n"
+        text += "\n"
+    
+    text += "*Средний расход по дням недели:*\n"
+    for name, amount in zip(WEEKDAYS_RU, trend.weekday_avg):
+        text += f"• {name}: {format_amount(amount)}\n"
+    
+    months = list(zip(trend.months, trend.month_expense))[-12:]
+    text += (
+        f"\n*Расходы по месяцам ({MONTHS_RU[months[0][0][1]-1]} {months[0][0][0]} - "
+        f"{MONTHS_RU[months[-1][0][1]-1]} {months[-1][0][0]}):*\n"
+        f"`{sparkline([expense for _, expense in months])}`"
+    )
+    return text
 
 # Команда для удаления последней записи
 async def undo_last(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Удаляет последнюю запись"""
     user_id = update.effective_user.id
-    records = user_data_store.get(user_id, [])
+    last_record = storage.pop_record(user_id)
     
-    if not records:
+    if last_record is None:
         await update.message.reply_text("📭 Нет записей для удаления")
         return
     
-    last_record = records.pop()
-    
     await update.message.reply_text(
         f"↩️ *Последняя запись удалена:*\n\n"
-        f"🗑️ {last_record['type'].capitalize()}\n"
-        f"🏷️ {last_record['category']}\n"
-        f"💰 {last_record['amount']:,.2f}₽\n"
-        f"📅 {last_record['date']}",
+        f"🗑️ {last_record.type.capitalize()}\n"
+        f"🏷️ {last_record.category}\n"
+        f"💰 {last_record.amount:,.2f}₽\n"
+        f"📅 {last_record.date}",
         parse_mode="Markdown",
         reply_markup=TYPE_KEYBOARD
     )
@@ -325,7 +681,8 @@ async def set_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Пример: /goal Новая_машина 500000\n"
             "Пример: /goal Отпуск 100000\n\n"
             "Просмотреть цели: /goals\n"
-            "Удалить цель: /goal_remove [id]",
+            "Удалить цель: /goal\\_remove [id]\n"
+            "Автопополнение: /goal\\_auto [id] [процент]",
             parse_mode="Markdown"
         )
         return
@@ -335,16 +692,12 @@ async def set_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         goal_name = args[0]
         goal_amount = float(args[1])
         
-        if user_id not in user_goals:
-            user_goals[user_id] = {}
-        
-        goal_id = len(user_goals[user_id]) + 1
-        user_goals[user_id][goal_id] = {
+        goal_id = storage.add_goal(user_id, {
             'name': goal_name,
             'target': goal_amount,
             'saved': 0,
             'created': datetime.now().strftime("%d.%m.%Y")
-        }
+        })
         
         await update.message.reply_text(
             f"🎯 *Цель установлена!*\n\n"
@@ -361,26 +714,121 @@ async def set_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Просмотр целей
 async def show_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    goals = storage.get_goals(user_id)
     
-    if user_id not in user_goals or not user_goals[user_id]:
+    if not goals:
         await update.message.reply_text("🎯 У вас еще нет финансовых целей.")
         return
     
+    # Прогноз зависит от даты, поэтому она входит в ключ
+    today = datetime.now().date()
+    goals_text = render_cache.get_or_render(
+        (user_id, "goals", today),
+        storage.version(user_id),
+        lambda: render_goals(goals, storage.get_aggregates(user_id).savings, today)
+    )
+    
+    await update.message.reply_text(goals_text, parse_mode="Markdown")
+
+def goal_projection(goal, savings, today) -> str:
+    """Строка прогноза: когда цель будет достигнута при текущем темпе.
+    Темп берется из агрегатов за O(1), поэтому список целей строится за O(целей)."""
+    remaining = goal['target'] - goal['saved']
+    if remaining <= 0:
+        return "✅ Цель достигнута!"
+    now = time.time()
+    if goal.get('auto'):
+        rate = savings.income_per_day(now) * goal['auto']
+        source = f"{goal['auto'] * 100:.0f}% доходов"
+    else:
+        rate = savings.net_per_day(now)
+        source = "темп накоплений"
+    if rate <= 0:
+        return f"⏳ Прогноз: при текущем темпе ({source}) цель не будет достигнута"
+    days = math.ceil(remaining / rate)
+    if days > MAX_PROJECTION_DAYS:
+        return f"⏳ Прогноз: больше {MAX_PROJECTION_DAYS // 365} лет ({source} {rate:,.0f}/день)".replace(',', ' ')
+    eta = today + timedelta(days=days)
+    return f"⏳ Прогноз: {eta.strftime('%d.%m.%Y')} ({source} {rate:,.0f}/день)".replace(',', ' ')
+
+def render_goals(goals, savings, today) -> str:
+    """Текст со списком целей, прогрессом и прогнозом"""
     goals_text = "🎯 *Ваши финансовые цели:*\n\n"
     
-    for goal_id, goal in user_goals[user_id].items():
+    for goal_id, goal in goals.items():
         progress = (goal['saved'] / goal['target']) * 100 if goal['target'] > 0 else 0
-        progress_bar = "🟢" * int(progress / 10) + "⚪" * (10 - int(progress / 10))
+        filled = min(int(progress / 10), 10)
+        progress_bar = "🟢" * filled + "⚪" * (10 - filled)
         
         goals_text += (
             f"*ID {goal_id}: {goal['name']}*\n"
             f"Накоплено: {goal['saved']:,.2f} / {goal['target']:,.2f}\n"
             f"Прогресс: {progress:.1f}%\n"
             f"{progress_bar}\n"
-            f"Создана: {goal['created']}\n\n"
         ).replace(',', ' ')
+        goals_text += (
+            f"{goal_projection(goal, savings, today)}\n"
+            f"Создана: {goal['created']}\n\n"
+        )
     
-    await update.message.reply_text(goals_text, parse_mode="Markdown")
+    return goals_text
+
+# Команда /goal_auto [id] [процент] - автопополнение цели долей каждого дохода
+async def goal_auto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args
+    user_id = update.effective_user.id
+    
+    try:
+        goal_id = int(args[0])
+        percent = float(args[1])
+    except (TypeError, IndexError, ValueError):
+        await update.message.reply_text(
+            "🔁 *Автопополнение цели*\n\n"
+            "Использование: /goal\\_auto [id] [процент]\n"
+            "Пример: /goal\\_auto 1 10 - 10% каждого дохода в цель 1\n"
+            "Отключить: /goal\\_auto 1 0",
+            parse_mode="Markdown"
+        )
+        return
+    
+    goals = storage.get_goals(user_id)
+    if goal_id not in goals:
+        await update.message.reply_text("❌ Цель не найдена!")
+        return
+    if not 0 <= percent <= 100:
+        await update.message.reply_text("❌ Процент должен быть от 0 до 100")
+        return
+    
+    others = sum(goal.get('auto', 0) for other_id, goal in goals.items() if other_id != goal_id)
+    if others + percent / 100 > 1 + 1e-9:
+        await update.message.reply_text(
+            f"❌ Вместе с другими целями получится больше 100% дохода "
+            f"(уже распределено {others * 100:.0f}%)"
+        )
+        return
+    
+    goal = storage.update_goal(user_id, goal_id, auto=percent / 100)
+    if percent:
+        await update.message.reply_text(
+            f"🔁 В цель «{goal['name']}» будет уходить {percent:g}% каждого дохода."
+        )
+    else:
+        await update.message.reply_text(f"🔁 Автопополнение цели «{goal['name']}» отключено.")
+
+# Команда /goal_remove [id]
+async def goal_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    try:
+        goal_id = int(context.args[0])
+    except (TypeError, IndexError, ValueError):
+        await update.message.reply_text("Использование: /goal_remove [id]")
+        return
+    
+    goal = storage.remove_goal(user_id, goal_id)
+    if goal is None:
+        await update.message.reply_text("❌ Цель не найдена!")
+        return
+    await update.message.reply_text(f"🗑️ Цель «{goal['name']}» удалена.")
 
 # Добавление денег к цели
 async def add_to_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -399,13 +847,12 @@ async def add_to_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         goal_id = int(args[0])
         amount = float(args[1])
         
-        if user_id not in user_goals or goal_id not in user_goals[user_id]:
+        goals = storage.get_goals(user_id)
+        if goal_id not in goals:
             await update.message.reply_text("❌ Цель не найдена!")
             return
         
-        user_goals[user_id][goal_id]['saved'] += amount
-        
-        goal = user_goals[user_id][goal_id]
+        goal = storage.update_goal(user_id, goal_id, saved=goals[goal_id]['saved'] + amount)
         progress = (goal['saved'] / goal['target']) * 100
         
         await update.message.reply_text(
@@ -420,9 +867,6 @@ async def add_to_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except (ValueError, IndexError):
         await update.message.reply_text("❌ Неверные параметры!")
 
-# Глобальная переменная для регулярных платежей
-user_subscriptions: Dict[int, List] = {}
-
 # Команда для добавления регулярного платежа
 async def add_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
     args = context.args
@@ -432,8 +876,7 @@ async def add_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "🔄 *Добавить регулярный платеж*\n\n"
             "Использование: /subscribe [название] [сумма] [день месяца]\n"
             "Пример: /subscribe Netflix 599 15\n"
-            "Пример: /subscribe Интернет 890 1\n\n"
-            "Мои подписки: /subscriptions",
+            "Пример: /subscribe Интернет 890 1",
             parse_mode="Markdown"
         )
         return
@@ -448,47 +891,81 @@ async def add_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ День должен быть от 1 до 31!")
             return
         
-        if user_id not in user_subscriptions:
-            user_subscriptions[user_id] = []
-        
+        today = datetime.now().date()
         subscription = {
             'name': name,
             'amount': amount,
             'day': day,
-            'added': datetime.now().strftime("%d.%m.%Y")
+            'added': today.strftime("%d.%m.%Y"),
+            # Первое списание - в следующий день платежа, не сегодня
+            'posted': today.isoformat()
         }
         
-        user_subscriptions[user_id].append(subscription)
+        index = storage.add_subscription(user_id, subscription)
+        subscription_calendar.add(user_id, index, day)
         
         await update.message.reply_text(
             f"✅ *Регулярный платеж добавлен!*\n\n"
             f"Название: {name}\n"
             f"Сумма: {amount:,.2f}\n"
             f"Списание каждый: {day} число\n"
-            f"Добавлено: {datetime.now().strftime('%d.%m.%Y')}",
+            f"Первое списание: {next_billing_date(day, today).strftime('%d.%m.%Y')}",
             parse_mode="Markdown"
         )
         
     except ValueError:
         await update.message.reply_text("❌ Неверные параметры!")
 
-# Проверка регулярных платежей (можно запускать по расписанию)
+# Списание регулярных платежей: раз в день берет подписки с наступившим
+# днем платежа, записывает расходы и рассылает напоминания
 async def check_subscriptions(context: ContextTypes.DEFAULT_TYPE):
-    today = datetime.now()
-    
-    if today.day == 1:  # Проверяем 1 числа каждого месяца
-        for user_id, subscriptions in user_subscriptions.items():
-            total = sum(sub['amount'] for sub in subscriptions)
-            
-            if total > 0:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📅 *Напоминание о регулярных платежах*\n\n"
-                        f"В этом месяце к оплате:\n"
-                        f"Общая сумма: {total:,.2f}\n\n"
-                        f"Не забудьте внести эти платежи!",
-                    parse_mode="Markdown"
-                )
+    now = datetime.now()
+    today = now.date()
+    # До времени списания сегодняшние платежи еще не наступили
+    if now.hour * 60 + now.minute < SUBSCRIPTION_TIME:
+        today -= timedelta(days=1)
+    
+    # Курсор задачи в памяти; после перезапуска проходим последние
+    # MAX_CATCH_UP_DAYS дней, а повторы отсекает отметка posted подписки
+    state = context.job.data
+    last_day = state.get("last_day", date.min)
+    state["last_day"] = today
+    
+    # Все записи делаются без await между ними и уходят на диск одной пачкой
+    posted, alerts = {}, {}
+    for day in days_to_post(last_day, today):
+        ts = min(day_start(day) + SUBSCRIPTION_TIME * 60, int(now.timestamp()))
+        for user_id, index in subscription_calendar.due(day):
+            subscription = storage.subscriptions[user_id][index]
+            if last_posted(subscription) >= day:
+                continue
+            record = storage.add_record(user_id, "расход", SUBSCRIPTION_CATEGORY, subscription["amount"], ts)
+            storage.update_subscription(user_id, index, posted=day.isoformat())
+            posted.setdefault(user_id, []).append((day, subscription))
+            alerts[user_id] = alerts.get(user_id, "") + budget_alerts(user_id, record)
+    
+    messages = [
+        OutgoingMessage(chat_id=user_id, text=subscriptions_text(payments) + alerts[user_id],
+                        parse_mode="Markdown")
+        for user_id, payments in posted.items()
+    ]
+    if messages:
+        logger.info("Списано регулярных платежей: %d у %d пользователей",
+                    sum(map(len, posted.values())), len(posted))
+        await broadcaster.broadcast(context.bot, messages, progress=log_progress)
+
+def subscriptions_text(payments) -> str:
+    lines = [
+        f"• {subscription['name']}: {subscription['amount']:,.2f} ({day.strftime('%d.%m')})"
+        for day, subscription in payments
+    ]
+    total = sum(subscription['amount'] for _, subscription in payments)
+    return (
+        "📅 *Регулярные платежи*\n\n"
+        + "\n".join(lines)
+        + f"\n\nИтого: {total:,.2f}\n"
+        "Платежи записаны в расходы."
+    )
 
 # Обработка выбора из главного меню
 async def handle_type_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -497,6 +974,8 @@ async def handle_type_selection(update: Update, context: ContextTypes.DEFAULT_TY
     # Добавьте в начало функции перед другими проверками:
     if "Быстрый расход" in text:
         return await quick_expense_menu(update, context)
+    if text in QUICK_BUTTONS:
+        return await handle_quick_expense(update, context)
     user_id = update.effective_user.id
     
     # Очищаем временные данные при новом запуске
@@ -623,30 +1102,27 @@ async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if "да" in text or "✅" in text:
         user_id = update.effective_user.id
         
-        # Создаем запись
-        record = {
-            "type": context.user_data.get("type", ""),
-            "category": context.user_data.get("category", ""),
-            "amount": context.user_data.get("amount", 0),
-            "date": datetime.now().strftime("%d.%m.%Y %H:%M"),
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Сохраняем в хранилище
-        if user_id not in user_data_store:
-            user_data_store[user_id] = []
-        user_data_store[user_id].append(record)
+        # Создаем запись и сохраняем в хранилище
+        record = storage.add_record(
+            user_id,
+            context.user_data.get("type", ""),
+            context.user_data.get("category", ""),
+            context.user_data.get("amount", 0)
+        )
+        # Пополнения целей, которые хранилище сделало из этого дохода
+        allocations = storage.last_allocations(user_id, len(storage.get_records(user_id)) - 1)
         
         # Форматируем сумму для сообщения
-        amount = record["amount"]
+        amount = record.amount
         formatted_amount = f"{amount:,.2f}".replace(',', ' ').replace('.', ',')
         
         await update.message.reply_text(
             f"✅ *Запись успешно сохранена!*\n\n"
-            f"📌 {record['type'].capitalize()}\n"
-            f"🏷️ {record['category']}\n"
+            f"📌 {record.type.capitalize()}\n"
+            f"🏷️ {record.category}\n"
             f"💰 {formatted_amount}\n"
-            f"📅 {record['date']}",
+            f"📅 {record.date}" + format_allocations(user_id, allocations)
+            + budget_alerts(user_id, record),
             reply_markup=TYPE_KEYBOARD,
             parse_mode="Markdown"
         )
@@ -661,12 +1137,20 @@ async def handle_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     return TYPE_SELECTION
 
+def format_allocations(user_id: int, allocations) -> str:
+    goals = storage.get_goals(user_id)
+    lines = [
+        f"\n🎯 {goals[goal_id]['name']}: +{amount:,.2f}".replace(',', ' ')
+        for goal_id, amount in allocations if goal_id in goals
+    ]
+    return "\n" + "".join(lines) if lines else ""
+
 # Статистика
 async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    records = user_data_store.get(user_id, [])
+    aggregates = storage.get_aggregates(user_id)
     
-    if not records:
+    if not aggregates.count:
         await update.message.reply_text(
             "📭 Записей пока нет.\n"
             "Начните добавлять доходы и расходы!",
@@ -674,38 +1158,34 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return TYPE_SELECTION
     
-    # Сегодняшняя дата
-    today = datetime.now().strftime("%d.%m.%Y")
+    # Сегодняшняя дата входит в ключ: после полуночи текст другой
+    today = datetime.now().date()
+    stats_text = render_cache.get_or_render(
+        (user_id, "stats", today),
+        storage.version(user_id),
+        lambda: render_statistics(user_id, today)
+    )
+    
+    await update.message.reply_text(
+        stats_text,
+        reply_markup=TYPE_KEYBOARD,
+        parse_mode="Markdown"
+    )
+    return TYPE_SELECTION
+
+def render_statistics(user_id: int, day) -> str:
+    """Текст общей статистики"""
+    aggregates = storage.get_aggregates(user_id)
+    today = day.strftime("%d.%m.%Y")
     
-    total_expense = 0
-    total_income = 0
-    today_expense = 0
-    today_income = 0
+    # Итоги берем из агрегатов, без прохода по записям
+    total_expense = aggregates.total("расход")
+    total_income = aggregates.total("доход")
+    today_expense = aggregates.day_total("расход", day)
+    today_income = aggregates.day_total("доход", day)
     
     # Анализ по категориям
-    expense_categories = {}
-    income_categories = {}
-    
-    for record in records:
-        amount = record["amount"]
-        
-        if record["type"] == "расход":
-            total_expense += amount
-            if record["date"].startswith(today):
-                today_expense += amount
-            
-            # Собираем по категориям расходов
-            cat = record["category"]
-            expense_categories[cat] = expense_categories.get(cat, 0) + amount
-            
-        else:  # доход
-            total_income += amount
-            if record["date"].startswith(today):
-                today_income += amount
-            
-            # Собираем по категориям доходов
-            cat = record["category"]
-            income_categories[cat] = income_categories.get(cat, 0) + amount
+    expense_categories = aggregates.categories("расход")
     
     balance = total_income - total_expense
     
@@ -731,23 +1211,60 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📅 *За сегодня ({today}):*\n"
         f"📈 Доходы: {format_amount(today_income)}\n"
         f"📉 Расходы: {format_amount(today_expense)}\n\n"
-        f"📝 Всего записей: {len(records)}\n"
+        f"📝 Всего записей: {aggregates.count}\n"
     )
     
     if top_expenses:
         stats_text += top_expenses
     
+    return stats_text
+
+# Команда /stats [с] [по] - статистика за произвольный период
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args
+    
+    if not args:
+        return await show_statistics(update, context)
+    
+    try:
+        first = datetime.strptime(args[0], "%d.%m.%Y").date()
+        last = datetime.strptime(args[1], "%d.%m.%Y").date() if len(args) > 1 else datetime.now().date()
+    except ValueError:
+        await update.message.reply_text(
+            "📊 *Статистика за период*\n\n"
+            "Использование: /stats [с] [по]\n"
+            "Пример: /stats 01.09.2026 30.09.2026\n"
+            "Без дат - общая статистика",
+            parse_mode="Markdown"
+        )
+        return
+    
+    if first > last:
+        first, last = last, first
+    
+    records = storage.get_records(update.effective_user.id)
+    t0, t1 = day_range(first, last)
+    income, income_count = records.range_total("доход", t0, t1)
+    expense, expense_count = records.range_total("расход", t0, t1)
+    
+    def format_amount(num):
+        return f"{num:,.2f}".replace(',', ' ').replace('.', ',')
+    
     await update.message.reply_text(
-        stats_text,
+        f"📊 *Статистика с {first.strftime('%d.%m.%Y')} по {last.strftime('%d.%m.%Y')}*\n\n"
+        f"📈 Доходы: {format_amount(income)} ({income_count} зап.)\n"
+        f"📉 Расходы: {format_amount(expense)} ({expense_count} зап.)\n"
+        f"💼 Баланс: *{format_amount(income - expense)}*",
         reply_markup=TYPE_KEYBOARD,
         parse_mode="Markdown"
     )
-    return TYPE_SELECTION
 
 # История операций
+HISTORY_PAGE = 15
+
 async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    records = user_data_store.get(user_id, [])
+    records = storage.get_records(user_id)
     
     if not records:
         await update.message.reply_text(
@@ -757,28 +1274,258 @@ async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return TYPE_SELECTION
     
-    # Показываем последние 15 записей
-    recent_records = records[-15:]
-    history_text = "📜 *Последние операции:*\n\n"
-    
-    for record in reversed(recent_records):
-        icon = "📈" if record["type"] == "доход" else "📉"
-        color = "🟢" if record["type"] == "доход" else "🔴"
-        
-        formatted_amount = f"{record['amount']:,.2f}".replace(',', ' ').replace('.', ',')
-        
-        history_text += (
-            f"{color} {icon} *{record['date']}*\n"
-            f"   {record['category']}: {formatted_amount}\n\n"
-        )
+    # Первая страница - последние записи; листание - кнопками под сообщением
+    stop = len(records)
+    history_text = render_cache.get_or_render(
+        (user_id, "history", stop),
+        storage.version(user_id),
+        lambda: render_history(records, stop)
+    )
     
     await update.message.reply_text(
         history_text,
-        reply_markup=TYPE_KEYBOARD,
+        reply_markup=history_keyboard(records, stop) or TYPE_KEYBOARD,
         parse_mode="Markdown"
     )
     return TYPE_SELECTION
 
+def history_page(records, stop: int):
+    """Позиции страницы, заканчивающейся перед stop"""
+    stop = max(min(stop, len(records)), 0)
+    return max(stop - HISTORY_PAGE, 0), stop
+
+def history_keyboard(records, stop: int):
+    """Кнопки листания. Курсор - позиция границы страницы в ledger:
+    записи только дописываются в конец, поэтому позиция не съезжает,
+    и страница читается за O(размера страницы)."""
+    start, stop = history_page(records, stop)
+    buttons = []
+    if start > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Старше", callback_data=f"hist:{start}"))
+    if stop < len(records):
+        buttons.append(InlineKeyboardButton("Новее ➡️", callback_data=f"hist:{stop + HISTORY_PAGE}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def history_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки "Старше"/"Новее" под историей"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    records = storage.get_records(user_id)
+    try:
+        stop = int(query.data.split(":", 1)[1])
+    except (IndexError, ValueError):
+        await query.answer()
+        return
+    
+    if not records:
+        await query.answer("История пуста")
+        return
+    
+    start, stop = history_page(records, stop)
+    history_text = render_cache.get_or_render(
+        (user_id, "history", stop),
+        storage.version(user_id),
+        lambda: render_history(records, stop)
+    )
+    await query.answer()
+    try:
+        await query.edit_message_text(
+            history_text,
+            reply_markup=history_keyboard(records, stop),
+            parse_mode="Markdown"
+        )
+    except BadRequest as e:
+        # Повторное нажатие на ту же страницу
+        if "not modified" not in str(e).lower():
+            raise
+
+def render_history(records, stop: int) -> str:
+    """Текст страницы истории, от новых записей к старым"""
+    start, stop = history_page(records, stop)
+    if stop == len(records):
+        history_text = "📜 *Последние операции:*\n\n"
+    else:
+        history_text = f"📜 *Операции {len(records) - stop + 1}-{len(records) - start} из {len(records)}:*\n\n"
+    
+    for record in reversed(list(records.iter_records(start, stop))):
+        history_text += format_history_record(record)
+    
+    return history_text
+
+def format_history_record(record) -> str:
+    icon = "📈" if record.type == "доход" else "📉"
+    color = "🟢" if record.type == "доход" else "🔴"
+    
+    formatted_amount = f"{record.amount:,.2f}".replace(',', ' ').replace('.', ',')
+    
+    return (
+        f"{color} {icon} *{record.date}*\n"
+        f"   {record.category}: {formatted_amount}\n\n"
+    )
+
+# Команда /search [текст] [от-до] - поиск по категории и диапазону сумм
+SEARCH_LIMIT = 20
+
+def parse_amount_range(text: str):
+    """Диапазон "100-500", "100-" или "-500" -> (мин, макс) в копейках;
+    None, если аргумент не диапазон"""
+    low, sep, high = text.replace(",", ".").partition("-")
+    if not sep or not (low or high):
+        return None
+    try:
+        return (to_kopecks(float(low)) if low else None,
+                to_kopecks(float(high)) if high else None)
+    except ValueError:
+        return None
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    args = list(context.args or [])
+    
+    amount_range = parse_amount_range(args[-1]) if args else None
+    if amount_range is not None:
+        args.pop()
+    query_text = " ".join(args).strip().lower()
+    
+    if not query_text and amount_range is None:
+        await update.message.reply_text(
+            "🔎 *Поиск операций*\n\n"
+            "Использование: /search [категория] [от-до]\n"
+            "Пример: /search еда\n"
+            "Пример: /search такси 300-1000\n"
+            "Пример: /search 5000-",
+            parse_mode="Markdown"
+        )
+        return
+    
+    records = storage.get_records(user_id)
+    category_ids = None
+    if query_text:
+        # Подходящие по подстроке - среди категорий самого пользователя
+        category_ids = [
+            category_id for category_id in records.postings
+            if query_text in categories.name(category_id).lower()
+        ]
+    low, high = amount_range or (None, None)
+    found, count, total_kop = records.search(category_ids, low, high, SEARCH_LIMIT)
+    
+    if not count:
+        await update.message.reply_text("🔎 Ничего не найдено.", reply_markup=TYPE_KEYBOARD)
+        return
+    
+    formatted_total = f"{total_kop / 100:,.2f}".replace(',', ' ').replace('.', ',')
+    text = f"🔎 *Найдено: {count}, на сумму {formatted_total}*\n"
+    if count > len(found):
+        text += f"Последние {len(found)}:\n"
+    text += "\n" + "".join(format_history_record(record) for record in found)
+    await update.message.reply_text(text, reply_markup=TYPE_KEYBOARD, parse_mode="Markdown")
+
+def format_money(kop: int) -> str:
+    return f"{kop / 100:,.0f}₽".replace(',', ' ')
+
+def format_budget(status) -> str:
+    icon = "🚨" if status.percent >= 100 else "⚠️" if status.percent >= min(BUDGET_ALERTS, default=100) else "✅"
+    return (
+        # Название - текст пользователя, а ответы идут с разметкой Markdown
+        f"{icon} {escape_markdown(status.category)}: {format_money(status.spent_kop)} из "
+        f"{format_money(status.limit_kop)} {PERIODS[status.period]} ({status.percent:.0f}%)"
+    )
+
+def budget_alerts(user_id: int, record) -> str:
+    """Пороги бюджета, пройденные записью record: текст для ответа или пустая строка"""
+    tracker = storage.budget_tracker(user_id)
+    if tracker is None or record.type != "расход":
+        return ""
+    key = category_key(record.category)
+    if key not in tracker.budgets:
+        return ""
+    status = tracker.status(key, storage.get_records(user_id), int(time.time()))
+    counter = tracker.counters[key]
+    # Запись задним числом из прошлого периода текущий бюджет не трогает
+    if not counter.start <= record.ts < counter.end:
+        return ""
+    percents = crossed(status.limit_kop, status.spent_kop - record.amount_kop,
+                       status.spent_kop, BUDGET_ALERTS)
+    if not percents:
+        return ""
+    if percents[-1] >= 100:
+        headline = f"🚨 *Бюджет превышен* ({percents[-1]}%)"
+    else:
+        headline = f"⚠️ *Израсходовано {percents[-1]}% бюджета*"
+    return f"\n\n{headline}\n{format_budget(status)}"
+
+# Название категории для бюджета: кнопка меню с тем же ключом или текст как есть
+def budget_category(text: str) -> str:
+    key = category_key(text)
+    for row in EXPENSE_CATEGORIES:
+        for button in row:
+            if category_key(button) == key:
+                return button
+    return text.strip().capitalize()
+
+# Команда /budget [категория] [сумма] [day|week|month] - бюджет категории
+async def budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    args = list(context.args or [])
+    
+    if not args:
+        tracker = storage.budget_tracker(user_id)
+        if tracker is None:
+            await update.message.reply_text(
+                "💼 *Бюджеты*\n\n"
+                "Использование: /budget [категория] [сумма] [день|неделя|месяц]\n"
+                "Пример: /budget Еда 5000 неделя\n"
+                "Пример: /budget Такси 3000 month\n"
+                "Удалить: /budget Еда off",
+                parse_mode="Markdown"
+            )
+            return
+        records = storage.get_records(user_id)
+        now = int(time.time())
+        await update.message.reply_text(
+            "💼 *Ваши бюджеты:*\n\n" + "\n".join(
+                format_budget(tracker.status(key, records, now)) for key in tracker.budgets
+            ),
+            parse_mode="Markdown"
+        )
+        return
+    
+    if len(args) >= 2 and args[-1].lower() in ("off", "выкл", "0"):
+        key = category_key(" ".join(args[:-1]))
+        if key not in storage.get_budgets(user_id):
+            await update.message.reply_text("❌ Бюджета для этой категории нет.")
+            return
+        storage.set_budget(user_id, key, None)
+        await update.message.reply_text("🗑️ Бюджет удален.")
+        return
+    
+    period = PERIOD_ALIASES.get(args[-1].lower())
+    if period is not None:
+        args.pop()
+    try:
+        amount = float(args[-1].replace(",", "."))
+        text = " ".join(args[:-1])
+        key = category_key(text)
+        if not key or amount <= 0 or period is None:
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "❌ Неверные параметры! Пример: /budget Еда 5000 неделя"
+        )
+        return
+    
+    storage.set_budget(user_id, key, {
+        "category": budget_category(text),
+        "limit": to_kopecks(amount),
+        "period": period,
+    })
+    status = storage.budget_tracker(user_id).status(key, storage.get_records(user_id), int(time.time()))
+    await update.message.reply_text(
+        f"✅ *Бюджет установлен!*\n\n{format_budget(status)}\n"
+        f"Уведомления: {', '.join(f'{percent}%' for percent in BUDGET_ALERTS)}",
+        parse_mode="Markdown"
+    )
+
 # Команда /help
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = (
@@ -794,7 +1541,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "4. Подтвердите запись\n\n"
         "*Дополнительно:*\n"
         "• Статистика - обзор финансов\n"
-        "• История - последние операции"
+        "• История - последние операции\n"
+        "• /monthly [N] - итоги за N последних месяцев\n"
+        "• /trend - динамика расходов\n"
+        "• /chart - графики по категориям и месяцам\n"
+        "• /search - поиск по категории и сумме\n"
+        "• /budget - бюджеты по категориям\n"
+        "• /subscribe - регулярные платежи\n"
+        "• /digest - ежедневный дайджест расходов\n"
+        "• /import - импорт операций из CSV"
     )
     
     await update.message.reply_text(
@@ -822,22 +1577,12 @@ async def quick_expense(update: Update, context: ContextTypes.DEFAULT_TYPE):
         category = args[1] if len(args) > 1 else "Другое"
         
         # Сохраняем запись
-        record = {
-            "type": "расход",
-            "category": category,
-            "amount": amount,
-            "date": datetime.now().strftime("%d.%m.%Y %H:%M"),
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        if user_id not in user_data_store:
-            user_data_store[user_id] = []
-        user_data_store[user_id].append(record)
+        record = storage.add_record(user_id, "расход", category, amount)
         
         await update.message.reply_text(
             f"✅ *Быстрая запись сохранена!*\n\n"
             f"📉 Расход: {category}\n"
-            f"💰 {amount:,.2f}",
+            f"💰 {amount:,.2f}" + budget_alerts(user_id, record),
             parse_mode="Markdown"
         )
         
@@ -864,14 +1609,14 @@ async def unknown_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 def get_top_habits(user_id):
-    records = user_data_store.get(user_id, [])
+    records = storage.get_records(user_id)
     if len(records) < 5:
         return None
     
     expense_categories = {}
     for r in records:
-        if r["type"] == "расход":
-            expense_categories[r["category"]] = expense_categories.get(r["category"], 0) + 1
+        if r.type == "расход":
+            expense_categories[r.category] = expense_categories.get(r.category, 0) + 1
     
     return
 
@@ -883,39 +1628,206 @@ async def setup_commands(application: Application):
         ("quick", "Быстрый расход"),
         ("stats", "Статистика"),
         ("history", "История"),
+        ("monthly", "Статистика по месяцам"),
+        ("trend", "Динамика расходов"),
+        ("chart", "Графики"),
+        ("search", "Поиск операций"),
+        ("budget", "Бюджеты по категориям"),
         ("export", "Экспорт данных"),
         ("undo", "Отменить последнюю запись"),
         ("goals", "Мои цели"),
-        ("subscriptions", "Мои подписки")
+        ("subscribe", "Регулярные платежи"),
+        ("digest", "Ежедневный дайджест"),
+        ("import", "Импорт из CSV")
     ]
     
-    await application.bot.set_my_commands(commands)
+    try:
+        await application.bot.set_my_commands(commands)
+    except Exception:
+        # Меню команд - удобство, без него бот работает
+        logger.exception("Не удалось обновить меню команд")
 
-async def daily_digest(context: ContextTypes.DEFAULT_TYPE):
-    user_id = context.job.user_id
-    records = user_data_store.get(user_id, [])
-    
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%d.%m.%Y")
-    daily_expenses = sum(r["amount"] for r in records 
-                        if r["type"] == "расход" and r["date"].startswith(yesterday))
-    
-    await context.bot.send_message(
-        chat_id=user_id,
-        text=f"📊 *Доброе утро!*\n\n"
-             f"Вчера потрачено: *{daily_expenses:,.0f}₽*\n"
-             f"Сегодня {datetime.now().strftime('%d.%m.%Y')} - удачного дня!",
-        parse_mode="Markdown"
+# Команда /digest [on|off|чч:мм] - настройка ежедневного дайджеста
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    args = context.args
+    
+    if not args:
+        minute = digest_schedule.get(user_id)
+        status = f"включен, в {format_minute(minute)}" if minute is not None else "выключен"
+        await update.message.reply_text(
+            f"📬 *Ежедневный дайджест* {status}\n\n"
+            "Использование: /digest on | off | [чч:мм]\n"
+            "Пример: /digest 08:30",
+            parse_mode="Markdown"
+        )
+        return
+    
+    choice = args[0].lower()
+    if choice == "off":
+        minute = None
+    elif choice == "on":
+        minute = digest_schedule.get(user_id)
+        if minute is None:
+            minute = DEFAULT_MINUTE
+    else:
+        try:
+            minute = parse_minute(choice)
+        except ValueError:
+            await update.message.reply_text("❌ Укажите время в формате чч:мм, например 08:30")
+            return
+    
+    storage.set_digest_minute(user_id, minute)
+    digest_schedule.set(user_id, minute)
+    
+    if minute is None:
+        await update.message.reply_text("📭 Дайджест выключен")
+    else:
+        await update.message.reply_text(f"📬 Дайджест будет приходить каждый день в {format_minute(minute)}")
+
+# Команда /profile - профилирование обновлений (только для администраторов)
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return await unknown_message(update, context)
+    
+    args = context.args
+    choice = args[0].lower() if args else ""
+    
+    if choice == "on":
+        try:
+            rate = float(args[1]) if len(args) > 1 else 0.1
+        except ValueError:
+            await update.message.reply_text("❌ Доля должна быть числом от 0 до 1")
+            return
+        profiler.enable(rate)
+        await update.message.reply_text(f"🔬 Профилирование включено, доля {profiler.sample_rate:.0%}")
+    elif choice == "off":
+        profiler.disable()
+        await update.message.reply_text("🔬 Профилирование выключено")
+    elif choice == "clear":
+        profiler.clear()
+        await update.message.reply_text("🔬 Список медленных обновлений очищен")
+    elif choice == "top":
+        slowest = profiler.slowest()
+        if not slowest:
+            await update.message.reply_text("🔬 Медленных обновлений пока нет")
+            return
+        lines = [f"🔬 Самые медленные обновления ({profiler.profiled} из {profiler.seen} с профилем):", ""]
+        for number, item in enumerate(slowest, 1):
+            mark = " 📄" if item.profile else ""
+            lines.append(f"{number}. {item.seconds * 1000:.0f} мс, {item.user_id}: {item.summary}{mark}")
+        await update.message.reply_text("\n".join(lines))
+    elif choice == "get":
+        slowest = profiler.slowest()
+        try:
+            item = slowest[int(args[1]) - 1]
+        except (IndexError, ValueError):
+            await update.message.reply_text("❌ Укажите номер из /profile top")
+            return
+        if item.profile is None:
+            await update.message.reply_text("📭 Это обновление прошло без профиля")
+            return
+        header = f"{item.seconds * 1000:.0f} мс, пользователь {item.user_id}: {item.summary}\n"
+        if item.dump_path:
+            header += f"файл: {item.dump_path}\n"
+        await update.message.reply_document(
+            document=InputFile((header + "\n" + item.stats()).encode("utf-8"), filename="profile.txt")
+        )
+    elif choice == "mem":
+        if len(args) > 1 and args[1].lower() == "off":
+            stop_tracing()
+            await update.message.reply_text("🔬 tracemalloc выключен")
+            return
+        # Снимок tracemalloc обходит всю кучу, не держим цикл событий
+        report = await asyncio.to_thread(memory_report, storage.records)
+        await update.message.reply_document(
+            document=InputFile(report.encode("utf-8"), filename="memory.txt")
+        )
+    else:
+        status = f"включено, доля {profiler.sample_rate:.0%}" if profiler.enabled else "выключено"
+        await update.message.reply_text(
+            f"🔬 Профилирование {status}\n\n"
+            "/profile on [доля] - включить (например, 0.1)\n"
+            "/profile off - выключить\n"
+            "/profile top - самые медленные обновления\n"
+            "/profile get <номер> - профиль обновления\n"
+            "/profile clear - очистить список\n"
+            "/profile mem [off] - снимок памяти / выключить tracemalloc"
+        )
+
+def digest_text(user_id: int, yesterday) -> str:
+    daily_expenses = storage.get_aggregates(user_id).day_total("расход", yesterday)
+    return (
+        f"📊 *Доброе утро!*\n\n"
+        f"Вчера потрачено: *{daily_expenses:,.0f}₽*\n"
+        f"Сегодня {datetime.now().strftime('%d.%m.%Y')} - удачного дня!"
     )
 
-# Основная функция
-def main():
-    # Проверка токена
-    if TOKEN == "ВАШ_ТОКЕН_ЗДЕСЬ":
-        logger.error("Токен бота не установлен! Укажите TELEGRAM_BOT_TOKEN в переменных окружения.")
-        return
+# Одна задача на всех: раз в минуту рассылает дайджест тем, чья минута наступила
+async def daily_digest(context: ContextTypes.DEFAULT_TYPE):
+    now = datetime.now()
+    minute = now.hour * 60 + now.minute
+    
+    # Догоняем минуты, пропущенные из-за задержки задачи
+    state = context.job.data
+    last = state.get("last_minute")
+    if last is None or (minute - last) % MINUTES_PER_DAY > MAX_CATCH_UP:
+        last = (minute - 1) % MINUTES_PER_DAY
+    state["last_minute"] = minute
+    
+    # Дневные итоги уже посчитаны в агрегатах, проход по записям не нужен
+    yesterday = (now - timedelta(days=1)).date()
+    messages = [
+        OutgoingMessage(user_id, digest_text(user_id, yesterday), parse_mode="Markdown")
+        for user_id in digest_schedule.due(last, minute)
+    ]
     
-    # Создаем Application
-    application = Application.builder().token(TOKEN).build()
+    if messages:
+        await broadcaster.broadcast(context.bot, messages, progress=log_progress)
+
+# Запуск и остановка хранилища вместе с приложением
+async def on_startup(application: Application):
+    await storage.start()
+    if isinstance(application.persistence, SQLitePersistence):
+        await application.persistence.start()
+    for user_id, minute in storage.digest_minutes.items():
+        digest_schedule.set(user_id, minute)
+    subscription_calendar.load(storage.subscriptions)
+    await setup_commands(application)
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = await metrics.start_server(METRICS_LISTEN, METRICS_PORT)
+
+async def on_shutdown(application: Application):
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    chart_renderer.shutdown()
+    await storage.close()
+
+# Создание приложения со всеми обработчиками и задачами
+def build_application(token: str, base_url: str = BOT_API_URL,
+                      max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+                      persistence: Optional[BasePersistence] = None) -> Application:
+    builder = Application.builder()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = (
+        builder
+        .token(token)
+        .base_url(base_url)
+        # Запросы к Bot API и задачи JobQueue с замером времени
+        .request(outbound.pooled_request(
+            BOT_API_POOL_SIZE, BOT_API_CONNECT_TIMEOUT, BOT_API_READ_TIMEOUT,
+            BOT_API_WRITE_TIMEOUT, BOT_API_POOL_TIMEOUT, BOT_API_KEEPALIVE, BOT_API_HTTP_VERSION
+        ))
+        .job_queue(metrics.InstrumentedJobQueue())
+        # Разные пользователи параллельно, один пользователь - по порядку
+        .concurrent_updates(ProfilingUpdateProcessor(max_concurrent_updates, profiler))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # ConversationHandler для добавления записей
     conv_handler = ConversationHandler(
@@ -943,37 +1855,141 @@ def main():
             CommandHandler("start", start),
             CommandHandler("help", help_command)
         ],
+        # Состояние переживает перезапуск, если задан persistence
+        name="finance_conversation",
+        persistent=persistence is not None,
     )
     
     # Регистрируем обработчики
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("history", show_history))
+    application.add_handler(CommandHandler("monthly", monthly_statistics))
+    application.add_handler(CommandHandler("trend", trend_command))
+    application.add_handler(CommandHandler("chart", chart_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("budget", budget_command))
+    application.add_handler(CallbackQueryHandler(history_callback, pattern=r"^hist:"))
     application.add_handler(CommandHandler("export", export_data))
     application.add_handler(CommandHandler("goal", set_goal))
     application.add_handler(CommandHandler("goals", show_goals))
     application.add_handler(CommandHandler("goal_add", add_to_goal))
+    application.add_handler(CommandHandler("goal_auto", goal_auto))
+    application.add_handler(CommandHandler("goal_remove", goal_remove))
     application.add_handler(CommandHandler("subscribe", add_subscription))
     
     
     # Добавим JobQueue для проверки подписок
     job_queue = application.job_queue
     if job_queue:
-        # Проверка каждое 1 число месяца в 10:00
-        job_queue.run_monthly(
+        # Списание подписок каждый день; при старте - сразу, чтобы догнать простой.
+        # Обе задачи делят курсор последнего обработанного дня
+        subscription_state = {}
+        job_queue.run_once(check_subscriptions, when=0, data=subscription_state)
+        job_queue.run_daily(
             check_subscriptions,
-            when=datetime.time(hour=10, minute=0),
-            day=1
+            time=dt_time(hour=SUBSCRIPTION_TIME // 60, minute=SUBSCRIPTION_TIME % 60),
+            data=subscription_state
+        )
+        # Дайджест: одна задача в начале каждой минуты
+        job_queue.run_repeating(
+            daily_digest,
+            interval=60,
+            first=60 - datetime.now().second,
+            data={}
         )
-    # Обработчик для неизвестных сообщений (должен быть последним)
-    application.add_handler(MessageHandler(filters.ALL, unknown_message))
-    # В main() после создания application добавьте:
     application.add_handler(CommandHandler("quick", quick_expense_menu))
     application.add_handler(CommandHandler("undo", undo_last))
-    logger.info("Бот запущен...")
+    application.add_handler(CommandHandler("ex", quick_expense))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CommandHandler("digest", digest_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(MessageHandler(filters.Document.ALL, import_document))
+    # Обработчик для неизвестных сообщений (должен быть последним)
+    application.add_handler(MessageHandler(filters.ALL, unknown_message))
+    
+    # Метрики на все обработчики сразу, включая состояния диалога
+    metrics.instrument_handlers(application, STATE_NAMES)
+    return application
+
+# Точка входа процесса-шарда: свое хранилище и свои задачи JobQueue
+def run_shard(index: int, shards: int, inbox):
+    global storage, broadcaster, METRICS_PORT
+    ignore_interrupts()
     
+    storage = create_storage(
+        STORAGE_BACKEND, shard_path(STORAGE_PATH, index), snapshot_interval=SNAPSHOT_INTERVAL
+    )
+    # Лимит Telegram на рассылку общий для бота - делим его между шардами
+    broadcaster = Broadcaster(global_rate=GLOBAL_RATE / shards)
+    if METRICS_PORT:
+        METRICS_PORT += index
+    persistence = None
+    if PERSISTENCE_PATH:
+        persistence = SQLitePersistence(
+            shard_path(PERSISTENCE_PATH, index), update_interval=PERSISTENCE_INTERVAL
+        )
+    logger.info(f"Шард {index} из {shards}: хранилище {STORAGE_BACKEND}")
+    
+    application = build_application(TOKEN, persistence=persistence)
+    asyncio.run(serve_shard(application, inbox))
+
+def run_sharded():
+    """Фронт: принимает обновления и раздает их шардам по user_id"""
+    pool = ShardPool(SHARDS, run_shard)
+    pool.start()
+    try:
+        if BOT_MODE == "webhook":
+            asyncio.run(run_front_webhook(
+                pool, TOKEN, BOT_API_URL,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                webhook_url=WEBHOOK_URL
+            ))
+        else:
+            asyncio.run(run_front_polling(pool, TOKEN, BOT_API_URL))
+    finally:
+        pool.stop()
+
+# Основная функция
+def main():
+    global storage
+    
+    # Проверка токена
+    if not TOKEN or TOKEN == "ВАШ_ТОКЕН_ЗДЕСЬ":
+        logger.error("Токен бота не установлен! Укажите TELEGRAM_BOT_TOKEN в переменных окружения.")
+        return
+    
+    if SHARDS > 1:
+        logger.info(f"Бот запущен в режиме {BOT_MODE}, шардов: {SHARDS}...")
+        run_sharded()
+        return
+    
+    storage = create_storage(STORAGE_BACKEND, STORAGE_PATH, snapshot_interval=SNAPSHOT_INTERVAL)
+    logger.info(f"Хранилище: {STORAGE_BACKEND}")
+    
+    logger.info(f"Бот запущен в режиме {BOT_MODE}...")
     
     # Запускаем бота
-    application.run_polling(drop_pending_updates=True)
+    persistence = None
+    if PERSISTENCE_PATH:
+        persistence = SQLitePersistence(PERSISTENCE_PATH, update_interval=PERSISTENCE_INTERVAL)
+        logger.info(f"Состояние диалогов сохраняется в {PERSISTENCE_PATH}")
+    application = build_application(TOKEN, persistence=persistence)
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(
+            application,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=WEBHOOK_URL
+        ))
+    else:
+        application.run_polling(drop_pending_updates=True)
 
 if __name__ == "__main__":
     # Для безопасности используйте переменные окружения:
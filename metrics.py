@@ -0,0 +1,258 @@
+"""Метрики в текстовом формате Prometheus.
+
+Счетчики, гистограммы и вычисляемые при опросе показатели держатся в
+памяти процесса и отдаются по GET /metrics встроенным HTTP-сервером.
+Обработчики, задачи JobQueue и запросы к Bot API оборачиваются один
+раз при сборке приложения, сами обработчики о метриках не знают.
+"""
+import bisect
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from telegram.ext import Application, BaseHandler, ConversationHandler, JobQueue
+from telegram.request import HTTPXRequest
+
+from httpserver import Request, Response, serve
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин в секундах, как у клиентов Prometheus по умолчанию
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for values, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labels, values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Значения меток -> [счетчики по корзинам (+Inf последней), сумма]
+        self.values: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, *label_values):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            cumulative += counts[-1]
+            labels = _format_labels(self.labels, values, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, values)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}"
+
+
+class Gauge:
+    """Показатель, который вычисляется в момент опроса"""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self) -> Iterable[str]:
+        try:
+            value = self.read()
+        except Exception:
+            logger.exception("Ошибка вычисления метрики %s", self.name)
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_latency = registry.add(Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика", ("handler", "state")))
+handler_updates = registry.add(Counter(
+    "bot_handler_updates_total", "Обновления по обработчикам", ("handler", "state", "outcome")))
+api_latency = registry.add(Histogram(
+    "bot_api_request_duration_seconds", "Время запроса к Bot API", ("method",)))
+api_errors = registry.add(Counter(
+    "bot_api_errors_total", "Ошибки запросов к Bot API", ("method", "error")))
+api_calls = registry.add(Counter(
+    "bot_api_calls_total", "Запросы к Bot API по методам", ("method",)))
+api_calls_per_update = registry.add(Histogram(
+    "bot_api_calls_per_update", "Запросов к Bot API за одно обновление", ("method",),
+    buckets=(0, 1, 2, 3, 5, 10)))
+job_latency = registry.add(Histogram(
+    "bot_job_duration_seconds", "Время выполнения задачи JobQueue", ("job",),
+    buckets=DEFAULT_BUCKETS + (30.0, 60.0, 300.0)))
+
+
+# Счетчики запросов по методам для обновления, которое сейчас обрабатывается
+_update_calls: ContextVar[Optional[Dict[str, int]]] = ContextVar("update_calls", default=None)
+
+
+@contextmanager
+def count_update_calls():
+    """Считает запросы к Bot API внутри блока (обработка одного обновления)"""
+    calls: Dict[str, int] = {}
+    token = _update_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _update_calls.reset(token)
+        api_calls_per_update.observe(sum(calls.values()), "all")
+        for method, count in calls.items():
+            api_calls_per_update.observe(count, method)
+
+
+def add_gauge(name: str, help_text: str, read: Callable[[], float]):
+    registry.add(Gauge(name, help_text, read))
+
+
+def timed_callback(callback: Callable, state: str) -> Callable:
+    """Оборачивает callback обработчика замером времени и счетчиком"""
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await callback(update, context)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name, state)
+            handler_updates.inc(name, state, outcome)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _instrument(handler: BaseHandler, state: str):
+    if not getattr(handler.callback, "instrumented", False):
+        handler.callback = timed_callback(handler.callback, state)
+
+
+def instrument_handlers(application: Application, state_names: Optional[Dict[object, str]] = None):
+    """Оборачивает все зарегистрированные обработчики, включая состояния
+    ConversationHandler. Вызывать один раз после add_handler.
+    """
+    state_names = state_names or {}
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                for inner in handler.entry_points:
+                    _instrument(inner, "entry")
+                for state, inner_handlers in handler.states.items():
+                    for inner in inner_handlers:
+                        _instrument(inner, state_names.get(state, str(state)))
+                for inner in handler.fallbacks:
+                    _instrument(inner, "fallback")
+            else:
+                _instrument(handler, "")
+
+
+class InstrumentedJobQueue(JobQueue):
+    """JobQueue, замеряющий длительность каждой задачи"""
+
+    @staticmethod
+    async def job_callback(job_queue, job):
+        started = time.perf_counter()
+        try:
+            await JobQueue.job_callback(job_queue, job)
+        finally:
+            job_latency.observe(time.perf_counter() - started, job.name or "")
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest с замером времени и ошибок по методам Bot API"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        api_calls.inc(api_method)
+        calls = _update_calls.get()
+        if calls is not None:
+            calls[api_method] = calls.get(api_method, 0) + 1
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            api_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - started, api_method)
+        if status >= 400:
+            api_errors.inc(api_method, str(status))
+        return status, payload
+
+
+async def start_server(host: str, port: int):
+    """Запускает эндпоинт /metrics; остановка - server.close()"""
+
+    async def handle(request: Request) -> Response:
+        if request.path != METRICS_PATH:
+            return Response(404)
+        if request.method != "GET":
+            return Response(405)
+        return Response(200, registry.render().encode("utf-8"), CONTENT_TYPE)
+
+    server = await serve(handle, host, port)
+    logger.info("Метрики доступны на http://%s:%d%s", host, port, METRICS_PATH)
+    return server
@@ -0,0 +1,163 @@
+"""Исходящие сообщения: склейка ответов и пул соединений с Bot API.
+
+Обработчик, отвечающий через reply(), не ждет отправки: текст кладется
+в буфер обновления, а после обработки соседние ответы в тот же чат с
+одинаковой разметкой склеиваются в одно сообщение (не длиннее
+4096 символов) и уходят по очереди. Буфер открывает процессор
+обновлений, пока держит замок пользователя, поэтому порядок
+сообщений пользователю сохраняется. Вне обновления (задачи JobQueue,
+рассылки) reply() отправляет сразу.
+
+Запросы идут через HTTPXRequest с настраиваемым пулом keep-alive
+соединений и таймаутами.
+"""
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from telegram import Message
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_LENGTH = MessageLimit.MAX_TEXT_LENGTH
+SEPARATOR = "\n\n"
+
+replies_total = metrics.registry.add(metrics.Counter(
+    "bot_outbound_replies_total",
+    "Ответы через буфер: отправлены, склеены с соседним или отправлены частью после отказа",
+    ("result",)))
+
+
+class _Reply:
+    __slots__ = ("message", "text", "kwargs", "parts")
+
+    def __init__(self, message: Message, text: str, kwargs: Dict[str, Any]):
+        self.message = message
+        self.text = text
+        self.kwargs = kwargs
+        # Исходные ответы: если склейку отклонят, они уйдут по отдельности
+        self.parts: List[Tuple[str, Dict[str, Any]]] = [(text, kwargs)]
+
+    def merge(self, message: Message, text: str, kwargs: Dict[str, Any]) -> bool:
+        """Дописывает ответ к этому, если их можно отправить одним сообщением"""
+        if message.chat_id != self.message.chat_id:
+            return False
+        if len(self.text) + len(SEPARATOR) + len(text) > MAX_TEXT_LENGTH:
+            return False
+        mine = dict(self.kwargs)
+        theirs = dict(kwargs)
+        markup, their_markup = mine.pop("reply_markup", None), theirs.pop("reply_markup", None)
+        # Клавиатура одна на сообщение: склеиваем, только если она не конфликтует
+        if mine != theirs or (markup is not None and their_markup is not None and markup != their_markup):
+            return False
+        self.text += SEPARATOR + text
+        self.parts.append((text, kwargs))
+        if their_markup is not None:
+            self.kwargs = dict(self.kwargs, reply_markup=their_markup)
+        return True
+
+
+class ReplyBuffer:
+    """Ответы одного обновления в порядке вызовов reply()"""
+
+    def __init__(self):
+        self.replies: List[_Reply] = []
+        self.closed = False
+
+    def add(self, message: Message, text: str, kwargs: Dict[str, Any]):
+        if self.replies and self.replies[-1].merge(message, text, kwargs):
+            replies_total.inc("merged")
+            return
+        self.replies.append(_Reply(message, text, kwargs))
+
+    async def flush(self):
+        replies, self.replies = self.replies, []
+        for reply in replies:
+            replies_total.inc("sent")
+            try:
+                await reply.message.reply_text(reply.text, **reply.kwargs)
+            except BadRequest as e:
+                # Telegram отклонил текст (обычно разметку): отправляем части
+                # по отдельности, чтобы ошибка в одной не съела остальные
+                logger.warning("Ответ в чат %s отклонен (%s), отправляем по частям",
+                               reply.message.chat_id, e)
+                for text, kwargs in reply.parts:
+                    await _send_part(reply.message, text, kwargs)
+            except Exception:
+                # Обработчик уже завершился, отдать ошибку некому
+                logger.exception("Не удалось отправить ответ в чат %s", reply.message.chat_id)
+
+
+async def _send_part(message: Message, text: str, kwargs: Dict[str, Any]):
+    replies_total.inc("split")
+    try:
+        await message.reply_text(text, **kwargs)
+        return
+    except BadRequest:
+        if "parse_mode" not in kwargs:
+            logger.exception("Не удалось отправить ответ в чат %s", message.chat_id)
+            return
+    # Последняя попытка - без разметки
+    plain = {key: value for key, value in kwargs.items() if key != "parse_mode"}
+    try:
+        await message.reply_text(text, **plain)
+    except Exception:
+        logger.exception("Не удалось отправить ответ в чат %s", message.chat_id)
+
+
+_buffer: ContextVar[Optional[ReplyBuffer]] = ContextVar("reply_buffer", default=None)
+
+
+async def reply(message: Message, text: str, **kwargs):
+    """reply_text, который внутри обновления откладывается до его конца"""
+    buffer = _buffer.get()
+    if buffer is None or buffer.closed:
+        await message.reply_text(text, **kwargs)
+        return
+    buffer.add(message, text, kwargs)
+
+
+@asynccontextmanager
+async def collect():
+    """Буфер ответов и счетчик запросов к Bot API на время обновления"""
+    with metrics.count_update_calls():
+        buffer = ReplyBuffer()
+        token = _buffer.set(buffer)
+        try:
+            yield buffer
+        finally:
+            _buffer.reset(token)
+            # Задачи, запущенные обработчиком (block=False), отвечают уже напрямую
+            buffer.closed = True
+            await buffer.flush()
+
+
+def pooled_request(pool_size: int, connect_timeout: float, read_timeout: float,
+                   write_timeout: float, pool_timeout: float, keepalive: float,
+                   http_version: str = "1.1") -> metrics.InstrumentedRequest:
+    """Запросы к Bot API с пулом pool_size соединений.
+
+    httpx по умолчанию держит открытыми 20 соединений по 5 секунд:
+    при большем числе одновременных обновлений и паузах между ними
+    соединения закрываются и TLS устанавливается заново. Здесь все
+    соединения пула остаются открытыми keepalive секунд.
+    """
+    return metrics.InstrumentedRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        pool_timeout=pool_timeout,
+        http_version=http_version,
+        httpx_kwargs={"limits": httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive,
+        )},
+    )
@@ -0,0 +1,163 @@
+"""Сохранение состояния диалогов и context.user_data в SQLite.
+
+Application сам отслеживает, у каких пользователей изменились данные,
+и раз в update_interval секунд передает только их. Здесь изменения
+сериализуются и уходят в WriteBatcher, который пишет их пачкой в
+одной транзакции в фоновом потоке. Данные пользователя читаются из
+базы (тоже в потоке) при первом его обновлении после запуска, а не
+все сразу.
+Состояния диалогов загружаются целиком при старте: они нужны
+ConversationHandler заранее и занимают по строке на пользователя.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import WriteBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для user_data и состояний ConversationHandler"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        );
+    """
+
+    def __init__(self, path: str, update_interval: float = 10, interval: float = 0.2,
+                 max_batch: int = 500):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                        callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        # Запись идет из потока WriteBatcher, чтение - из event loop
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(self.SCHEMA)
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        # Чтения идут из потоков to_thread - по одному на соединение
+        self._reader_lock = threading.Lock()
+        self._batcher = WriteBatcher(self._write_batch, interval, max_batch)
+        # Пользователи, чьи данные уже прочитаны из базы
+        self._loaded: Set[int] = set()
+
+    def _write_batch(self, batch):
+        # Одна транзакция на пачку, как в SQLiteStorage
+        with self._conn:
+            for sql, params in batch:
+                self._conn.execute(sql, params)
+
+    async def start(self):
+        """Запускает фоновую запись; вызывается из post_init приложения"""
+        await self._batcher.start()
+
+    # user_data: ленивое чтение и запись только изменившихся
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}
+
+    def _read_user_data(self, user_id: int) -> Optional[tuple]:
+        with self._reader_lock:
+            return self._reader.execute(
+                "SELECT data FROM user_data WHERE user_id = ?", (user_id,)
+            ).fetchone()
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        row = await asyncio.to_thread(self._read_user_data, user_id)
+        if row is not None:
+            # Обновление, пришедшее до чтения, важнее сохраненного
+            for key, value in json.loads(row[0]).items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        self._loaded.add(user_id)
+        if data:
+            self._batcher.submit((
+                "INSERT OR REPLACE INTO user_data VALUES (?, ?)",
+                (user_id, json.dumps(data, ensure_ascii=False))
+            ))
+        else:
+            self._batcher.submit(("DELETE FROM user_data WHERE user_id = ?", (user_id,)))
+
+    async def drop_user_data(self, user_id: int):
+        self._loaded.add(user_id)
+        self._batcher.submit(("DELETE FROM user_data WHERE user_id = ?", (user_id,)))
+
+    # Состояния диалогов
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        rows = self._reader.execute(
+            "SELECT key, state FROM conversations WHERE name = ?", (name,)
+        )
+        conversations = {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+        logger.info("Загружено состояний диалога %s: %d", name, len(conversations))
+        return conversations
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        key_text = json.dumps(list(key))
+        if new_state is None:
+            self._batcher.submit((
+                "DELETE FROM conversations WHERE name = ? AND key = ?", (name, key_text)
+            ))
+        else:
+            self._batcher.submit((
+                "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                (name, key_text, json.dumps(new_state))
+            ))
+
+    async def flush(self):
+        # Application вызывает flush при остановке, после последнего update_persistence
+        await self._batcher.stop()
+        with self._reader_lock:
+            self._reader.close()
+        self._conn.close()
+
+    # Остальное не хранится (см. store_data)
+
+    async def get_chat_data(self) -> Dict:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
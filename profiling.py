@@ -0,0 +1,197 @@
+"""Профилирование медленных обновлений по запросу администратора.
+
+Пока профилирование выключено, процессор обновлений только проверяет
+один флаг. Включенное, оно меряет время каждого обновления, а долю
+sample_rate прогоняет под cProfile и хранит top_n самых медленных с
+их профилями. Профиль включается только на шагах своей корутины,
+поэтому соседние обновления в него не попадают; работа в
+asyncio.to_thread в профиль тоже не попадает. ncalls у корутин в
+отчете pstats - число возобновлений, а не вызовов.
+
+Снимки tracemalloc показывают, где выделена память, а объем колонок
+Ledger - сколько занимает история каждого пользователя.
+"""
+import cProfile
+import heapq
+import io
+import itertools
+import logging
+import os
+import pstats
+import random
+import time
+import tracemalloc
+from typing import Awaitable, Dict, List, NamedTuple, Optional
+
+from concurrency import UserOrderedUpdateProcessor, update_key
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк pstats хранить для каждого медленного обновления
+STATS_LINES = 30
+
+
+class SlowUpdate(NamedTuple):
+    seconds: float
+    user_id: Optional[int]
+    summary: str
+    profile: Optional[cProfile.Profile]  # None для обновлений без профиля
+    dump_path: Optional[str]
+
+    def stats(self) -> str:
+        """Текст pstats, отсортированный по накопленному времени"""
+        if self.profile is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(STATS_LINES)
+        return out.getvalue()
+
+
+def describe_update(update: object) -> str:
+    """Короткое описание обновления для отчета"""
+    message = getattr(update, "effective_message", None)
+    if message is not None and message.text:
+        return message.text[:40]
+    if message is not None and message.document:
+        return f"документ {message.document.file_name}"
+    return type(update).__name__
+
+
+class _Profiled:
+    """Awaitable, включающий профиль только на шагах своей корутины"""
+
+    def __init__(self, coroutine, profile: cProfile.Profile):
+        self.coroutine = coroutine
+        self.profile = profile
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profile.enable()
+            try:
+                if error is not None:
+                    yielded = self.coroutine.throw(error)
+                else:
+                    yielded = self.coroutine.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profile.disable()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class Profiler:
+    def __init__(self, top_n: int = 20, dump_dir: Optional[str] = None):
+        self.enabled = False
+        self.sample_rate = 0.1
+        self.top_n = top_n
+        self.dump_dir = dump_dir
+        self.profiled = 0
+        self.seen = 0
+        # Куча (время, номер, SlowUpdate): в корне самое быстрое из хранимых
+        self._slowest: List = []
+        self._numbers = itertools.count()
+
+    def enable(self, sample_rate: float):
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self._slowest = []
+        self.profiled = self.seen = 0
+
+    def slowest(self) -> List[SlowUpdate]:
+        return [item for _, _, item in sorted(self._slowest, reverse=True)]
+
+    def _admits(self, seconds: float) -> bool:
+        return len(self._slowest) < self.top_n or seconds > self._slowest[0][0]
+
+    async def run(self, update: object, coroutine: Awaitable):
+        self.seen += 1
+        profile = cProfile.Profile() if random.random() < self.sample_rate else None
+        started = time.perf_counter()
+        try:
+            if profile is None:
+                await coroutine
+            else:
+                self.profiled += 1
+                await _Profiled(coroutine, profile)
+        finally:
+            seconds = time.perf_counter() - started
+            if self._admits(seconds):
+                self._remember(update, seconds, profile)
+
+    def _remember(self, update: object, seconds: float, profile: Optional[cProfile.Profile]):
+        number = next(self._numbers)
+        dump_path = None
+        if profile is not None:
+            if self.dump_dir:
+                dump_path = os.path.join(self.dump_dir, f"update_{int(time.time())}_{number}.prof")
+                try:
+                    os.makedirs(self.dump_dir, exist_ok=True)
+                    profile.dump_stats(dump_path)
+                except OSError:
+                    logger.exception("Не удалось сохранить профиль в %s", dump_path)
+                    dump_path = None
+
+        item = SlowUpdate(seconds, update_key(update), describe_update(update), profile, dump_path)
+        if len(self._slowest) < self.top_n:
+            heapq.heappush(self._slowest, (seconds, number, item))
+        else:
+            heapq.heapreplace(self._slowest, (seconds, number, item))
+
+
+class ProfilingUpdateProcessor(UserOrderedUpdateProcessor):
+    """UserOrderedUpdateProcessor, отдающий обновления профилировщику,
+    когда тот включен"""
+
+    def __init__(self, max_concurrent_updates: int, profiler: Profiler):
+        super().__init__(max_concurrent_updates)
+        self.profiler = profiler
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        if not self.profiler.enabled:
+            await coroutine
+            return
+        await self.profiler.run(update, coroutine)
+
+
+def memory_report(records: Dict[int, object], top: int = 10) -> str:
+    """Снимок tracemalloc и объем историй самых крупных пользователей.
+
+    Первый вызов включает tracemalloc: он видит только выделения,
+    сделанные после включения, и замедляет работу, пока не выключен.
+    """
+    lines = []
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        lines.append("tracemalloc включен только что, снимок покажет новые выделения")
+    snapshot = tracemalloc.take_snapshot()
+    traced, peak = tracemalloc.get_traced_memory()
+    lines.append(f"отслежено {traced / 2**20:.1f} МБ, пик {peak / 2**20:.1f} МБ")
+    lines.append("")
+    lines.append("крупнейшие места выделения:")
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"  {os.path.basename(frame.filename)}:{frame.lineno} "
+                     f"{stat.size / 1024:.0f} КБ в {stat.count} блоках")
+
+    sizes = sorted(((ledger.nbytes(), user_id, len(ledger)) for user_id, ledger in records.items()),
+                   reverse=True)
+    lines.append("")
+    lines.append(f"истории пользователей: {len(sizes)}, "
+                 f"всего {sum(size for size, _, _ in sizes) / 2**20:.1f} МБ")
+    for size, user_id, count in sizes[:top]:
+        lines.append(f"  {user_id}: {count} записей, {size / 1024:.0f} КБ")
+    return "\n".join(lines)
+
+
+def stop_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
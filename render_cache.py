@@ -0,0 +1,72 @@
+"""Кэш готовых текстов отчетов (и картинок графиков).
+
+Ключ - (пользователь, отчет, параметры), к записи приложена версия
+данных пользователя. Любая запись или отмена повышает версию, и
+устаревший текст просто не совпадет по версии. Вытеснение - LRU по
+суммарному объему текстов.
+"""
+import sys
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple, Union
+
+# Объем кэша по умолчанию
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# Примерные накладные расходы на запись: ключ, кортеж, узел OrderedDict
+ENTRY_OVERHEAD = 200
+
+Rendered = Union[str, bytes]
+
+
+class RenderCache:
+    """LRU-кэш отрендеренных текстов с ограничением по памяти"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Hashable, Rendered, int]]" = OrderedDict()
+
+    def get(self, key: Hashable, version: Hashable) -> Optional[Rendered]:
+        """Текст из кэша, если он построен для этой версии данных"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, version: Hashable, text: Rendered):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.bytes -= entry[2]
+        size = sys.getsizeof(text) + ENTRY_OVERHEAD
+        self._entries[key] = (version, text, size)
+        self._entries.move_to_end(key)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes and self._entries:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def get_or_render(self, key: Hashable, version: Hashable, render: Callable[[], Rendered]) -> Rendered:
+        text = self.get(key, version)
+        if text is None:
+            text = render()
+            self.put(key, version, text)
+        return text
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
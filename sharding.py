@@ -0,0 +1,235 @@
+"""Режим нескольких процессов: пользователи распределены по шардам.
+
+Фронт получает обновления (polling или webhook) и, не разбирая их,
+отправляет JSON в процесс-шард по user_id. Каждый шард - обычное
+Application со своим хранилищем, поэтому записи, цели, подписки и
+задачи JobQueue шарда касаются только его пользователей. Все
+обновления пользователя попадают в один шард, так что порядок и
+состояние диалога сохраняются.
+
+Шард сам отвечает пользователю через Bot API, фронт только
+маршрутизирует.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from typing import Callable, Dict, List, Optional
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, TimedOut
+from telegram.ext import Application
+
+from httpserver import Request, Response, json_response, serve
+from webhook import HEALTH_PATH, SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Поля обновления, в которых Telegram присылает пользователя
+USER_FIELDS = ("from", "user")
+POLL_TIMEOUT = 30
+
+
+def update_owner(data: Dict) -> Optional[int]:
+    """Пользователь (или чат) из JSON обновления для выбора шарда"""
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field in USER_FIELDS:
+            user = value.get(field)
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+def shard_of(owner: Optional[int], shards: int) -> int:
+    return owner % shards if owner is not None else 0
+
+
+def shard_path(path: str, index: int) -> str:
+    """Свой файл или каталог хранилища для шарда: data.db -> data.shard0.db"""
+    root, ext = os.path.splitext(path.rstrip("/"))
+    return f"{root}.shard{index}{ext}"
+
+
+class ShardPool:
+    """Процессы-шарды и очереди обновлений к ним"""
+
+    def __init__(self, shards: int, target: Callable, args: tuple = ()):
+        # spawn: шард не наследует состояние фронта и одинаково ведет себя на всех ОС
+        context = multiprocessing.get_context("spawn")
+        self.shards = shards
+        self.inboxes = [context.Queue() for _ in range(shards)]
+        self.processes = [
+            context.Process(target=target, args=(index, shards, self.inboxes[index], *args),
+                            name=f"shard-{index}", daemon=False)
+            for index in range(shards)
+        ]
+        self.routed = [0] * shards
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logger.info("Запущено шардов: %d", self.shards)
+
+    def dispatch(self, data: Dict):
+        shard = shard_of(update_owner(data), self.shards)
+        self.routed[shard] += 1
+        self.inboxes[shard].put(data)
+
+    def stop(self, timeout: float = 30):
+        """Просит шарды завершиться и ждет их"""
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Шард %s не завершился за %.0f с, останавливаем", process.name, timeout)
+                process.terminate()
+                process.join()
+
+    def alive(self) -> List[bool]:
+        return [process.is_alive() for process in self.processes]
+
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    return stop
+
+
+async def run_front_polling(pool: ShardPool, token: str, base_url: str,
+                            stop: Optional[asyncio.Event] = None):
+    """getUpdates на фронте, обновления - в шарды"""
+    stop = stop or _stop_event()
+    async with Bot(token, base_url=base_url) as bot:
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        delay = 1.0
+        while not stop.is_set():
+            poll = asyncio.create_task(bot.get_updates(
+                offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES,
+                read_timeout=POLL_TIMEOUT + 10
+            ))
+            waiter = asyncio.create_task(stop.wait())
+            await asyncio.wait((poll, waiter), return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if not poll.done():
+                poll.cancel()
+                break
+            try:
+                updates = poll.result()
+            except (NetworkError, TimedOut) as e:
+                logger.warning("Ошибка getUpdates: %s, повтор через %.0f с", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            delay = 1.0
+            for update in updates:
+                pool.dispatch(update.to_dict())
+                offset = update.update_id + 1
+        # Подтверждаем последние полученные обновления, чтобы не получить их снова
+        if offset is not None:
+            try:
+                await bot.get_updates(offset=offset, timeout=0)
+            except (NetworkError, TimedOut):
+                pass
+
+
+async def run_front_webhook(pool: ShardPool, token: str, base_url: str, listen: str, port: int,
+                            path: str, secret_token: Optional[str] = None,
+                            webhook_url: Optional[str] = None,
+                            stop: Optional[asyncio.Event] = None):
+    """Webhook на фронте, обновления - в шарды"""
+    stop = stop or _stop_event()
+
+    async def handle(request: Request) -> Response:
+        if request.path == HEALTH_PATH:
+            alive = pool.alive()
+            return json_response({"status": "ok" if all(alive) else "degraded",
+                                  "shards_alive": alive, "routed": pool.routed},
+                                 200 if all(alive) else 503)
+        if request.path != path:
+            return Response(404)
+        if request.method != "POST":
+            return Response(405)
+        if secret_token is not None:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received.encode(), secret_token.encode()):
+                return Response(403)
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(400)
+        if not isinstance(data, dict):
+            return Response(400)
+        pool.dispatch(data)
+        return Response(200)
+
+    if webhook_url:
+        async with Bot(token, base_url=base_url) as bot:
+            await bot.set_webhook(url=webhook_url, secret_token=secret_token,
+                                  allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    server = await serve(handle, listen, port)
+    logger.info("Фронт webhook слушает http://%s:%d%s", listen, port, path)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def serve_shard(application: Application, inbox):
+    """Жизненный цикл Application в шарде: обновления берутся из inbox,
+    None в очереди - сигнал остановки."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    def put(data):
+        try:
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError):
+            logger.warning("Некорректное обновление от фронта")
+            return
+        application.update_queue.put_nowait(update)
+
+    def reader():
+        # Очередь multiprocessing блокирующая, читаем ее в отдельном потоке
+        while True:
+            data = inbox.get()
+            if data is None:
+                loop.call_soon_threadsafe(stop.set)
+                return
+            loop.call_soon_threadsafe(put, data)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    threading.Thread(target=reader, name="shard-inbox", daemon=True).start()
+    try:
+        await stop.wait()
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def ignore_interrupts():
+    """В шарде: Ctrl+C получает вся группа процессов, а останавливает фронт"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
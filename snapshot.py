@@ -0,0 +1,210 @@
+"""Двоичный снимок хранилища и журнал изменений после него.
+
+Снимок - колонки всех Ledger подряд, без разбора по записям: при
+загрузке файл отображается через mmap, и каждая колонка пользователя
+копируется в массив одним вызовом frombytes. Цели, подписки, дайджест
+и названия категорий лежат рядом в JSON - их немного.
+
+Формат снимка (порядок байтов машины, записавшей его):
+    заголовок HEADER, метаданные JSON, выравнивание до 8 байт,
+    таблица пользователей (user_id, число записей) в int64,
+    ts int64, amounts int64, category_ids uint32, flags uint8 -
+    каждая колонка по всем пользователям подряд.
+
+Журнал - последовательность записей (длина, crc32, данные). Запись с
+неверной длиной или crc32 считается оборванной при сбое: журнал
+обрезается перед ней.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from ledger import Ledger, categories
+
+MAGIC = b"FBSNAP01"
+# magic, порядок байтов (1 - little), поколение журнала, пользователей, записей, длина JSON
+HEADER = struct.Struct("<8sBQQQQ")
+ENTRY_HEADER = struct.Struct("<II")
+ADD = struct.Struct("<BqqBq")
+POP = struct.Struct("<Bq")
+
+OP_ADD = 1
+OP_POP = 2
+OP_JSON = 3
+
+LITTLE = sys.byteorder == "little"
+
+
+class Snapshot(NamedTuple):
+    generation: int
+    records: Dict[int, Ledger]
+    meta: Dict
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_snapshot(path: str, generation: int,
+                   columns: Dict[int, Tuple[array, array, array, array]], meta: Dict):
+    """Пишет снимок атомарно: во временный файл, fsync, rename.
+
+    columns - копии колонок (ts, amounts, flags, category_ids) на
+    момент снимка; meta должна содержать список categories.
+    """
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    users = array("q")
+    for user_id, (ts, _, _, _) in columns.items():
+        users.append(user_id)
+        users.append(len(ts))
+    total = sum(len(ts) for ts, _, _, _ in columns.values())
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 1 if LITTLE else 0, generation, len(columns), total,
+                            len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(b"\0" * (_align(HEADER.size + len(meta_bytes)) - HEADER.size - len(meta_bytes)))
+        users.tofile(f)
+        # Колонки по 8 байт первыми - так все остаются выровненными
+        for column in (0, 1, 3, 2):
+            for user_columns in columns.values():
+                user_columns[column].tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+def read_snapshot(path: str) -> Optional[Snapshot]:
+    """Загружает снимок; None, если файла нет"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, little, generation, user_count, total, meta_len = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не файл снимка")
+        if bool(little) != LITTLE:
+            raise ValueError(f"{path}: снимок записан на машине с другим порядком байтов")
+
+        offset = HEADER.size
+        meta = json.loads(bytes(mm[offset:offset + meta_len]).decode("utf-8"))
+        offset = _align(offset + meta_len)
+
+        users = array("q")
+        users.frombytes(mm[offset:offset + 16 * user_count])
+        offset += 16 * user_count
+
+        # Id категорий снимка -> id в реестре этого процесса
+        mapping = [categories.intern(name) for name in meta["categories"]]
+        remap = mapping != list(range(len(mapping)))
+
+        view = memoryview(mm)
+        ts_at, amounts_at = offset, offset + 8 * total
+        ids_at = amounts_at + 8 * total
+        flags_at = ids_at + 4 * total
+        records: Dict[int, Ledger] = {}
+        start = 0
+        ids = None
+        try:
+            for number in range(user_count):
+                user_id, count = users[2 * number], users[2 * number + 1]
+                stop = start + count
+                ledger = Ledger()
+                ids = view[ids_at + 4 * start:ids_at + 4 * stop]
+                if remap:
+                    ids = array("I", (mapping[i] for i in ids.cast("I")))
+                ledger.extend_raw(
+                    view[ts_at + 8 * start:ts_at + 8 * stop],
+                    view[amounts_at + 8 * start:amounts_at + 8 * stop],
+                    view[flags_at + start:flags_at + stop],
+                    ids,
+                )
+                records[user_id] = ledger
+                start = stop
+        finally:
+            # mmap нельзя закрыть, пока на него есть memoryview
+            del ids
+            view.release()
+    return Snapshot(generation, records, meta)
+
+
+def _fsync_dir(directory: str):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# --- Журнал ---
+
+def _entry(payload: bytes) -> bytes:
+    return ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_add(user_id: int, ts: int, flags: int, category: str, amount_kop: int) -> bytes:
+    return _entry(ADD.pack(OP_ADD, user_id, ts, flags, amount_kop) + category.encode("utf-8"))
+
+
+def encode_pop(user_id: int) -> bytes:
+    return _entry(POP.pack(OP_POP, user_id))
+
+
+def encode_json(kind: str, user_id: int, *args) -> bytes:
+    """Редкие изменения (цели, подписки, дайджест) - одной строкой JSON"""
+    body = json.dumps([kind, user_id, *args], ensure_ascii=False).encode("utf-8")
+    return _entry(bytes([OP_JSON]) + body)
+
+
+def read_log(path: str) -> Tuple[List[tuple], int]:
+    """Читает журнал до первой оборванной записи.
+
+    Возвращает операции ("add", user_id, ts, flags, category, amount_kop),
+    ("pop", user_id) или (kind, user_id, ...) из JSON, и длину целой
+    части файла.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    ops = []
+    offset = 0
+    while offset + ENTRY_HEADER.size <= len(data):
+        length, crc = ENTRY_HEADER.unpack_from(data, offset)
+        start = offset + ENTRY_HEADER.size
+        payload = data[start:start + length]
+        if not payload or len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        op = payload[0]
+        if op == OP_ADD:
+            _, user_id, ts, flags, amount_kop = ADD.unpack_from(payload)
+            ops.append(("add", user_id, ts, flags, payload[ADD.size:].decode("utf-8"), amount_kop))
+        elif op == OP_POP:
+            ops.append(("pop", POP.unpack_from(payload)[1]))
+        elif op == OP_JSON:
+            ops.append(tuple(json.loads(payload[1:].decode("utf-8"))))
+        else:
+            break
+        offset = start + length
+    return ops, offset
+
+
+def iter_logs(directory: str, prefix: str) -> Iterator[Tuple[int, str]]:
+    """Файлы журнала prefix.<поколение> в порядке поколений"""
+    found = []
+    for name in os.listdir(directory):
+        head, _, tail = name.rpartition(".")
+        if head == prefix and tail.isdigit():
+            found.append((int(tail), os.path.join(directory, name)))
+    return iter(sorted(found))
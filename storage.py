@@ -0,0 +1,776 @@
+"""Хранилище данных бота: записи, цели и регулярные платежи.
+
+Все данные держатся в памяти, а бэкенд отвечает только за их
+сохранение. Записи на диск группируются фоновой задачей WriteBatcher,
+поэтому пачка подтверждений стоит одного fsync, а не сотни.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aggregates import UserAggregates, check_consistency, to_kopecks
+from budgets import BudgetTracker
+from ledger import TYPE_INCOME, Ledger, Record, categories, type_flags
+from snapshot import (
+    encode_add,
+    encode_json,
+    encode_pop,
+    iter_logs,
+    read_log,
+    read_snapshot,
+    write_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+# Для скольких последних доходов пользователя помнить пополнения целей
+MAX_UNDO_ALLOCATIONS = 50
+
+
+def income_allocations(goals: Dict[int, Dict], amount: float) -> List[Tuple[int, float]]:
+    """Сколько дохода amount забирают цели с автопополнением (доля goal["auto"]),
+    не больше остатка до цели"""
+    allocations = []
+    for goal_id, goal in goals.items():
+        share = goal.get("auto")
+        remaining = goal["target"] - goal["saved"]
+        if share and remaining > 0:
+            allocations.append((goal_id, round(min(amount * share, remaining), 2)))
+    return allocations
+
+
+class WriteBatcher:
+    """Копит операции записи и сбрасывает их пачкой в фоновой задаче.
+
+    Сброс происходит раз в ``interval`` секунд или сразу, как только
+    набралось ``max_batch`` операций. Сама запись выполняется в потоке,
+    чтобы не блокировать event loop.
+    """
+
+    def __init__(self, write: Callable[[List[tuple]], None],
+                 interval: float = 0.2, max_batch: int = 500):
+        self._write = write
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending: List[tuple] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        # Пачки пишутся строго по очереди, даже если flush вызван снаружи
+        self._flush_lock = asyncio.Lock()
+
+    def submit(self, op: tuple):
+        self._pending.append(op)
+        if self._wakeup is not None and len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task is None:
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую задачу и дописывает остаток"""
+        if self._task is not None:
+            # Не отменяем задачу: запись в потоке должна завершиться сама
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                # Возвращаем операции в начало очереди, попробуем в следующий раз
+                logger.exception("Ошибка записи пачки из %d операций", len(batch))
+                self._pending[:0] = batch
+                raise
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(self.interval)
+
+
+class BaseStorage:
+    """Интерфейс хранилища.
+
+    Держит данные в памяти и вызывает ``_persist`` для каждой
+    изменяющей операции. Наследники переопределяют ``_persist``,
+    ``start`` и ``close``.
+    """
+
+    def __init__(self):
+        self.records: Dict[int, Ledger] = {}
+        self.goals: Dict[int, Dict[int, Dict]] = {}
+        self.subscriptions: Dict[int, List[Dict]] = {}
+        self.aggregates: Dict[int, UserAggregates] = {}
+        # Минута суток для ежедневного дайджеста, если пользователь подписан
+        self.digest_minutes: Dict[int, int] = {}
+        # Версия данных пользователя: растет при каждом изменении
+        self.versions: Dict[int, int] = {}
+        # Последний выданный id цели: id не переиспользуются после удаления
+        self.goal_seq: Dict[int, int] = {}
+        # Пополнения целей недавними доходами: позиция записи -> [(id цели, сумма)].
+        # Отмена такой записи забирает пополнения обратно. Только в памяти
+        self._allocations: Dict[int, Dict[int, List[Tuple[int, float]]]] = {}
+        # Бюджеты: ключ категории -> {"category", "limit" (копейки), "period"}
+        self.budgets: Dict[int, Dict[str, Dict]] = {}
+        # Счетчики бюджетов; создаются при первом обращении, только в памяти
+        self._budget_trackers: Dict[int, BudgetTracker] = {}
+
+    def version(self, user_id: int) -> int:
+        return self.versions.get(user_id, 0)
+
+    def _touch(self, user_id: int):
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+    # --- Записи о доходах и расходах ---
+
+    def get_records(self, user_id: int) -> Ledger:
+        ledger = self.records.get(user_id)
+        return ledger if ledger is not None else Ledger()
+
+    def get_aggregates(self, user_id: int) -> UserAggregates:
+        aggregates = self.aggregates.get(user_id)
+        if aggregates is not None:
+            return aggregates
+        if user_id in self.records:
+            return self._user_aggregates(user_id)
+        return UserAggregates()
+
+    def _user_aggregates(self, user_id: int) -> UserAggregates:
+        """Агрегаты пользователя; строятся по записям при первом обращении.
+
+        Бэкенды, загружающие записи снимком, не считают агрегаты при
+        старте, поэтому изменяющие операции берут их здесь до
+        изменения ledger.
+        """
+        aggregates = self.aggregates.get(user_id)
+        if aggregates is None:
+            records = self.records.get(user_id)
+            aggregates = UserAggregates.from_records(records) if records else UserAggregates()
+            self.aggregates[user_id] = aggregates
+        return aggregates
+
+    def add_record(self, user_id: int, record_type: str, category: str,
+                   amount: float, ts: Optional[int] = None) -> Record:
+        """Добавляет запись; время по умолчанию - текущее"""
+        if ts is None:
+            ts = int(time.time())
+        aggregates = self._user_aggregates(user_id)
+        records = self.records.get(user_id)
+        if records is None:
+            records = self.records[user_id] = Ledger()
+        record = records.append(ts, type_flags(record_type), category, to_kopecks(amount))
+        aggregates.add(record)
+        tracker = self._budget_trackers.get(user_id)
+        if tracker is not None:
+            tracker.apply(record, 1)
+        self._touch(user_id)
+        self._persist(("add", user_id, len(records) - 1, record))
+        if record_type == TYPE_INCOME and user_id in self.goals:
+            self._allocate_income(user_id, len(records) - 1, record.amount)
+        return record
+
+    def _allocate_income(self, user_id: int, position: int, amount: float):
+        allocations = income_allocations(self.goals[user_id], amount)
+        for goal_id, share in allocations:
+            goal = self.goals[user_id][goal_id]
+            self.update_goal(user_id, goal_id, saved=round(goal["saved"] + share, 2))
+        if allocations:
+            recent = self._allocations.setdefault(user_id, {})
+            recent[position] = allocations
+            if len(recent) > MAX_UNDO_ALLOCATIONS:
+                del recent[min(recent)]
+
+    def last_allocations(self, user_id: int, position: int) -> List[Tuple[int, float]]:
+        """Пополнения целей доходом на позиции position: [(id цели, сумма)]"""
+        return self._allocations.get(user_id, {}).get(position, [])
+
+    def add_records_bulk(self, user_id: int, ts: array, flags: array,
+                         category_ids: array, amounts: array):
+        """Добавляет пачку записей одной операцией записи.
+
+        В агрегаты и счетчики бюджетов добавляются только новые
+        записи, история не пересчитывается.
+        """
+        # Агрегаты берем до extend, иначе ленивое построение учтет пачку дважды
+        aggregates = self._user_aggregates(user_id)
+        records = self.records.get(user_id)
+        if records is None:
+            records = self.records[user_id] = Ledger()
+        start = len(records)
+        records.extend(ts, flags, category_ids, amounts)
+        tracker = self._budget_trackers.get(user_id)
+        for record in records.iter_records(start):
+            aggregates.add(record)
+            if tracker is not None:
+                tracker.apply(record, 1)
+        self._touch(user_id)
+        self._persist(("bulk", user_id, start, records.iter_records(start)))
+
+    def pop_record(self, user_id: int) -> Optional[Record]:
+        records = self.records.get(user_id)
+        if not records:
+            return None
+        aggregates = self._user_aggregates(user_id)
+        record = records.pop()
+        aggregates.remove(record)
+        tracker = self._budget_trackers.get(user_id)
+        if tracker is not None:
+            tracker.apply(record, -1)
+        self._touch(user_id)
+        self._persist(("pop", user_id, len(records)))
+        recent = self._allocations.get(user_id)
+        allocations = recent.pop(len(records), None) if recent else None
+        if allocations:
+            # Отменили доход, который пополнил цели - забираем пополнения обратно
+            goals = self.goals.get(user_id, {})
+            for goal_id, share in allocations:
+                if goal_id in goals:
+                    saved = max(round(goals[goal_id]["saved"] - share, 2), 0)
+                    self.update_goal(user_id, goal_id, saved=saved)
+        return record
+
+    def rebuild_aggregates(self):
+        """Пересчитывает агрегаты всех пользователей по записям"""
+        self.aggregates = {
+            user_id: UserAggregates.from_records(records)
+            for user_id, records in self.records.items()
+        }
+
+    def verify_aggregates(self) -> Dict[int, List[str]]:
+        """Сверяет агрегаты с записями, возвращает расхождения по пользователям"""
+        problems = {}
+        for user_id, records in self.records.items():
+            user_problems = check_consistency(records, self.get_aggregates(user_id))
+            if user_problems:
+                problems[user_id] = user_problems
+        return problems
+
+    # --- Финансовые цели ---
+
+    def get_goals(self, user_id: int) -> Dict[int, Dict]:
+        return self.goals.get(user_id, {})
+
+    def add_goal(self, user_id: int, goal: Dict) -> int:
+        goals = self.goals.setdefault(user_id, {})
+        goal_id = self.goal_seq.get(user_id, 0) + 1
+        self.goal_seq[user_id] = goal_id
+        goals[goal_id] = goal
+        self._touch(user_id)
+        self._persist(("goal", user_id, goal_id, goal))
+        return goal_id
+
+    def remove_goal(self, user_id: int, goal_id: int) -> Optional[Dict]:
+        goals = self.goals.get(user_id)
+        goal = goals.pop(goal_id, None) if goals else None
+        if goal is None:
+            return None
+        if not goals:
+            del self.goals[user_id]
+        self._touch(user_id)
+        self._persist(("goal_del", user_id, goal_id, self.goal_seq.get(user_id, goal_id)))
+        return goal
+
+    def _note_goal_id(self, user_id: int, goal_id: int):
+        """При загрузке: счетчик id не меньше любого встреченного id"""
+        if goal_id > self.goal_seq.get(user_id, 0):
+            self.goal_seq[user_id] = goal_id
+
+    def update_goal(self, user_id: int, goal_id: int, **changes) -> Dict:
+        goal = self.goals[user_id][goal_id]
+        goal.update(changes)
+        self._touch(user_id)
+        self._persist(("goal", user_id, goal_id, goal))
+        return goal
+
+    # --- Регулярные платежи ---
+
+    def get_subscriptions(self, user_id: int) -> List[Dict]:
+        return self.subscriptions.get(user_id, [])
+
+    def add_subscription(self, user_id: int, subscription: Dict) -> int:
+        subscriptions = self.subscriptions.setdefault(user_id, [])
+        subscriptions.append(subscription)
+        self._touch(user_id)
+        self._persist(("sub", user_id, len(subscriptions) - 1, subscription))
+        return len(subscriptions) - 1
+
+    def update_subscription(self, user_id: int, index: int, **changes) -> Dict:
+        subscription = self.subscriptions[user_id][index]
+        subscription.update(changes)
+        self._touch(user_id)
+        self._persist(("sub", user_id, index, subscription))
+        return subscription
+
+    # --- Бюджеты ---
+
+    def get_budgets(self, user_id: int) -> Dict[str, Dict]:
+        return self.budgets.get(user_id, {})
+
+    def set_budget(self, user_id: int, key: str, budget: Optional[Dict]):
+        """Задает бюджет категории с ключом key; None - удаляет"""
+        budgets = self.budgets.setdefault(user_id, {})
+        if budget is None:
+            budgets.pop(key, None)
+        else:
+            budgets[key] = budget
+        tracker = self._budget_trackers.get(user_id)
+        if tracker is not None:
+            tracker.reset(key)
+        if not budgets:
+            del self.budgets[user_id]
+            self._budget_trackers.pop(user_id, None)
+        self._touch(user_id)
+        self._persist(("budget", user_id, key, budget))
+
+    def budget_tracker(self, user_id: int) -> Optional[BudgetTracker]:
+        """Счетчики бюджетов пользователя; None, если бюджетов нет"""
+        budgets = self.budgets.get(user_id)
+        if not budgets:
+            return None
+        tracker = self._budget_trackers.get(user_id)
+        if tracker is None:
+            tracker = self._budget_trackers[user_id] = BudgetTracker(budgets)
+        return tracker
+
+    # --- Ежедневный дайджест ---
+
+    def set_digest_minute(self, user_id: int, minute: Optional[int]):
+        """Включает дайджест в заданную минуту суток; None - выключает"""
+        if minute is None:
+            self.digest_minutes.pop(user_id, None)
+        else:
+            self.digest_minutes[user_id] = minute
+        self._persist(("digest", user_id, minute))
+
+    # --- Жизненный цикл ---
+
+    def _persist(self, op: tuple):
+        pass
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryStorage(BaseStorage):
+    """Хранилище только в памяти: данные теряются при перезапуске"""
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище в SQLite (режим WAL) с групповой записью"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            user_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount_kop INTEGER NOT NULL,
+            PRIMARY KEY (user_id, seq)
+        );
+        CREATE TABLE IF NOT EXISTS goals (
+            user_id INTEGER NOT NULL,
+            goal_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, goal_id)
+        );
+        CREATE TABLE IF NOT EXISTS goal_seq (
+            user_id INTEGER PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER NOT NULL,
+            sub_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, sub_id)
+        );
+        CREATE TABLE IF NOT EXISTS digest (
+            user_id INTEGER PRIMARY KEY,
+            minute INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS budgets (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, category)
+        );
+    """
+
+    def __init__(self, path: str, interval: float = 0.2, max_batch: int = 500):
+        super().__init__()
+        self.path = path
+        # Соединение используется из потока WriteBatcher
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(self.SCHEMA)
+        self._batcher = WriteBatcher(self._write_batch, interval, max_batch)
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT user_id, ts, type, category, amount_kop "
+            "FROM records ORDER BY user_id, seq"
+        )
+        for user_id, ts, record_type, category, amount_kop in rows:
+            records = self.records.get(user_id)
+            if records is None:
+                records = self.records[user_id] = Ledger()
+            records.append(ts, type_flags(record_type), category, amount_kop)
+
+        for user_id, goal_id, data in self._conn.execute(
+                "SELECT user_id, goal_id, data FROM goals ORDER BY user_id, goal_id"):
+            self.goals.setdefault(user_id, {})[goal_id] = json.loads(data)
+            self._note_goal_id(user_id, goal_id)
+        # Счетчик хранится отдельно на случай, если удалена цель с наибольшим id
+        for user_id, last_id in self._conn.execute("SELECT user_id, last_id FROM goal_seq"):
+            self._note_goal_id(user_id, last_id)
+
+        for user_id, sub_id, data in self._conn.execute(
+                "SELECT user_id, sub_id, data FROM subscriptions ORDER BY user_id, sub_id"):
+            self.subscriptions.setdefault(user_id, []).append(json.loads(data))
+
+        self.digest_minutes = dict(self._conn.execute("SELECT user_id, minute FROM digest"))
+
+        for user_id, key, data in self._conn.execute("SELECT user_id, category, data FROM budgets"):
+            self.budgets.setdefault(user_id, {})[key] = json.loads(data)
+
+        self.rebuild_aggregates()
+
+        logger.info(
+            "Загружено из %s: %d пользователей, %d записей",
+            self.path, len(self.records), sum(map(len, self.records.values()))
+        )
+
+    def _persist(self, op: tuple):
+        # Сериализуем сразу: объект в памяти может измениться до сброса
+        kind, user_id = op[0], op[1]
+        if kind == "add":
+            seq, record = op[2], op[3]
+            self._batcher.submit((
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, seq, record.ts, record.type, record.category,
+                 record.amount_kop)
+            ))
+        elif kind == "bulk":
+            start, rows = op[2], op[3]
+            self._batcher.submit((
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (user_id, seq, record.ts, record.type, record.category, record.amount_kop)
+                    for seq, record in enumerate(rows, start)
+                ]
+            ))
+        elif kind == "pop":
+            self._batcher.submit((
+                "DELETE FROM records WHERE user_id = ? AND seq = ?",
+                (user_id, op[2])
+            ))
+        elif kind == "goal":
+            self._batcher.submit((
+                "INSERT OR REPLACE INTO goals VALUES (?, ?, ?)",
+                (user_id, op[2], json.dumps(op[3], ensure_ascii=False))
+            ))
+        elif kind == "goal_del":
+            self._batcher.submit((
+                "DELETE FROM goals WHERE user_id = ? AND goal_id = ?", (user_id, op[2])
+            ))
+            self._batcher.submit((
+                "INSERT OR REPLACE INTO goal_seq VALUES (?, ?)", (user_id, op[3])
+            ))
+        elif kind == "sub":
+            self._batcher.submit((
+                "INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?)",
+                (user_id, op[2], json.dumps(op[3], ensure_ascii=False))
+            ))
+        elif kind == "digest":
+            if op[2] is None:
+                self._batcher.submit(("DELETE FROM digest WHERE user_id = ?", (user_id,)))
+            else:
+                self._batcher.submit((
+                    "INSERT OR REPLACE INTO digest VALUES (?, ?)", (user_id, op[2])
+                ))
+        elif kind == "budget":
+            if op[3] is None:
+                self._batcher.submit((
+                    "DELETE FROM budgets WHERE user_id = ? AND category = ?", (user_id, op[2])
+                ))
+            else:
+                self._batcher.submit((
+                    "INSERT OR REPLACE INTO budgets VALUES (?, ?, ?)",
+                    (user_id, op[2], json.dumps(op[3], ensure_ascii=False))
+                ))
+
+    def _write_batch(self, batch: List[tuple]):
+        # Одна транзакция на пачку - один fsync
+        with self._conn:
+            for sql, params in batch:
+                if isinstance(params, list):
+                    self._conn.executemany(sql, params)
+                else:
+                    self._conn.execute(sql, params)
+
+    async def start(self):
+        await self._batcher.start()
+
+    async def close(self):
+        await self._batcher.stop()
+        self._conn.close()
+
+
+class SnapshotStorage(BaseStorage):
+    """Хранилище в каталоге: двоичный снимок плюс журнал изменений.
+
+    При старте снимок загружается через mmap, а из журнала
+    повторяются только изменения после снимка. Агрегаты не
+    пересчитываются при загрузке, а строятся для пользователя при
+    первом обращении. Снимок пишется раз в snapshot_interval секунд
+    и при остановке, если с прошлого снимка что-то изменилось.
+    """
+
+    SNAPSHOT_NAME = "snapshot.bin"
+    LOG_PREFIX = "log"
+
+    def __init__(self, directory: str, interval: float = 0.2, max_batch: int = 500,
+                 snapshot_interval: float = 600):
+        super().__init__()
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(directory, exist_ok=True)
+        # Поколение текущего журнала; снимок поколения G покрывает журналы < G
+        self.generation = 0
+        # Изменений с последнего снимка
+        self.changes = 0
+        self._load()
+        # Файл журнала открыт и пишется только из потока WriteBatcher
+        self._log = open(self._log_path(self.generation), "ab")
+        self._batcher = WriteBatcher(self._write_batch, interval, max_batch)
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._snapshot_lock = asyncio.Lock()
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{self.LOG_PREFIX}.{generation}")
+
+    def _load(self):
+        started = time.perf_counter()
+        snapshot = read_snapshot(os.path.join(self.directory, self.SNAPSHOT_NAME))
+        if snapshot is not None:
+            self.generation = snapshot.generation
+            self.records = snapshot.records
+            meta = snapshot.meta
+            self.goals = {
+                int(user_id): {int(goal_id): goal for goal_id, goal in goals.items()}
+                for user_id, goals in meta["goals"].items()
+            }
+            for user_id, goals in self.goals.items():
+                for goal_id in goals:
+                    self._note_goal_id(user_id, goal_id)
+            for user_id, last_id in meta.get("goal_seq", {}).items():
+                self._note_goal_id(int(user_id), last_id)
+            self.subscriptions = {int(user_id): subs for user_id, subs in meta["subscriptions"].items()}
+            self.digest_minutes = {int(user_id): minute for user_id, minute in meta["digest"].items()}
+            self.budgets = {int(user_id): budgets for user_id, budgets in meta.get("budgets", {}).items()}
+
+        replayed = 0
+        for generation, path in iter_logs(self.directory, self.LOG_PREFIX):
+            if generation < self.generation:
+                # Уже в снимке: остался от сбоя между снимком и удалением
+                os.remove(path)
+                continue
+            ops, valid = read_log(path)
+            if valid < os.path.getsize(path):
+                logger.warning("Журнал %s оборван, обрезаем до %d байт", path, valid)
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+            for op in ops:
+                self._apply(op)
+            replayed += len(ops)
+            self.generation = generation
+        self.changes = replayed
+
+        logger.info(
+            "Загружено из %s за %.2f с: %d пользователей, %d записей, %d изменений из журнала",
+            self.directory, time.perf_counter() - started, len(self.records),
+            sum(map(len, self.records.values())), replayed
+        )
+
+    def _apply(self, op: tuple):
+        """Повторяет операцию журнала; агрегаты еще не построены"""
+        kind, user_id = op[0], op[1]
+        if kind == "add":
+            records = self.records.get(user_id)
+            if records is None:
+                records = self.records[user_id] = Ledger()
+            records.append(op[2], op[3], op[4], op[5])
+        elif kind == "pop":
+            self.records[user_id].pop()
+        elif kind == "goal":
+            self.goals.setdefault(user_id, {})[op[2]] = op[3]
+            self._note_goal_id(user_id, op[2])
+        elif kind == "goal_del":
+            goals = self.goals.get(user_id, {})
+            goals.pop(op[2], None)
+            if not goals:
+                self.goals.pop(user_id, None)
+            self._note_goal_id(user_id, op[3])
+        elif kind == "sub":
+            subscriptions = self.subscriptions.setdefault(user_id, [])
+            if op[2] < len(subscriptions):
+                subscriptions[op[2]] = op[3]
+            else:
+                subscriptions.append(op[3])
+        elif kind == "digest":
+            if op[2] is None:
+                self.digest_minutes.pop(user_id, None)
+            else:
+                self.digest_minutes[user_id] = op[2]
+        elif kind == "budget":
+            budgets = self.budgets.setdefault(user_id, {})
+            if op[3] is None:
+                budgets.pop(op[2], None)
+            else:
+                budgets[op[2]] = op[3]
+            if not budgets:
+                del self.budgets[user_id]
+
+    def _persist(self, op: tuple):
+        # Сериализуем сразу: объект в памяти может измениться до сброса
+        self.changes += 1
+        kind, user_id = op[0], op[1]
+        if kind == "add":
+            record = op[3]
+            self._batcher.submit(("data", encode_add(
+                user_id, record.ts, record.flags, record.category, record.amount_kop)))
+        elif kind == "bulk":
+            self._batcher.submit(("data", b"".join(
+                encode_add(user_id, record.ts, record.flags, record.category, record.amount_kop)
+                for record in op[3]
+            )))
+        elif kind == "pop":
+            self._batcher.submit(("data", encode_pop(user_id)))
+        else:
+            self._batcher.submit(("data", encode_json(kind, user_id, *op[2:])))
+
+    def _write_batch(self, batch: List[tuple]):
+        for kind, payload in batch:
+            if kind == "data":
+                self._log.write(payload)
+            else:
+                # Переход на журнал нового поколения, заказанный снимком
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._log.close()
+                self._log = open(self._log_path(payload), "ab")
+        # Одна пачка - один fsync
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    async def snapshot(self):
+        """Пишет снимок и удаляет журналы, которые он покрывает"""
+        async with self._snapshot_lock:
+            started = time.perf_counter()
+            # Граница снимка: все, что раньше маркера, попадет в старый
+            # журнал и в снимок, все, что позже, - в новый журнал
+            self.generation += 1
+            generation = self.generation
+            self._batcher.submit(("rotate", generation))
+            self.changes = 0
+            columns = {
+                user_id: (records.ts[:], records.amounts[:], records.flags[:],
+                          records.category_ids[:])
+                for user_id, records in self.records.items()
+                if records
+            }
+            meta = {
+                "categories": categories.names(),
+                "goals": self.goals,
+                "goal_seq": self.goal_seq,
+                "subscriptions": self.subscriptions,
+                "digest": self.digest_minutes,
+                "budgets": self.budgets,
+            }
+            # JSON собираем здесь же, пока данные не изменились
+            meta = json.loads(json.dumps(meta, ensure_ascii=False))
+            copied = time.perf_counter() - started
+
+            path = os.path.join(self.directory, self.SNAPSHOT_NAME)
+            await asyncio.to_thread(write_snapshot, path, generation, columns, meta)
+            for old_generation, old_path in iter_logs(self.directory, self.LOG_PREFIX):
+                if old_generation < generation:
+                    os.remove(old_path)
+            logger.info(
+                "Снимок поколения %d: %d пользователей, копирование %.3f с, всего %.2f с",
+                generation, len(columns), copied, time.perf_counter() - started
+            )
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if not self.changes:
+                continue
+            try:
+                # Отмена при остановке не должна прерывать запись файла
+                await asyncio.shield(self.snapshot())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка записи снимка")
+
+    async def start(self):
+        await self._batcher.start()
+        if self._snapshot_task is None and self.snapshot_interval:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+
+    async def close(self):
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            try:
+                await self._snapshot_task
+            except asyncio.CancelledError:
+                pass
+            self._snapshot_task = None
+        # Снимок при остановке - следующий старт обойдется без журнала
+        if self.changes:
+            await self.snapshot()
+        await self._batcher.stop()
+        self._log.close()
+
+
+def create_storage(backend: str, path: str, snapshot_interval: float = 600) -> BaseStorage:
+    """Создает хранилище по имени бэкенда: memory, sqlite или snapshot.
+
+    Для snapshot path - каталог со снимком и журналом.
+    """
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(path)
+    if backend == "snapshot":
+        return SnapshotStorage(path, snapshot_interval=snapshot_interval)
+    raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
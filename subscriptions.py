@@ -0,0 +1,78 @@
+"""Календарь регулярных платежей.
+
+Подписки разложены по корзинам дня месяца, и ежедневная задача берет
+только корзину наступившего дня, а не перебирает всех пользователей.
+В коротких месяцах платежи с днем, которого в месяце нет (29-31),
+приходятся на последний день месяца.
+
+Каждая подписка помнит дату последнего списания ("posted"), поэтому
+повторный проход по тем же дням (догон после простоя, перезапуск)
+ничего не списывает дважды.
+"""
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Set, Tuple
+
+# Сколько пропущенных дней догонять после простоя
+MAX_CATCH_UP_DAYS = 31
+
+# (пользователь, номер подписки в его списке)
+Entry = Tuple[int, int]
+
+
+def billing_day(day: int, year: int, month: int) -> int:
+    """День списания в данном месяце: 31 число в апреле - 30 апреля"""
+    return min(day, monthrange(year, month)[1])
+
+
+def next_billing_date(day: int, after: date) -> date:
+    """Ближайшая дата списания позже after"""
+    year, month = after.year, after.month
+    if after.day >= billing_day(day, year, month):
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return date(year, month, billing_day(day, year, month))
+
+
+def last_posted(subscription: Dict) -> date:
+    """Дата последнего списания; для подписок без отметки - дата добавления"""
+    posted = subscription.get("posted")
+    if posted is not None:
+        return date.fromisoformat(posted)
+    return datetime.strptime(subscription["added"], "%d.%m.%Y").date()
+
+
+def days_to_post(last_day: date, today: date) -> Iterator[date]:
+    """Дни в полуинтервале (last_day, today], не больше MAX_CATCH_UP_DAYS"""
+    day = max(last_day, today - timedelta(days=MAX_CATCH_UP_DAYS))
+    while day < today:
+        day += timedelta(days=1)
+        yield day
+
+
+class SubscriptionCalendar:
+    """Подписки, сгруппированные по дню месяца"""
+
+    def __init__(self):
+        self.buckets: Dict[int, Set[Entry]] = {}
+
+    def add(self, user_id: int, index: int, day: int):
+        self.buckets.setdefault(day, set()).add((user_id, index))
+
+    def load(self, subscriptions: Dict[int, List[Dict]]):
+        self.buckets.clear()
+        for user_id, user_subscriptions in subscriptions.items():
+            for index, subscription in enumerate(user_subscriptions):
+                self.add(user_id, index, subscription["day"])
+
+    def due(self, day: date) -> List[Entry]:
+        """Подписки со списанием в день day"""
+        last = monthrange(day.year, day.month)[1]
+        # В последний день месяца - еще и все дни, которых в месяце нет
+        days = range(day.day, 32) if day.day == last else (day.day,)
+        entries: List[Entry] = []
+        for bucket_day in days:
+            entries.extend(self.buckets.get(bucket_day, ()))
+        return entries
+
+    def __len__(self) -> int:
+        return sum(map(len, self.buckets.values()))
@@ -0,0 +1,101 @@
+"""Режим webhook: бот принимает обновления через локальный HTTP-сервер.
+
+Сервер проверяет секретный токен, кладет обновление в очередь
+Application и сразу отвечает 200, а обработка идет параллельно.
+GET /healthz сообщает о состоянии без обращения к Telegram.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from httpserver import Request, Response, json_response, serve
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+HEALTH_PATH = "/healthz"
+
+
+def make_handler(application: Application, path: str, secret_token: Optional[str]):
+    """HTTP-обработчик: прием обновлений на path и health на /healthz"""
+
+    async def handle(request: Request) -> Response:
+        if request.path == HEALTH_PATH:
+            if request.method != "GET":
+                return Response(405)
+            return json_response({
+                "status": "ok" if application.running else "starting",
+                "pending_updates": application.update_queue.qsize(),
+            }, 200 if application.running else 503)
+
+        if request.path != path:
+            return Response(404)
+        if request.method != "POST":
+            return Response(405)
+
+        if secret_token is not None:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received.encode(), secret_token.encode()):
+                return Response(403)
+
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError):
+            logger.warning("Некорректное обновление в webhook")
+            return Response(400)
+
+        await application.update_queue.put(update)
+        return Response(200)
+
+    return handle
+
+
+async def run_webhook(application: Application, listen: str, port: int, path: str,
+                      secret_token: Optional[str] = None, webhook_url: Optional[str] = None,
+                      stop: Optional[asyncio.Event] = None):
+    """Запускает приложение и webhook-сервер до SIGINT/SIGTERM или stop.
+
+    Если webhook_url не задан, setWebhook не вызывается - так сервер
+    можно гонять локально, присылая записанные обновления POST-ом.
+    """
+    if stop is None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+
+    # Повторяем последовательность run_polling: initialize, post_init, start
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    if webhook_url:
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
+    await application.start()
+
+    server = await serve(make_handler(application, path, secret_token), listen, port)
+    logger.info("Webhook слушает http://%s:%d%s", listen, port, path)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)